@@ -239,6 +239,7 @@ def pasteAsTemplate(self, event=None):
         # and finally insert it at the given index
         vpar.children.insert(index, v)
         v.parents.append(vpar)
+        c.touchVnodes((v, vpar))
 
         pasted = v  # remember the first node as a return value
 
@@ -259,17 +260,20 @@ def pasteAsTemplate(self, event=None):
             # and link them
             vpar.children.append(v)
             v.parents.append(vpar)
+            c.touchVnodes([v])
 
         return pasted
     #@+node:vitalije.20200529120440.1: *4* undoHelper
     def undoHelper():
         v = vpar.children.pop(index)
         v.parents.remove(vpar)
+        c.touchVnodes((v, vpar))
         c.redraw(bunch.p)
     #@+node:vitalije.20200529120537.1: *4* redoHelper
     def redoHelper():
         vpar.children.insert(index, pasted)
         pasted.parents.append(vpar)
+        c.touchVnodes((pasted, vpar))
         c.redraw(newp)
     #@-others
     xroot = ElementTree.fromstring(g.app.gui.getTextFromClipboard())
@@ -1426,6 +1430,8 @@ def demote(self, event=None):
     for child in followingSibs:
         child.parents.remove(parent_v)
         child.parents.append(p.v)
+    c.touchVnodes((parent_v, p.v))
+    c.touchVnodes(followingSibs)
     p.expand()
     p.setDirty()
     c.setChanged()
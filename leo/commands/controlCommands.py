@@ -69,6 +69,66 @@ class ControlCommandsClass(BaseEditCommandsClass):
         that enables the plugin.
         """
         g.app.pluginsController.printPluginsInfo(self.c)
+    #@+node:ekr.20211109074852.1: *3* showImportTimes
+    @cmd('show-import-times')
+    def showImportTimes(self, event=None):
+        """
+        Print the time spent in each phase of Leo's startup, and the time
+        spent importing (and initing) each plugin, importer and writer,
+        slowest first, in the style of python -X importtime.
+
+        Importers and writers not listed have not been imported.
+        Use python -X importtime launchLeo.py for a complete report.
+        """
+        lines = ['startup times...']
+        for phase, t in g.app.startup_times.items():
+            lines.append(f"{phase:>8}: {t:5.2f} sec")
+        lines.append('import time: usec | module')
+        d = g.app.import_times
+        for name in sorted(d, key=lambda z: -d[z]):
+            lines.append(f"import time: {int(d[name] * 1e6):>8} | {name}")
+        g.es_print('\n'.join(lines))
+    #@+node:ekr.20211109082740.10: *3* perf-stats commands
+    @cmd('clear-perf-stats')
+    def clearPerfStats(self, event=None):
+        """Discard all statistics recorded by g.app.perfStats."""
+        g.app.perfStats.clear()
+        g.es('perf stats cleared')
+
+    @cmd('export-perf-stats')
+    def exportPerfStats(self, event=None):
+        """
+        Write the statistics recorded by g.app.perfStats to
+        perf-stats.json in the user's ~/.leo directory.
+        """
+        path = g.os_path_finalize_join(g.app.homeLeoDir or '.', 'perf-stats.json')
+        try:
+            g.app.perfStats.write_json(path)
+            g.es_print(f"wrote {path}")
+        except Exception:
+            g.es_print(f"can not write {path}")
+            g.es_exception()
+
+    @cmd('show-perf-stats')
+    def showPerfStats(self, event=None):
+        """
+        Print the latency (count, total, p50, p95 and max, in msec) of each
+        command, keystroke and plugin hook handler, slowest first.
+
+        @bool record-perf-stats = True enables recording at startup.
+        toggle-perf-stats enables or disables recording.
+        """
+        stats = g.app.perfStats
+        if not stats.enabled:
+            g.es_print('perf stats are disabled: use toggle-perf-stats')
+        g.es_print(stats.report())
+
+    @cmd('toggle-perf-stats')
+    def togglePerfStats(self, event=None):
+        """Enable or disable recording of command, keystroke and hook latencies."""
+        stats = g.app.perfStats
+        stats.enabled = not stats.enabled
+        g.es(f"perf stats {'enabled' if stats.enabled else 'disabled'}")
     #@+node:ekr.20150514063305.93: *3* setSilentMode
     @cmd('set-silent-mode')
     def setSilentMode(self, event=None):
@@ -292,6 +292,10 @@ class EditCommandsClass(BaseEditCommandsClass):
         """Clear all of Leo's file caches."""
         g.app.global_cacher.clear()
         g.app.commander_cacher.clear()
+        if g.app.external_files_cacher:
+            g.app.external_files_cacher.clear()
+        if g.app.settings_cacher:
+            g.app.settings_cacher.clear()
 
     @cmd('dump-caches')
     def dumpCaches(self, event=None):  # pragma: no cover
@@ -7,6 +7,8 @@
 import argparse
 import importlib
 import io
+import json
+import math
 import os
 import sqlite3
 import subprocess
@@ -155,6 +157,8 @@ class LeoApp:
         #@+node:ekr.20161028035956.1: *5* << LeoApp: global data >>
         self.atAutoNames = set()  # The set of all @auto spellings.
         self.atFileNames = set()  # The set of all built-in @<file> spellings.
+        self.import_times = {}  # Keys are module names, values are import (and init) times.
+        self.startup_times = {}  # Keys are startup phases, values are times.
         self.globalKillBuffer = []  # The global kill buffer.
         self.globalRegisters = {}  # The global register list.
         self.leoID = None  # The id part of gnx's.
@@ -179,8 +183,12 @@ class LeoApp:
             # The singleton leoConfig instance.
         self.db = None
             # The singleton global db, managed by g.app.global_cacher.
+        self.external_files_cacher = None
+            # The singleton leoCacher.ExternalFilesCacher instance.
         self.externalFilesController = None
             # The singleton ExternalFilesController instance.
+        self.settings_cacher = None
+            # The singleton leoCacher.SettingsCacher instance.
         self.global_cacher = None
             # The singleton leoCacher.GlobalCacher instance.
         self.idleTimeManager = None
@@ -195,6 +203,8 @@ class LeoApp:
             # The singleton OpenWithManager instance.
         self.nodeIndices = None
             # The singleton nodeIndices instance.
+        self.perfStats = PerfStats()
+            # The singleton PerfStats instance.
         self.pluginsController = None
             # The singleton PluginsManager instance.
         self.sessionManager = None
@@ -214,6 +224,8 @@ class LeoApp:
         self.atAutoDict = {}
             # Keys are @auto names, values are scanner classes.
         self.classDispatchDict = {}
+            # Keys are file extensions, values are scanner classes.
+        # Values in all these dicts may be LazyPluginClass instances.
         #@-<< LeoApp: global reader/writer data >>
         #@+<< LeoApp: global status vars >>
         #@+node:ekr.20161028040054.1: *5* << LeoApp: global status vars >>
@@ -1034,6 +1046,8 @@ class LeoApp:
         g.app.db = g.app.global_cacher.db
         g.app.commander_cacher = leoCache.CommanderCacher()
         g.app.commander_db = g.app.commander_cacher.db
+        g.app.external_files_cacher = leoCache.ExternalFilesCacher()
+        g.app.settings_cacher = leoCache.SettingsCacher()
     #@+node:ekr.20031218072017.1978: *4* app.setLeoID & helpers
     def setLeoID(self, useDialog=True, verbose=True):
         """Get g.app.leoID from various sources."""
@@ -1298,6 +1312,10 @@ class LeoApp:
             if g.app.commander_cacher:  # #1766.
                 g.app.commander_cacher.commit()
                 g.app.commander_cacher.close()
+            if g.app.external_files_cacher:
+                g.app.external_files_cacher.commit_and_close()
+            if g.app.settings_cacher:
+                g.app.settings_cacher.commit_and_close()
         if g.app.ipk:
             g.app.ipk.cleanup_consoles()
         g.app.destroyAllOpenWithFiles()
@@ -1596,6 +1614,10 @@ class LoadManager:
         self.theme_c = None
             # #1374.
         self.theme_path = None
+        #
+        # Importer and writer plugins.
+        self.plugins_manifest = {}
+        self.plugins_manifest_changed = False
     #@+node:ekr.20120211121736.10812: *3* LM.Directory & file utils
     #@+node:ekr.20120219154958.10481: *4* LM.completeFileName
     def completeFileName(self, fileName):
@@ -2203,6 +2225,111 @@ class LoadManager:
         for c in commanders:
             if c not in old_commanders:
                 g.app.forgetOpenFile(c.fileName())
+        lm.writeGlobalSettingsSnapshot(commanders + [lm.theme_c])
+    #@+node:ekr.20211109073419.1: *4* LM.readGlobalSettingsSnapshot & helpers
+    # The g.app.config ivars that the SettingsTreeParser sets as a side effect.
+    snapshot_config_ivars = (
+        'buttonsFileName', 'context_menus', 'enabledPluginsFileName',
+        'enabledPluginsString', 'menusFileName', 'menusList', 'modeCommandsDict',
+    )
+
+    def readGlobalSettingsSnapshot(self):
+        """
+        Set the global settings and bindings dicts from g.app.settings_cacher
+        instead of reading leoSettings.leo, myLeoSettings.leo and the theme file.
+
+        Return True if the snapshot is valid.
+        """
+        lm = self
+        cacher = g.app.settings_cacher
+        if not cacher or g.app.trace_setting or g.app.trace_binding:
+            return False
+        env = lm.computeSettingsSnapshotEnv()
+        snapshot = cacher.get(env)
+        if not snapshot:
+            return False
+        try:
+            (lm.globalSettingsDict, lm.globalBindingsDict,
+                lm.theme_path, config_d) = snapshot
+        except Exception:
+            return False
+        for ivar, val in config_d.items():
+            setattr(g.app.config, ivar, val)
+        if lm.theme_path:
+            g.app.theme_directory = g.os_path_dirname(lm.theme_path)
+        if 'startup' in g.app.debug:
+            print('using cached global settings')
+        return True
+    #@+node:ekr.20211109073556.1: *5* LM.computeSettingsSnapshotEnv & fileContains
+    def computeSettingsSnapshotEnv(self):
+        """
+        Return a dict describing everything besides the contents of the
+        settings files that can change the global settings.
+        """
+        from leo.core import leoVersion
+        lm = self
+        # Step 2 of LM.computeThemeFilePath opens the first loaded file.
+        first_file = lm.files and lm.files[0]
+        if first_file and not lm.fileContains(first_file, b'theme-name'):
+            first_file = None
+        return {
+            'first_file': first_file,
+            'leo_settings_path': lm.computeLeoSettingsPath(),
+            'machine_name': lm.computeMachineName(),
+            'my_settings_path': lm.computeMyLeoSettingsPath(),
+            'platform': sys.platform,
+            'theme_option': lm.options.get('theme_path'),
+            'version': leoVersion.version,
+        }
+
+    def fileContains(self, path, pattern, chunk_size=0x10000):
+        """
+        Return True if the file at path contains the bytes pattern.
+        Read the file in chunks so as not to hold large files in memory.
+        """
+        tail = b''
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        return False
+                    s = tail + chunk
+                    if pattern in s:
+                        return True
+                    tail = s[1 - len(pattern):]
+        except Exception:
+            return False
+    #@+node:ekr.20211109073733.1: *5* LM.writeGlobalSettingsSnapshot
+    def writeGlobalSettingsSnapshot(self, commanders):
+        """
+        Save the global settings and bindings dicts in g.app.settings_cacher.
+
+        Settings that can not be pickled, or that depend on the environment,
+        disable the snapshot.
+        """
+        lm = self
+        cacher = g.app.settings_cacher
+        config = g.app.config
+        if not cacher:
+            return
+        if config.atCommonButtonsList or config.atCommonCommandsList:
+            # These lists contain positions.
+            cacher.clear()
+            return
+        for c in commanders:
+            if c and any(p.h.startswith('@ifenv') for p in c.all_unique_positions()):
+                cacher.clear()
+                return
+        env = lm.computeSettingsSnapshotEnv()
+        paths = [env['leo_settings_path'], env['my_settings_path'],
+            lm.theme_path, env['first_file']]
+        config_d = {
+            ivar: getattr(config, ivar)
+                for ivar in self.snapshot_config_ivars if hasattr(config, ivar)
+        }
+        snapshot = (lm.globalSettingsDict, lm.globalBindingsDict, lm.theme_path, config_d)
+        cacher.put(env, paths, snapshot)
     #@+node:ekr.20120214165710.10838: *4* LM.traceSettingsDict
     def traceSettingsDict(self, d, verbose=False):
         if verbose:
@@ -2272,8 +2399,14 @@ class LoadManager:
         g.es('')  # Clears horizontal scrolling in the log pane.
         if g.app.listen_to_log_flag:
             g.app.listenToLog()
+        t4 = time.process_time()
+        g.app.startup_times = {
+            'settings': t2 - t1,
+            'plugins': t3 - t2,
+            'files': t4 - t3,
+            'total': t4 - t1,
+        }
         if 'startup' in g.app.debug:
-            t4 = time.process_time()
             print('')
             g.es_print(f"settings:{t2 - t1:5.2f} sec")
             g.es_print(f" plugins:{t3 - t2:5.2f} sec")
@@ -2443,13 +2576,15 @@ class LoadManager:
         if g.app.quit_after_load:
             localConfigFile = None
         else:
-            lm.readGlobalSettingsFiles()
-                # reads only standard settings files, using a null gui.
-                # uses lm.files[0] to compute the local directory
-                # that might contain myLeoSettings.leo.
+            if not lm.readGlobalSettingsSnapshot():
+                lm.readGlobalSettingsFiles()
+                    # reads only standard settings files, using a null gui.
+                    # uses lm.files[0] to compute the local directory
+                    # that might contain myLeoSettings.leo.
             # Read the recent files file.
             localConfigFile = lm.files[0] if lm.files else None
             g.app.recentFilesManager.readRecentFiles(localConfigFile)
+            g.app.perfStats.reloadSettings()
         # Create the gui after reading options and settings.
         lm.createGui(pymacs)
         # We can't print the signon until we know the gui.
@@ -2463,39 +2598,23 @@ class LoadManager:
         """
         assert g.app.loadDir
             # This is the only data required.
+        self.readPluginsManifest()
         self.createWritersData()
             # Was an AtFile method.
         self.createImporterData()
             # Was a LeoImportCommands method.
+        self.writePluginsManifest()
     #@+node:ekr.20140724064952.18037: *6* LM.createImporterData & helper
     def createImporterData(self):
         """Create the data structures describing importer plugins."""
-        # Allow plugins to be defined in ~/.leo/plugins.
-        plugins1 = g.os_path_finalize_join(g.app.homeDir, '.leo', 'plugins')
-        plugins2 = g.os_path_finalize_join(g.app.loadDir, '..', 'plugins')
-        for kind, plugins in (('home', plugins1), ('leo', plugins2)):
-            pattern = g.os_path_finalize_join(
-                g.app.loadDir, '..', 'plugins', 'importers', '*.py')
-            for fn in g.glob_glob(pattern):
-                sfn = g.shortFileName(fn)
-                if sfn != '__init__.py':
-                    try:
-                        module_name = sfn[:-3]
-                        # Important: use importlib to give imported modules
-                        # their fully qualified names.
-                        m = importlib.import_module(
-                            f"leo.plugins.importers.{module_name}")
-                        self.parse_importer_dict(sfn, m)
-                        # print('createImporterData', m.__name__)
-                    except Exception:
-                        g.warning(f"can not import leo.plugins.importers.{module_name}")
+        for sfn, importer_d in self.scanPluginModules('importers'):
+            self.parse_importer_dict(sfn, importer_d)
     #@+node:ekr.20140723140445.18076: *7* LM.parse_importer_dict
-    def parse_importer_dict(self, sfn, m):
+    def parse_importer_dict(self, sfn, importer_d):
         """
         Set entries in g.app.classDispatchDict, g.app.atAutoDict and
-        g.app.atAutoNames using entries in m.importer_dict.
+        g.app.atAutoNames using entries in importer_d, a module's importer_dict.
         """
-        importer_d = getattr(m, 'importer_dict', None)
         if importer_d:
             at_auto = importer_d.get('@auto', [])
             scanner_class = importer_d.get('class', None)
@@ -2529,21 +2648,8 @@ class LoadManager:
             g.app.debug_dict['createWritersData'] = True
         g.app.writersDispatchDict = {}
         g.app.atAutoWritersDict = {}
-        plugins1 = g.os_path_finalize_join(g.app.homeDir, '.leo', 'plugins')
-        plugins2 = g.os_path_finalize_join(g.app.loadDir, '..', 'plugins')
-        for kind, plugins in (('home', plugins1), ('leo', plugins2)):
-            pattern = g.os_path_finalize_join(g.app.loadDir,
-                '..', 'plugins', 'writers', '*.py')
-            for fn in g.glob_glob(pattern):
-                sfn = g.shortFileName(fn)
-                if sfn != '__init__.py':
-                    try:
-                        # Important: use importlib to give imported modules their fully qualified names.
-                        m = importlib.import_module(f"leo.plugins.writers.{sfn[:-3]}")
-                        self.parse_writer_dict(sfn, m)
-                    except Exception:
-                        g.es_exception()
-                        g.warning(f"can not import leo.plugins.writers.{sfn}")
+        for sfn, writer_d in self.scanPluginModules('writers'):
+            self.parse_writer_dict(sfn, writer_d)
         if trace:
             g.trace('LM.writersDispatchDict')
             g.printDict(g.app.writersDispatchDict)
@@ -2551,12 +2657,11 @@ class LoadManager:
             g.printDict(g.app.atAutoWritersDict)
         # Creates problems: See #40.
     #@+node:ekr.20140728040812.17991: *7* LM.parse_writer_dict
-    def parse_writer_dict(self, sfn, m):
+    def parse_writer_dict(self, sfn, writer_d):
         """
         Set entries in g.app.writersDispatchDict and g.app.atAutoWritersDict
-        using entries in m.writers_dict.
+        using entries in writer_d, a module's writer_dict.
         """
-        writer_d = getattr(m, 'writer_dict', None)
         if writer_d:
             at_auto = writer_d.get('@auto', [])
             scanner_class = writer_d.get('class', None)
@@ -2569,7 +2674,7 @@ class LoadManager:
                     if aClass and aClass != scanner_class:
                         g.trace(
                             f"{sfn}: duplicate {s} class {aClass.__name__} "
-                            f"in {m.__file__}:")
+                            f"in leo/plugins/writers/{sfn}:")
                     else:
                         d[s] = scanner_class
                         g.app.atAutoNames.add(s)
@@ -2584,6 +2689,121 @@ class LoadManager:
                         d[ext] = scanner_class
         elif sfn not in ('basewriter.py',):
             g.warning(f"leo/plugins/writers/{sfn} has no writer_dict")
+    #@+node:ekr.20211109074047.1: *6* LM.scanPluginModules & helpers
+    def scanPluginModules(self, kind):
+        """
+        Return a list of (sfn, d) for all modules in leo/plugins/<kind>, where
+        kind is 'importers' or 'writers' and d is the module's importer_dict
+        or writer_dict.
+
+        Modules whose entry in the plugins manifest is up to date are *not*
+        imported: the 'class' entry of d is a LazyPluginClass.
+        """
+        lm = self
+        dict_name = 'importer_dict' if kind == 'importers' else 'writer_dict'
+        manifest = lm.plugins_manifest.setdefault(kind, {})
+        pattern = g.os_path_finalize_join(g.app.loadDir, '..', 'plugins', kind, '*.py')
+        result = []
+        for fn in sorted(g.glob_glob(pattern)):
+            sfn = g.shortFileName(fn)
+            if sfn == '__init__.py':
+                continue
+            module_name = f"leo.plugins.{kind}.{sfn[:-3]}"
+            stamp = lm.computePluginStamp(fn)
+            entry = manifest.get(sfn)
+            if entry and entry.get('stamp') == stamp:
+                d = entry.get('dict')
+                if d:
+                    d = dict(d)
+                    d['class'] = LazyPluginClass(module_name, d['class'])
+                result.append((sfn, d))
+                continue
+            try:
+                # Important: use importlib to give imported modules their fully qualified names.
+                t1 = time.perf_counter()
+                m = importlib.import_module(module_name)
+                g.app.import_times[module_name] = time.perf_counter() - t1
+            except Exception:
+                g.es_exception()
+                g.warning(f"can not import {module_name}")
+                manifest.pop(sfn, None)
+                continue
+            d = getattr(m, dict_name, None)
+            entry = lm.computePluginsManifestEntry(m, d)
+            if entry is not None:
+                manifest[sfn] = dict(stamp=stamp, dict=entry)
+            else:
+                manifest.pop(sfn, None)
+            lm.plugins_manifest_changed = True
+            result.append((sfn, d))
+        return result
+    #@+node:ekr.20211109074224.1: *7* LM.computePluginStamp
+    def computePluginStamp(self, fn):
+        """Return [mtime, size] for the given file."""
+        try:
+            st = os.stat(fn)
+            return [st.st_mtime, st.st_size]
+        except Exception:
+            return None
+    #@+node:ekr.20211109074401.1: *7* LM.computePluginsManifestEntry
+    def computePluginsManifestEntry(self, m, d):
+        """
+        Return the plugins manifest entry for module m, whose importer_dict
+        or writer_dict is d.
+
+        Return None if m must be imported at startup.
+        """
+        if not d:
+            return {}
+        aClass = d.get('class')
+        name = getattr(aClass, '__name__', None)
+        if not name or getattr(m, name, None) is not aClass:
+            return None
+        if set(d.keys()) - {'@auto', 'class', 'extensions'}:
+            return None
+        return {
+            '@auto': list(d.get('@auto', [])),
+            'class': name,
+            'extensions': list(d.get('extensions', [])),
+        }
+    #@+node:ekr.20211109074538.1: *6* LM.read/writePluginsManifest
+    plugins_manifest_version = 1
+
+    def computePluginsManifestPath(self):
+        """Return the path to the plugins manifest, or None."""
+        if not g.app.homeLeoDir:
+            return None
+        return g.os_path_finalize_join(g.app.homeLeoDir, 'db', 'plugins_manifest.json')
+
+    def readPluginsManifest(self):
+        """Set lm.plugins_manifest from ~/.leo/db/plugins_manifest.json."""
+        lm = self
+        lm.plugins_manifest, lm.plugins_manifest_changed = {}, False
+        path = lm.computePluginsManifestPath()
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                d = json.load(f)
+            if d.get('version') == lm.plugins_manifest_version:
+                lm.plugins_manifest = d
+        except Exception:
+            pass  # Recreate the manifest.
+
+    def writePluginsManifest(self):
+        """Write lm.plugins_manifest if it has changed."""
+        lm = self
+        path = lm.computePluginsManifestPath()
+        if not path or not lm.plugins_manifest_changed:
+            return
+        lm.plugins_manifest['version'] = lm.plugins_manifest_version
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(lm.plugins_manifest, f, indent=1, sort_keys=True)
+            lm.plugins_manifest_changed = False
+        except Exception:
+            g.es_print(f"can not write {path}")
     #@+node:ekr.20120219154958.10478: *5* LM.createGui
     def createGui(self, pymacs):
         lm = self
@@ -3280,6 +3500,178 @@ class LoadManager:
             c.fileCommands.getLeoFile(theFile, fn, checkOpenFiles=False)
                 # Closes the file.
     #@-others
+#@+node:ekr.20211109074715.1: ** class LazyPluginClass
+class LazyPluginClass:
+    """
+    A stand-in for the class in an importer or writer plugin.
+
+    LM.scanPluginModules creates these from the plugins manifest.
+    The plugin's module is imported only when the class is first called.
+    """
+
+    def __init__(self, module_name, class_name):
+        self.module_name = module_name
+        self.class_name = class_name
+        self.__name__ = class_name
+        self.aClass = None
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyPluginClass):
+            return (self.module_name, self.class_name) == (other.module_name, other.class_name)
+        return self.resolve() == other
+
+    def __hash__(self):
+        return hash((self.module_name, self.class_name))
+
+    def __repr__(self):
+        return f"<LazyPluginClass {self.module_name}.{self.class_name}>"
+
+    def resolve(self):
+        """Import the module, if necessary, and return the actual class."""
+        if self.aClass is None:
+            t1 = time.perf_counter()
+            m = importlib.import_module(self.module_name)
+            g.app.import_times.setdefault(self.module_name, time.perf_counter() - t1)
+            self.aClass = getattr(m, self.class_name)
+        return self.aClass
+#@+node:ekr.20211109082740.1: ** class LatencyHistogram
+class LatencyHistogram:
+    """
+    A log-scale histogram of latencies, in seconds.
+
+    Each power of two is split into eight buckets, so percentiles are
+    accurate to within 12.5% no matter how many samples are added, and
+    memory is bounded by the range of the samples, not their number.
+    """
+
+    def __init__(self):
+        self.buckets = {}  # Keys are bucket indices, values are counts.
+        self.count = 0
+        self.max = 0.0
+        self.total = 0.0
+
+    #@+others
+    #@+node:ekr.20211109082740.2: *3* hist.add
+    def add(self, t):
+        """Add one sample, in seconds."""
+        self.count += 1
+        self.total += t
+        if t > self.max:
+            self.max = t
+        m, e = math.frexp(t or 1e-9)  # t == m * 2**e, with 0.5 <= m < 1.
+        i = 8 * e + int((m - 0.5) * 16)
+        self.buckets[i] = self.buckets.get(i, 0) + 1
+    #@+node:ekr.20211109082740.3: *3* hist.percentile
+    def percentile(self, q):
+        """Return an upper bound for the q'th percentile, with 0 < q <= 100."""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(self.count * q / 100))
+        n = 0
+        for i in sorted(self.buckets):
+            n += self.buckets[i]
+            if n >= target:
+                return min(self.max, self.upper_bound(i))
+        return self.max
+    #@+node:ekr.20211109082740.4: *3* hist.to_dict & upper_bound
+    def to_dict(self):
+        """Return a json-compatible dict describing this histogram, in msec."""
+        ms = 1000.0
+        return {
+            'count': self.count,
+            'total_ms': self.total * ms,
+            'p50_ms': self.percentile(50) * ms,
+            'p95_ms': self.percentile(95) * ms,
+            'max_ms': self.max * ms,
+            # Keys are the upper bounds of the buckets.
+            'buckets': {
+                f"{self.upper_bound(i) * ms:.6g}": self.buckets[i]
+                    for i in sorted(self.buckets)
+            },
+        }
+
+    def upper_bound(self, i):
+        """Return the largest time in bucket i."""
+        e, sub = divmod(i, 8)
+        return (0.5 + (sub + 1) / 16) * 2.0 ** e
+    #@-others
+#@+node:ekr.20211109082740.5: ** class PerfStats
+class PerfStats:
+    """
+    The singleton g.app.perfStats: opt-in latency histograms.
+
+    When enabled, c.doCommand records the time taken by each command
+    (including its command1/command2 hooks), k.masterKeyHandler the time
+    taken by each keystroke, and plugins.callTagHandler the time taken by
+    each plugin's hook handler. When disabled, each site costs one test.
+
+    @bool record-perf-stats enables recording at startup.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        # Keys are kinds, values are dicts.
+        # Keys of the inner dicts are names, values are LatencyHistograms.
+        self.tables = {'commands': {}, 'hooks': {}, 'keys': {}}
+
+    #@+others
+    #@+node:ekr.20211109082740.6: *3* perf.reloadSettings
+    def reloadSettings(self):
+        if g.app.config.getBool('record-perf-stats', default=False):
+            self.enabled = True
+    #@+node:ekr.20211109082740.7: *3* perf.clear & record
+    def clear(self):
+        """Discard all recorded statistics."""
+        for d in self.tables.values():
+            d.clear()
+
+    def record(self, kind, name, t):
+        """Add t, a time in seconds, to the histogram for the given kind and name."""
+        d = self.tables[kind]
+        hist = d.get(name)
+        if hist is None:
+            hist = d[name] = LatencyHistogram()
+        hist.add(t)
+    #@+node:ekr.20211109082740.8: *3* perf.report
+    def report(self, n=None):
+        """
+        Return a report of the recorded statistics, in msec.
+        Each table is sorted by total time, largest first.
+        n: the maximum number of rows of each table, or None.
+        """
+        lines = []
+        for kind, d in self.tables.items():
+            if not d:
+                continue
+            names = sorted(d, key=lambda z: -d[z].total)[:n]
+            width = max(len(z) for z in names)
+            lines.append(
+                f"{kind + ':':<{width}} {'count':>7} {'total':>9} "
+                f"{'p50':>8} {'p95':>8} {'max':>8}")
+            for name in names:
+                h = d[name]
+                lines.append(
+                    f"{name:<{width}} {h.count:7} {h.total * 1000:9.1f} "
+                    f"{h.percentile(50) * 1000:8.2f} {h.percentile(95) * 1000:8.2f} "
+                    f"{h.max * 1000:8.2f}")
+            lines.append('')
+        return '\n'.join(lines) if lines else 'no performance statistics'
+    #@+node:ekr.20211109082740.9: *3* perf.to_json & write_json
+    def to_json(self):
+        """Return a json-compatible dict of all recorded statistics."""
+        return {
+            kind: {name: hist.to_dict() for name, hist in d.items()}
+                for kind, d in self.tables.items()
+        }
+
+    def write_json(self, path):
+        """Write all recorded statistics to the given path, as json."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_json(), f, indent=2, sort_keys=True)
+    #@-others
 #@+node:ekr.20120223062418.10420: ** class PreviousSettings
 class PreviousSettings:
     """
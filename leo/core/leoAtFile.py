@@ -5,14 +5,19 @@
 """Classes to read and write @file nodes."""
 #@+<< imports >>
 #@+node:ekr.20041005105605.2: ** << imports >> (leoAtFile.py)
+from concurrent import futures
+import hashlib
 import io
 import os
 import re
+import shutil
 import sys
 import tabnanny
+import tempfile
 import time
 import tokenize
 from typing import List
+import zlib
 from leo.core import leoGlobals as g
 from leo.core import leoNodes
 #@-<< imports >>
@@ -64,6 +69,18 @@ class AtFile:
         self.checkPythonCodeOnWrite = False
         self.runPyFlakesOnWrite = False
         self.underindentEscapeString = '\\-'
+        self.useExternalFilesCache = True
+        self.lazyBodies = False
+        self.readWorkers = 0
+        # For at.prefetchFiles. Keys are full paths, values are (contents, data, cached).
+        self.prefetchedFiles = {}
+        self.writeWorkers = 0
+        # For at.flushPendingWrites: None, or a list of g.Bunches.
+        self.pendingWrites = None
+        # For at.subtreeIsUnchanged.
+        # Keys are real paths, values are (subtree hash, file stamp).
+        self.subtreeHash = None
+        self.writeHashes = {}
         self.reloadSettings()
     #@+node:ekr.20171113152939.1: *5* at.reloadSettings
     def reloadSettings(self):
@@ -75,6 +92,13 @@ class AtFile:
             'run-pyflakes-on-write', default=False)
         self.underindentEscapeString = c.config.getString(
             'underindent-escape-string') or '\\-'
+        self.useExternalFilesCache = c.config.getBool(
+            'cache-external-files', default=True)
+        self.lazyBodies = c.config.getBool('lazy-external-file-bodies', default=False)
+        self.readWorkers = c.config.getInt('read-external-files-workers') or 0
+        self.writeWorkers = c.config.getInt('write-external-files-workers') or 0
+        # Settings affect what Leo writes.
+        self.writeHashes = {}
     #@+node:ekr.20041005105605.10: *4* at.initCommonIvars
     def initCommonIvars(self):
         """
@@ -300,7 +324,15 @@ class AtFile:
         at.fromString = fromString
         if at.errors:
             return False  # pragma: no cover
-        fileName, file_s = at.openFileForReading(fromString=fromString)
+        prefetched = None if fromString else at.prefetchedFiles.pop(fileName, None)
+        if prefetched:
+            # at.prefetchFiles has already read the file.
+            file_s, prefetched_data, cached = prefetched
+            at.setPathUa(root, fileName)
+            at.warnOnReadOnlyFile(fileName)
+        else:
+            fileName, file_s = at.openFileForReading(fromString=fromString)
+            prefetched_data, cached = None, False
         # #1798:
         if file_s is None:
             return False  # pragma: no cover
@@ -321,7 +353,23 @@ class AtFile:
                 # at.tab_width
         gnx2vnode = c.fileCommands.gnxDict
         contents = fromString or file_s
-        FastAtRead(c, gnx2vnode).read_into_root(contents, fileName, root)
+        fast_read = FastAtRead(c, gnx2vnode)
+        # Compute the bodies of real files only when needed.
+        fast_read.lazy = at.lazyBodies and not fromString
+        # Use the external files cache only for real files with non-lazy bodies.
+        use_cache = at.useExternalFilesCache and not fromString and not fast_read.lazy
+        cacher = g.app.external_files_cacher if use_cache else None
+        data = prefetched_data or (cacher.get(fileName, contents) if cacher else None)
+        if data:
+            nodes, bodies = data
+            fast_read.read_from_cache(nodes, bodies, fileName, root)
+            if prefetched_data and cacher and not cached:
+                # A cache miss: at.prefetchFiles scanned the file.
+                cacher.put(fileName, contents, nodes, bodies)
+        elif fast_read.read_into_root(contents, fileName, root):
+            if cacher and fast_read.cache_data:
+                nodes, bodies = fast_read.cache_data
+                cacher.put(fileName, contents, nodes, bodies)
         root.clearDirty()
         return True
     #@+node:ekr.20100122130101.6174: *6* at.deleteTnodeList
@@ -358,8 +406,13 @@ class AtFile:
         t1 = time.time()
         c.init_error_dialogs()
         files = at.findFilesToRead(force, root)
-        for p in files:
-            at.readFileAtPosition(force, p)
+        if at.readWorkers > 1 and len(files) > 1 and not at.lazyBodies:
+            at.prefetchFiles(files)
+        try:
+            for p in files:
+                at.readFileAtPosition(force, p)
+        finally:
+            at.prefetchedFiles = {}
         for p in files:
             p.v.clearDirty()
         if not g.unitTesting:  # pragma: no cover
@@ -408,6 +461,73 @@ class AtFile:
             else:
                 p.moveToThreadNext()
         return files
+    #@+node:ekr.20211109053308.1: *6* at.prefetchFiles & helper
+    def prefetchFiles(self, files):
+        """
+        Read and parse the @file and @thin nodes in the files list using a pool
+        of at.readWorkers worker threads, setting at.prefetchedFiles.
+
+        Workers read and scan the files. They never create or change vnodes:
+        the main thread decodes the files exactly as at.readFileToUnicode does,
+        and at.read links the results into the outline.
+        """
+        at, c = self, self.c
+        gnx2vnode = c.fileCommands.gnxDict
+        cacher = g.app.external_files_cacher if at.useExternalFilesCache else None
+        roots = {}  # Keys are full paths, values are positions.
+        for p in files:
+            if p.isAtThinFileNode() or p.isAtFileNode():
+                fileName = g.fullPath(c, p)
+                if fileName and fileName not in roots:
+                    roots[fileName] = p.copy()
+        if not roots:
+            return
+
+        def parse(fileName, contents):
+            fast_read = FastAtRead(c, gnx2vnode)
+            fast_read.messages = []
+            try:
+                ok, data = fast_read.parse(contents, fileName, roots[fileName])
+            except Exception:
+                # at.read will read the file again and report any errors.
+                ok, data = False, None
+            return fast_read, (data if ok else None)
+
+        with futures.ThreadPoolExecutor(max_workers=at.readWorkers) as executor:
+            # Pass 1: read all files.
+            bytes_d = dict(zip(roots, executor.map(at.readFileInThread, roots)))
+            # Decode the files and look for unchanged files in the main thread.
+            contents_d, to_parse = {}, []
+            for fileName, b in bytes_d.items():
+                if b is None:
+                    continue  # at.read will report the error.
+                at.initReadIvars(roots[fileName], fileName)
+                contents = contents_d[fileName] = at.decodeFileContents(fileName, b)
+                data = cacher.get(fileName, contents) if cacher else None
+                if data:
+                    at.prefetchedFiles[fileName] = contents, data, True
+                else:
+                    to_parse.append(fileName)
+            # Pass 2: scan the sentinels of all changed files.
+            results = executor.map(parse, to_parse, [contents_d[z] for z in to_parse])
+            for fileName, (fast_read, data) in zip(to_parse, results):
+                fast_read.report_messages()
+                if data:
+                    at.prefetchedFiles[fileName] = contents_d[fileName], data, False
+    #@+node:ekr.20211109053445.1: *7* at.readFileInThread
+    @staticmethod
+    def readFileInThread(fileName):
+        """
+        Return the contents of the given file as bytes, or None.
+
+        Like at.openFileHelper, but safe to call from a worker thread:
+        this method neither reports errors nor changes any ivars.
+        """
+        try:
+            with open(fileName, 'rb') as f:
+                return f.read()
+        except Exception:
+            return None
     #@+node:ekr.20190108054803.1: *6* at.readFileAtPosition
     def readFileAtPosition(self, force, p):  # pragma: no cover
         """Read the @<file> node at p."""
@@ -737,6 +857,14 @@ class AtFile:
         # #1798.
         if s is None:
             return None
+        return at.decodeFileContents(fileName, s)
+    #@+node:ekr.20211109083231.1: *6* at.decodeFileContents
+    def decodeFileContents(self, fileName, s):
+        """
+        Set at.encoding as described in at.readFileToUnicode and return the
+        bytes s converted to a unicode string.
+        """
+        at = self
         e, s = g.stripBOM(s)
         if e:
             # The BOM determines the encoding unambiguously.
@@ -977,11 +1105,18 @@ class AtFile:
         at.cancelFlag = False
         at.yesToAll = False
         files, root = at.findFilesToWrite(all)
-        for p in files:
-            try:
-                at.writeAllHelper(p, root)
-            except Exception:
-                at.internalWriteError(p)
+        if at.writeWorkers > 1 and len(files) > 1:
+            # Compute all contents, then write them in worker threads.
+            at.pendingWrites = []
+        try:
+            for p in files:
+                try:
+                    at.writeAllHelper(p, root)
+                except Exception:
+                    at.internalWriteError(p)
+            at.flushPendingWrites()
+        finally:
+            at.pendingWrites = None
         # Make *sure* these flags are cleared for other commands.
         at.canCancelFlag = False
         at.cancelFlag = False
@@ -1099,6 +1234,15 @@ class AtFile:
             at.writePathChanged(p)
         except IOError:
             return
+        if at.subtreeIsUnchanged(p):
+            # Leo wrote exactly this subtree to the unchanged file.
+            at.unchangedFiles += 1
+            if not g.unitTesting and at.c.config.getBool(
+                'report-unchanged-files', default=True):
+                g.es(f"unchanged: {g.shortFileName(p.anyAtFileNodeName())}")  # pragma: no cover
+            for p2 in p.self_and_subtree(copy=False):
+                p2.v.clearDirty()
+            return
         table = (
             (p.isAtAsisFileNode, at.asisWrite),
             (p.isAtAutoNode, at.writeOneAtAutoNode),
@@ -1109,18 +1253,70 @@ class AtFile:
             (p.isAtShadowFileNode, at.writeOneAtShadowNode),
             (p.isAtThinFileNode, at.writeOneAtFileNode),
         )
-        for pred, func in table:
-            if pred():
-                func(p)  # type:ignore
-                break
-        else:  # pragma: no cover
-            g.trace(f"Can not happen: {p.h}")
-            return
+        try:
+            for pred, func in table:
+                if pred():
+                    func(p)  # type:ignore
+                    break
+            else:  # pragma: no cover
+                g.trace(f"Can not happen: {p.h}")
+                return
+        finally:
+            at.subtreeHash = None
         #
         # Clear the dirty bits in all descendant nodes.
         # The persistence data may still have to be written.
         for p2 in p.self_and_subtree(copy=False):
             p2.v.clearDirty()
+    #@+node:ekr.20211109060214.1: *7* at.computeSubtreeHash
+    def computeSubtreeHash(self, p, fileName):
+        """
+        Return a hash of everything in p's tree that affects the file written
+        from p: the outline structure, all headlines and body text, and the
+        directives in effect at p.
+        """
+        c = self.c
+        h = hashlib.sha1()
+        for s in (fileName, repr(g.get_directives_dict_list(p)), c.config.output_initial_comment or ''):
+            h.update(s.encode('utf-8', 'replace'))
+            h.update(b'\0')
+        base = p.level()
+        for p2 in p.self_and_subtree(copy=False):
+            for s in (str(p2.level() - base), p2.gnx, p2.h, p2.b):
+                h.update(s.encode('utf-8', 'replace'))
+                h.update(b'\0')
+        return h.hexdigest()
+    #@+node:ekr.20211109060351.1: *7* at.subtreeIsUnchanged
+    def subtreeIsUnchanged(self, p):
+        """
+        Return True if at.replaceFile has already written p's tree, unchanged,
+        to p's external file, and the file has not changed since then.
+
+        Set at.subtreeHash so that at.replaceFile can remember the hash.
+        """
+        at, c = self, self.c
+        at.subtreeHash = None
+        c.endEditing()
+        # @auto and @shadow files don't (just) depend on the subtree.
+        if p.isAtAutoNode() or p.isAtShadowFileNode():
+            return False
+        fileName = g.os_path_realpath(g.fullPath(c, p))
+        if not fileName:
+            return False  # pragma: no cover
+        at.subtreeHash = at.computeSubtreeHash(p, fileName)
+        data = at.writeHashes.get(fileName)
+        return bool(
+            data and data[0] == at.subtreeHash
+            and data[1] == at.fileStamp(fileName))
+    #@+node:ekr.20211109060528.1: *7* at.fileStamp
+    @staticmethod
+    def fileStamp(fileName):
+        """Return (mtime, size) for the given file, or None."""
+        try:
+            st = os.stat(fileName)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
     #@+node:ekr.20190108105509.1: *7* at.writePathChanged
     def writePathChanged(self, p):  # pragma: no cover
         """
@@ -2519,6 +2715,9 @@ class AtFile:
         """
         Write or create the given file from the contents.
         Return True if the original file was changed.
+
+        If at.pendingWrites is a list, defer all file operations to
+        at.flushPendingWrites and return False.
         """
         at, c = self, self.c
         if root:
@@ -2535,65 +2734,167 @@ class AtFile:
         assert isinstance(contents, str), g.callers()
         if at.output_newline != '\n':  # pragma: no cover
             contents = contents.replace('\r', '').replace('\n', at.output_newline)
+        job = g.Bunch(
+            contents=contents,
+            encoding=encoding,
+            explicitLineEnding=at.explicitLineEnding,
+            fileName=g.os_path_realpath(fileName),
+            ignoreBlankLines=ignoreBlankLines,
+            root=root and root.copy(),
+            subtreeHash=at.subtreeHash,
+            timestamp=timestamp,
+        )
+        if at.pendingWrites is not None:
+            at.pendingWrites.append(job)
+            return False
+        return at.finishReplaceFile(job, at.writeJob(job))
+    #@+node:ekr.20211109060705.1: *6* at.flushPendingWrites
+    def flushPendingWrites(self):
+        """
+        Write all files in at.pendingWrites using at.writeWorkers worker threads.
+
+        The threads only compare and write files. All other work, including
+        all messages, happens in the main thread.
+        """
+        at = self
+        jobs, at.pendingWrites = at.pendingWrites, None
+        if not jobs:
+            return
+        with futures.ThreadPoolExecutor(max_workers=at.writeWorkers) as executor:
+            results = list(executor.map(at.writeJob, jobs))
+        for job, result in zip(jobs, results):
+            at.finishReplaceFile(job, result)
+    #@+node:ekr.20211109060842.1: *6* at.writeJob
+    def writeJob(self, job):
+        """
+        Compare job.contents with job.fileName, writing the file if it has changed.
+        Return one of ('created', 'unchanged', 'wrote', 'wrote-line-endings',
+        'read-only', 'error').
+
+        This method may run in a worker thread: it must not change Leo's state.
+        """
+        at = self
+        contents, encoding, fileName = job.contents, job.encoding, job.fileName
         #
         # If file does not exist, create it from the contents.
-        fileName = g.os_path_realpath(fileName)
-        sfn = g.shortFileName(fileName)
         if not g.os_path_exists(fileName):
             ok = g.writeFile(contents, encoding, fileName)
-            if ok:
-                c.setFileTimeStamp(fileName)
-                if not g.unitTesting:
-                    g.es(f"{timestamp}created: {fileName}")  # pragma: no cover
-                if root:
-                    # Fix bug 889175: Remember the full fileName.
-                    at.rememberReadPath(fileName, root)
-                    at.checkPythonCode(contents, fileName, root)
-            else:
-                at.addToOrphanList(root)   # pragma: no cover
-            # No original file to change. Return value tested by a unit test.
-            return False  # No change to original file.
+            return 'created' if ok else 'error'
         #
         # Compare the old and new contents.
         old_contents = g.readFileIntoUnicodeString(fileName,
-            encoding=at.encoding, silent=True)
+            encoding=encoding, silent=True)
         if not old_contents:
             old_contents = ''
         unchanged = (
             contents == old_contents
-            or (not at.explicitLineEnding and at.compareIgnoringLineEndings(old_contents, contents))
-            or ignoreBlankLines and at.compareIgnoringBlankLines(old_contents, contents))
+            or (not job.explicitLineEnding and at.compareIgnoringLineEndings(old_contents, contents))
+            or job.ignoreBlankLines and at.compareIgnoringBlankLines(old_contents, contents))
         if unchanged:
-            at.unchangedFiles += 1
-            if not g.unitTesting and c.config.getBool(
-                'report-unchanged-files', default=True):
-                g.es(f"{timestamp}unchanged: {sfn}")  # pragma: no cover
-            # Leo 5.6: Check unchanged files.
-            at.checkPythonCode(contents, fileName, root, pyflakes_errors_only=True)
-            return False  # No change to original file.
+            return 'unchanged'
+        #
+        # Write a changed file.
+        if not os.access(fileName, os.W_OK):
+            return 'read-only'
+        if not at.writeFileAtomically(contents, encoding, fileName):
+            return 'error'  # pragma: no cover
         #
         # Warn if we are only adjusting the line endings.
-        if at.explicitLineEnding:  # pragma: no cover
+        if job.explicitLineEnding:  # pragma: no cover
             ok = (
                 at.compareIgnoringLineEndings(old_contents, contents) or
-                ignoreBlankLines and at.compareIgnoringLineEndings(
+                job.ignoreBlankLines and at.compareIgnoringLineEndings(
                 old_contents, contents))
             if not ok:
-                g.warning("correcting line endings in:", fileName)
-        #
-        # Write a changed file.
-        ok = g.writeFile(contents, encoding, fileName)
-        if ok:
+                return 'wrote-line-endings'
+        return 'wrote'
+    #@+node:ekr.20211109061019.1: *6* at.writeFileAtomically
+    @staticmethod
+    def writeFileAtomically(contents, encoding, fileName):
+        """
+        Replace an existing file by writing the contents to a temp file in the
+        same directory, then renaming the temp file. Return True if all went well.
+
+        Files with several hard links are written in place: renaming would
+        leave the other links pointing to the old contents.
+        """
+        if isinstance(contents, str):
+            contents = g.toEncodedString(contents, encoding=encoding)
+        try:
+            if os.stat(fileName).st_nlink > 1:
+                return g.writeFile(contents, encoding, fileName)
+        except OSError:  # pragma: no cover
+            pass
+        directory, name = os.path.split(fileName)
+        tempName = None
+        try:
+            fd, tempName = tempfile.mkstemp(prefix=f".{name}.", dir=directory or None)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(contents)
+            shutil.copymode(fileName, tempName)
+            os.replace(tempName, fileName)
+            return True
+        except Exception:  # pragma: no cover
+            if tempName and os.path.exists(tempName):
+                os.remove(tempName)
+            # Fall back to writing the file in place.
+            return g.writeFile(contents, encoding, fileName)
+    #@+node:ekr.20211109061156.1: *6* at.finishReplaceFile
+    def finishReplaceFile(self, job, result):
+        """
+        Report the result of at.writeJob and update Leo's state.
+        Return True if the original file was changed.
+        """
+        at, c = self, self.c
+        contents, fileName, root = job.contents, job.fileName, job.root
+        sfn, timestamp = g.shortFileName(fileName), job.timestamp
+        if result == 'created':
             c.setFileTimeStamp(fileName)
+            at.rememberSubtreeHash(job)
             if not g.unitTesting:
-                g.es(f"{timestamp}wrote: {sfn}")  # pragma: no cover
-        else:  # pragma: no cover
-            g.error('error writing', sfn)
-            g.es('not written:', sfn)
-            at.addToOrphanList(root)
+                g.es(f"{timestamp}created: {fileName}")  # pragma: no cover
+            if root:
+                # Fix bug 889175: Remember the full fileName.
+                at.rememberReadPath(fileName, root)
+                at.checkPythonCode(contents, fileName, root)
+            # No original file to change. Return value tested by a unit test.
+            return False  # No change to original file.
+        if result == 'unchanged':
+            at.unchangedFiles += 1
+            at.rememberSubtreeHash(job)
+            if not g.unitTesting and c.config.getBool(
+                'report-unchanged-files', default=True):
+                g.es(f"{timestamp}unchanged: {sfn}")  # pragma: no cover
+            # Leo 5.6: Check unchanged files.
+            at.checkPythonCode(contents, fileName, root, pyflakes_errors_only=True)
+            return False  # No change to original file.
+        if result == 'read-only':  # pragma: no cover
+            g.es('read only:', repr(fileName), color='red')
+            if root:
+                at.addToOrphanList(root)
+            return False
+        if result == 'error':  # pragma: no cover
+            if g.os_path_exists(fileName):
+                g.error('error writing', sfn)
+                g.es('not written:', sfn)
+            if root:
+                at.addToOrphanList(root)
+            return False
+        if result == 'wrote-line-endings':  # pragma: no cover
+            g.warning("correcting line endings in:", fileName)
+        c.setFileTimeStamp(fileName)
+        at.rememberSubtreeHash(job)
+        if not g.unitTesting:
+            g.es(f"{timestamp}wrote: {sfn}")  # pragma: no cover
         at.checkPythonCode(contents, fileName, root)
             # Check *after* writing the file.
-        return ok
+        return True
+    #@+node:ekr.20211109061333.1: *6* at.rememberSubtreeHash
+    def rememberSubtreeHash(self, job):
+        """Remember the subtree hash for at.subtreeIsUnchanged."""
+        at = self
+        if job.subtreeHash:
+            at.writeHashes[job.fileName] = job.subtreeHash, at.fileStamp(job.fileName)
     #@+node:ekr.20190114061452.27: *6* at.compareIgnoringBlankLines
     def compareIgnoringBlankLines(self, s1, s2):  # pragma: no cover
         """Compare two strings, ignoring blank lines."""
@@ -2821,7 +3122,7 @@ class AtFile:
         v = p.v
         # Fix bug #50: body text lost switching @file to @auto-rst
         if not hasattr(v, 'at_read'):
-            v.at_read = {}  # pragma: no cover
+            v.at_read = {}
         d = v.at_read
         aSet = d.get(fn, set())
         aSet.add(p.h)
@@ -2969,6 +3270,10 @@ class FastAtRead:
         self.c = c
         assert gnx2vnode is not None
         self.gnx2vnode = gnx2vnode # The global fc.gnxDict. Keys are gnx's, values are vnodes.
+        self.cache_data = None  # (nodes, bodies) for g.app.external_files_cacher.
+        self.lazy = False  # True: compute only the root's body. See LazyBodies.
+        self.directive_lines = {}  # Set by scan_lines when self.lazy is True. See LazyBodies.
+        self.messages = None  # Not None: a list of deferred (message, color) tuples.
         self.path = None
         self.root = None
         # compiled patterns...
@@ -2984,6 +3289,23 @@ class FastAtRead:
         self.others_pat = None
         self.ref_pat = None   
         self.section_delims_pat = None
+    #@+node:ekr.20211109053131.1: *3* fast_at.es_print & report_messages
+    def es_print(self, message, color=None):
+        """
+        Print the message, or defer it if fast_at.messages is a list.
+
+        Worker threads must not write to Leo's log pane.
+        """
+        if self.messages is None:
+            g.es_print(message, color=color)
+        else:
+            self.messages.append((message, color),)
+
+    def report_messages(self):
+        """Print all deferred messages. Must be called in the main thread."""
+        for message, color in self.messages or []:
+            g.es_print(message, color=color)
+        self.messages = None
     #@+node:ekr.20180602103135.3: *3* fast_at.get_patterns
     #@@nobeautify
 
@@ -3043,20 +3365,25 @@ class FastAtRead:
         return None  # pragma: no cover (defensive)
     #@+node:ekr.20180602103135.8: *3* fast_at.scan_lines
     def scan_lines(self, comment_delims, first_lines, lines, path, start):
-        """Scan all lines of the file, creating vnodes."""
+        """
+        Scan all lines of the file.
+
+        Return (nodes, bodies), suitable for fast_at.create_vnodes, or None.
+
+        This method neither creates nor changes vnodes, so it may run in a
+        worker thread. See at.prefetchFiles.
+        """
         #@+<< init scan_lines >>
         #@+node:ekr.20180602103135.9: *4* << init scan_lines >>
         #
         # Simple vars...
         afterref = False  # True: the next line follows @afterref.
-        clone_v = None  # The root of the clone tree.
         comment_delim1, comment_delim2 = comment_delims  # The start/end *comment* delims.
         doc_skip = (comment_delim1 + '\n', comment_delim2 + '\n')  # To handle doc parts.
         first_i = 0  # Index into first array.
         in_doc = False  # True: in @doc parts.
         is_cweb = comment_delim1 == '@q@' and comment_delim2 == '@>'  # True: cweb hack in effect.
         indent = 0  # The current indentation.
-        level_stack = []  # Entries are (vnode, in_clone_tree)
         n_last_lines = 0  # The number of @@last directives seen.
         root_gnx_adjusted = False  # True: suppress final checks.
         # #1065 so reads will not create spurious child nodes.
@@ -3071,19 +3398,12 @@ class FastAtRead:
         verbatim_line = comment_delim1 + '@verbatim' + comment_delim2 + '\n'
         verbatim = False  # True: the next line must be added without change.
         #
-        # Init the parent vnode.
-        #
-        root_gnx = gnx = self.root.gnx
-        context = self.c
-        parent_v = self.root.v
-        root_v = parent_v  # Does not change.
-        level_stack.append((root_v, False),)
-        #
         # Init the gnx dict last.
         #
-        gnx2vnode = self.gnx2vnode  # Keys are gnx's, values are vnodes.
+        root_gnx = gnx = self.root.gnx
+        gnx2vnode = self.gnx2vnode  # Keys are gnx's, values are vnodes. Read only!
         gnx2body = {}  # Keys are gnxs, values are list of body lines.
-        gnx2vnode[gnx] = parent_v  # Add gnx to the keys
+        nodes = []  # Entries are (gnx, head, level), for fast_at.create_vnodes.
         # Add gnx to the keys.
         # Body is the list of lines presently being accumulated.
         gnx2body[gnx] = body = first_lines
@@ -3171,65 +3491,16 @@ class FastAtRead:
                 gnx, head = m.group(2), m.group(5)
                 level = int(m.group(3)) if m.group(3) else 1 + len(m.group(4))
                     # m.group(3) is the level number, m.group(4) is the number of stars.
-                v = gnx2vnode.get(gnx)
-                #
-                # Case 1: The root @file node. Don't change the headline.
-                if not root_seen and not v and not g.unitTesting:
-                    # Don't warn about a gnx mismatch in the root.
-                    root_gnx_adjusted = True  # pragma: no cover
+                nodes.append((gnx, head, level),)
                 if not root_seen:
                     # Fix #1064: The node represents the root, regardless of the gnx!
                     root_seen = True
-                    clone_v = None
-                    gnx2body[gnx] = body = []
-                    # This case can happen, but not in unit tests.
-                    if not v:  # pragma: no cover
-                        # Fix #1064.
-                        v = root_v
-                        # This message is annoying when using git-diff.
-                            # if gnx != root_gnx:
-                                # g.es_print("using gnx from external file: %s" % (v.h), color='blue')
-                        gnx2vnode[gnx] = v
-                        v.fileIndex = gnx
-                    v.children = []
-                    continue
-                #
-                # Case 2: We are scanning the descendants of a clone.
-                parent_v, clone_v = level_stack[level - 2]
-                if v and clone_v:
-                    # The last version of the body and headline wins..
-                    gnx2body[gnx] = body = []
-                    v._headString = head
-                    # Update the level_stack.
-                    level_stack = level_stack[: level - 1]
-                    level_stack.append((v, clone_v),)
-                    # Always clear the children!
-                    v.children = []
-                    parent_v.children.append(v)
-                    continue
-                #
-                # Case 3: we are not already scanning the descendants of a clone.
-                if v:
-                    # The *start* of a clone tree. Reset the children.
-                    clone_v = v
-                    v.children = []
-                else:
-                    # Make a new vnode.
-                    v = leoNodes.VNode(context=context, gnx=gnx)
-                #
+                    if gnx != root_gnx and gnx not in gnx2vnode and not g.unitTesting:
+                        # Don't warn about a gnx mismatch in the root.
+                        root_gnx_adjusted = True  # pragma: no cover
                 # The last version of the body and headline wins.
-                gnx2vnode[gnx] = v
+                # fast_at.create_vnodes handles clones.
                 gnx2body[gnx] = body = []
-                v._headString = head
-                #
-                # Update the stack.
-                level_stack = level_stack[: level - 1]
-                level_stack.append((v, clone_v),)
-                #
-                # Update the links.
-                assert v != root_v
-                parent_v.children.append(v)
-                v.parents.append(parent_v)
                 continue
             #@-<< handle node_start >>
             if in_doc:
@@ -3390,7 +3661,7 @@ class FastAtRead:
                 if section_reference_seen:  # pragma: no cover
                     # This is a serious error.
                     # This kind of error should have been caught by Leo's atFile write logic.
-                    g.es_print('section-delims seen after a section reference', color='red')
+                    self.es_print('section-delims seen after a section reference', color='red')
                 else:
                     # Carefully update the section reference pattern!
                     section_delim1 = d1 = re.escape(m.group(1))
@@ -3445,7 +3716,7 @@ class FastAtRead:
             #@-<< handle remaining @ lines >>
         else:
             # No @-leo sentinel!
-            return  # pragma: no cover
+            return None  # pragma: no cover
         #@+<< final checks >>
         #@+node:ekr.20211104054823.1: *4* << final checks >>
         if g.unitTesting:
@@ -3456,10 +3727,10 @@ class FastAtRead:
         elif root_gnx_adjusted:  # pragma: no cover
             pass  # Don't check!
         elif stack or root_gnx != gnx:  # pragma: no cover
-            g.error(f"Possibly corrupted file: {root_v.h}")
-            g.es_print('Unbalanced sentinels lines')
+            self.es_print(f"Possibly corrupted file: {self.root.h}", color='error')
+            self.es_print('Unbalanced sentinels lines')
             g.printObj(stack, tag='stack')
-            g.es_print(f"root_gnx: {root_gnx}, gnx: {gnx}")
+            self.es_print(f"root_gnx: {root_gnx}, gnx: {gnx}")
             g.trace(g.callers())
         #@-<< final checks >>
         #@+<< insert @last lines >>
@@ -3476,17 +3747,24 @@ class FastAtRead:
                 n2 = len(last_lines)
                 g.trace(f"Expected {n1} trailing line{g.plural(n1)}, got {n2}")
         #@-<< insert @last lines >>
-        #@+<< post pass: set all body text>>
-        #@+node:ekr.20211104054426.1: *4* << post pass: set all body text>>
-        # Set the body text.
-        assert root_v.gnx in gnx2vnode, root_v
-        assert root_v.gnx in gnx2body, root_v
+        #@+<< post pass: compute all body text>>
+        #@+node:ekr.20211104054426.1: *4* << post pass: compute all body text>>
+        assert root_gnx in gnx2body, root_gnx
+        bodies = {}
+        # Fix #1064: nodes[0] represents the root, regardless of its gnx.
+        root_gnxs = {root_gnx, nodes[0][0]} if nodes else {root_gnx}
+        self.directive_lines = {}
         for key in gnx2body:
-            body = gnx2body.get(key)
-            v = gnx2vnode.get(key)
-            assert v, (key, v)
-            v._bodyString = g.toUnicode(''.join(body))
-        #@-<< post pass: set all body text>>
+            lines = gnx2body.get(key)
+            if self.lazy and key not in root_gnxs:
+                # Remember only the lines that might contain directives.
+                if any(lines):
+                    self.directive_lines[key] = g.toUnicode(
+                        ''.join(z for z in lines if z.lstrip().startswith('@')))
+                continue
+            bodies[key] = g.toUnicode(''.join(lines))
+        #@-<< post pass: compute all body text>>
+        return nodes, bodies
     #@+node:ekr.20180603170614.1: *3* fast_at.read_into_root
     def read_into_root(self, contents, path, root):
         """
@@ -3495,6 +3773,34 @@ class FastAtRead:
         """
         trace = False
         t1 = time.process_time()
+        ok, data = self.parse(contents, path, root)
+        self.report_messages()
+        if not ok:
+            return False  # pragma: no cover
+        if data and self.lazy:
+            nodes, bodies = data
+            lazy_bodies = LazyBodies(self.c, contents, path, root.v, self.directive_lines)
+            self.create_vnodes(nodes, bodies, lazy_bodies)
+        elif data:
+            nodes, bodies = data
+            self.create_vnodes(nodes, bodies)
+            self.cache_data = data
+        else:
+            # No @-leo sentinel!
+            root.v._deleteAllChildren()  # pragma: no cover
+        if trace:
+            t2 = time.process_time()
+            g.trace(f"{t2 - t1:5.2f} sec. {path}")
+        return True
+    #@+node:ekr.20211109052817.1: *3* fast_at.parse
+    def parse(self, contents, path, root):
+        """
+        Parse the file's contents *without* creating or changing any vnodes.
+
+        Return (ok, data):
+        ok:   False if the contents has no @+leo header.
+        data: (nodes, bodies), suitable for fast_at.create_vnodes, or None.
+        """
         self.path = path
         self.root = root
         sfn = g.shortFileName(path)
@@ -3503,16 +3809,134 @@ class FastAtRead:
         data = self.scan_header(lines)
         if not data:  # pragma: no cover
             g.trace(f"Invalid external file: {sfn}")
-            return False
-        # Clear all children.
-        # Previously, this had been done in readOpenFile.
-        root.v._deleteAllChildren()
+            return False, None
         comment_delims, first_lines, start_i = data
-        self.scan_lines(comment_delims, first_lines, lines, path, start_i)
-        if trace:
-            t2 = time.process_time()
-            g.trace(f"{t2 - t1:5.2f} sec. {path}")
+        return True, self.scan_lines(comment_delims, first_lines, lines, path, start_i)
+    #@+node:ekr.20211109052012.1: *3* fast_at.read_from_cache
+    def read_from_cache(self, nodes, bodies, path, root):
+        """
+        Recreate the tree of vnodes anchored in root.v from data cached by
+        g.app.external_files_cacher, without scanning the file's sentinels.
+        """
+        self.path = path
+        self.root = root
+        self.create_vnodes(nodes, bodies)
         return True
+    #@+node:ekr.20211109052954.1: *3* fast_at.create_vnodes
+    def create_vnodes(self, nodes, bodies, lazy_bodies=None):
+        """
+        Create the tree of vnodes anchored in self.root.v.
+
+        nodes: A list of (gnx, head, level) tuples, one per @+node sentinel.
+        bodies: A dict. Keys are gnxs, values are body texts.
+        lazy_bodies: None, or a LazyBodies object that will compute the
+                     bodies of all nodes in nodes[1:].
+        """
+        context = self.c
+        gnx2vnode = self.gnx2vnode
+        root_v = self.root.v
+        # Clear all children.
+        # Previously, this had been done in readOpenFile.
+        root_v._deleteAllChildren()
+        gnx2vnode[root_v.gnx] = root_v
+        level_stack = [(root_v, False)]
+        root_seen = False
+        for gnx, head, level in nodes:
+            v = gnx2vnode.get(gnx)
+            #
+            # Case 1: The root @file node. Don't change the headline.
+            if not root_seen:
+                # Fix #1064: The node represents the root, regardless of the gnx!
+                root_seen = True
+                if not v:  # pragma: no cover
+                    # This case can happen, but not in unit tests.
+                    v = root_v
+                    gnx2vnode[gnx] = v
+                    v.fileIndex = gnx
+                v.children = []
+                continue
+            #
+            # Case 2: We are scanning the descendants of a clone.
+            parent_v, clone_v = level_stack[level - 2]
+            if v and clone_v:
+                # The last version of the headline wins.
+                v._headString = head
+                level_stack = level_stack[: level - 1]
+                level_stack.append((v, clone_v),)
+                v.children = []
+                parent_v.children.append(v)
+                continue
+            #
+            # Case 3: we are not already scanning the descendants of a clone.
+            if v:
+                # The *start* of a clone tree. Reset the children.
+                clone_v = v
+                v.children = []
+            else:
+                # Make a new vnode.
+                v = leoNodes.VNode(context=context, gnx=gnx)
+            gnx2vnode[gnx] = v
+            v._headString = head
+            level_stack = level_stack[: level - 1]
+            level_stack.append((v, clone_v),)
+            parent_v.children.append(v)
+            v.parents.append(parent_v)
+        if lazy_bodies:
+            for gnx, head, level in nodes[1:]:
+                gnx2vnode[gnx]._bodyString = lazy_bodies
+        # Set the body text. The last version of the body wins.
+        for gnx, body in bodies.items():
+            v = gnx2vnode.get(gnx)
+            assert v, (gnx, v)
+            v._bodyString = body
+        if context.vnode_observers:
+            context.touchVnodes([gnx2vnode[gnx] for gnx, head, level in nodes])
+    #@-others
+#@+node:ekr.20211109063430.1: ** class LazyBodies
+class LazyBodies:
+    """
+    The compressed contents of an external file whose body text has not yet
+    been computed.
+
+    fast_at.create_vnodes sets v._bodyString to a LazyBodies object for all
+    vnodes of the file except the root. The first call to v.bodyString for
+    any of these vnodes sets the body text of all of them.
+
+    self.directive_lines lets v.directiveString and v.hasBody answer
+    without loading any body.
+    """
+
+    def __init__(self, c, contents, path, root_v, directive_lines=None):
+        self.c = c
+        self.data = zlib.compress(contents.encode('utf-8'), 1)
+        # Keys are the gnxs of non-empty bodies, values are the lines of
+        # those bodies that start with '@', after leading whitespace.
+        self.directive_lines = directive_lines or {}
+        self.path = path
+        self.root_v = root_v
+    #@+others
+    #@+node:ekr.20211109063607.1: *3* LazyBodies.load
+    def load(self, v):
+        """Set the body text of all vnodes that refer to self. Return v's body."""
+        gnx2vnode = self.c.fileCommands.gnxDict
+        if self.data is not None:
+            contents = zlib.decompress(self.data).decode('utf-8')
+            self.data, self.directive_lines = None, {}
+            fast_read = FastAtRead(self.c, gnx2vnode)
+            fast_read.messages = []  # The first read has already reported all messages.
+            try:
+                ok, data = fast_read.parse(contents, self.path, self.root_v)
+            except Exception:
+                g.es_exception()
+                ok, data = False, None
+            bodies = data[1] if ok and data else {}
+            for gnx, body in bodies.items():
+                v2 = gnx2vnode.get(gnx)
+                if v2 and v2._bodyString is self:
+                    v2._bodyString = body
+        if v._bodyString is self:
+            v._bodyString = ''  # pragma: no cover
+        return v._bodyString
     #@-others
 #@-others
 #@@language python
@@ -161,7 +161,8 @@ class BridgeController:
             g.app.commander_cacher = g.NullObject()
             g.app.global_cacher = g.NullObject()
         if self.readSettings:
-            lm.readGlobalSettingsFiles()
+            if not (self.useCaches and lm.readGlobalSettingsSnapshot()):
+                lm.readGlobalSettingsFiles()
                 # reads only standard settings files, using a null gui.
                 # uses lm.files[0] to compute the local directory
                 # that might contain myLeoSettings.leo.
@@ -4,6 +4,7 @@
 #@+<< imports >>
 #@+node:ekr.20100208223942.10436: ** << imports >> (leoCache)
 import fnmatch
+import hashlib
 import os
 import pickle
 import sqlite3
@@ -189,6 +190,162 @@ class GlobalCacher:
         dump_cache(self.db, tag2)
             # Careful: g.app.db may not be set yet.
     #@-others
+#@+node:ekr.20211109083231.24: ** class SqliteCacher
+class SqliteCacher:
+    """
+    A base class for caches of data computed from files, kept in an
+    SqlitePickleShare database in ~/.leo/db.
+
+    Subclasses define db_name and version. Cached data is valid only if the
+    modification time, size *and* contents hash of the files all match.
+    """
+
+    db_name = ''  # The name of the database file in ~/.leo/db.
+    version = 1  # Bump this whenever the format of the cached data changes.
+
+    def __init__(self, path=None):
+        """Ctor for SqliteCacher classes."""
+        try:
+            path = path or join(g.app.homeLeoDir, 'db', self.db_name)
+            self.db = SqlitePickleShare(path)
+        except Exception:
+            # Use a plain dict as a dummy.
+            self.db = {}  # type:ignore
+    #@+others
+    #@+node:ekr.20211109051521.1: *3* sqlite_cacher.clear & commit_and_close
+    def clear(self):
+        """Clear the cache."""
+        try:
+            self.db.clear()
+        except Exception:
+            g.trace('unexpected exception')
+            g.es_exception()
+            self.db = {}  # type:ignore
+
+    def commit_and_close(self):
+        # Careful: self.db may be a dict.
+        if hasattr(self.db, 'conn'):
+            # pylint: disable=no-member
+            self.db.conn.commit()
+            self.db.conn.close()
+    #@+node:ekr.20211109083231.25: *3* sqlite_cacher.get_data & stamp
+    def get_data(self, key):
+        """Return the data cached under key if it has the current version."""
+        try:
+            data = self.db.get(key)
+        except Exception:
+            return None
+        if not data or data.get('version') != self.version:
+            return None
+        return data
+
+    def stamp(self, path, contents=None):
+        """
+        Return (mtime, size, content hash) for the given path, or None if
+        the file can not be read.
+
+        contents: the file's contents, if the caller has already read them.
+        """
+        try:
+            st = os.stat(path)
+            mtime, size = st.st_mtime, st.st_size
+        except Exception:
+            mtime, size = None, None
+        if contents is None:
+            try:
+                with open(path, 'rb') as f:
+                    contents = f.read()
+            except Exception:
+                return None
+        h = hashlib.sha1(g.toEncodedString(contents)).hexdigest()
+        return mtime, size, h
+    #@-others
+#@+node:ekr.20211109051344.1: ** class ExternalFilesCacher (SqliteCacher)
+class ExternalFilesCacher(SqliteCacher):
+    """
+    A singleton cache, g.app.external_files_cacher, containing the
+    structure of the vnodes created by reading @file and @clean trees.
+
+    Keys are full paths. Values are dicts describing what FastAtRead
+    created the last time it read the file. A cache entry is valid only if
+    the file's modification time, size *and* contents hash all match.
+    """
+
+    db_name = 'external_files'
+    version = 1  # Bump this whenever the format of the cached data changes.
+    #@+others
+    #@+node:ekr.20211109051658.1: *3* ef_cacher.get & put
+    def get(self, path, contents):
+        """
+        Return the cached data for the given path if the file has not changed
+        since the data was cached. Otherwise return None.
+        """
+        data = self.get_data(self.key(path))
+        if not data:
+            return None
+        if data.get('stamp') != self.stamp(path, contents):
+            return None
+        return data.get('nodes'), data.get('bodies')
+
+    def put(self, path, contents, nodes, bodies):
+        """Cache the data that FastAtRead created by reading the given path."""
+        try:
+            self.db[self.key(path)] = {
+                'version': self.version,
+                'stamp': self.stamp(path, contents),
+                'nodes': nodes,
+                'bodies': bodies,
+            }
+        except Exception:
+            g.es_exception()
+    #@+node:ekr.20211109051835.1: *3* ef_cacher.key
+    def key(self, path):
+        return f"fast-at-read:::{g.os_path_normcase(path)}"
+    #@-others
+#@+node:ekr.20211109072751.1: ** class SettingsCacher (SqliteCacher)
+class SettingsCacher(SqliteCacher):
+    """
+    A singleton cache, g.app.settings_cacher, containing a snapshot of the
+    global settings and bindings computed from leoSettings.leo,
+    myLeoSettings.leo and the theme file.
+
+    A snapshot is valid only if the modification time, size *and* contents
+    hash of all those files match, and if the snapshot's environment (Leo's
+    version, the platform, etc.) matches.
+    """
+
+    db_name = 'settings'
+    key = 'global-settings'
+    version = 1  # Bump this whenever the format of the cached data changes.
+    #@+others
+    #@+node:ekr.20211109073105.1: *3* settings_cacher.get & put
+    def get(self, env):
+        """
+        Return the cached snapshot if it was computed in the given environment
+        and no settings file has changed since then. Otherwise return None.
+        """
+        data = self.get_data(self.key)
+        if not data:
+            return None
+        if data.get('env') != env:
+            return None
+        for path, stamp in data.get('stamps', []):
+            if stamp != self.stamp(path):
+                return None
+        return data.get('snapshot')
+
+    def put(self, env, paths, snapshot):
+        """Cache the snapshot computed from the given settings files."""
+        try:
+            self.db[self.key] = {
+                'env': env,
+                'snapshot': snapshot,
+                'stamps': [(z, self.stamp(z)) for z in paths if z],
+                'version': self.version,
+            }
+        except Exception:
+            g.es_exception()
+    #@-others
 #@+node:ekr.20100208223942.5967: ** class PickleShareDB
 _sentinel = object()
 
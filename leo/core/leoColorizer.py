@@ -9,10 +9,11 @@
 
 #@+<< imports >>
 #@+node:ekr.20140827092102.18575: ** << imports >> (leoColorizer.py)
+import itertools
 import re
 import string
 import time
-from typing import Any, Callable, Dict, List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 #
 # Third-part tools.
 try:
@@ -146,6 +147,12 @@ class BaseColorizer:
 class BaseJEditColorizer(BaseColorizer):
     """A class containing common JEdit tags machinery."""
     # No need for a ctor.
+    compiled_rulesets: Dict[int, Any] = {}
+        # Keys are ids of rulesDicts, values are rulesets compiled by jedit.compile_ruleset.
+        # Shared by all colorizers, because modes share rulesDicts.
+    format_runs: Optional[List[Tuple[int, int, Any]]] = None
+        # A list of (i, length, format) for the line being colored.
+        # Only the jEdit colorizer caches format runs.
     #@+others
     #@+node:ekr.20110605121601.18576: *3* bjc.addImportedRules
     def addImportedRules(self, mode, rulesDict, rulesetName):
@@ -153,6 +160,7 @@ class BaseJEditColorizer(BaseColorizer):
         if self.importedRulesets.get(rulesetName):
             return
         self.importedRulesets[rulesetName] = True
+        self.compiled_rulesets.clear()
         names = mode.importDict.get(
             rulesetName, []) if hasattr(mode, 'importDict') else []
         for name in names:
@@ -174,6 +182,7 @@ class BaseJEditColorizer(BaseColorizer):
     def addLeoRules(self, theDict):
         """Put Leo-specific rules to theList."""
         # pylint: disable=no-member
+        self.compiled_rulesets.clear()
         table = [
             # Rules added at front are added in **reverse** order.
             ('@', self.match_leo_keywords, True),  # Called after all other Leo matchers.
@@ -244,6 +253,7 @@ class BaseJEditColorizer(BaseColorizer):
     def configure_tags(self):
         """Configure all tags."""
         wrapper = self.wrapper
+        self.formats_dict = {}  # Keys are tags, values are formats. See setTag.
         if wrapper and hasattr(wrapper, 'start_tag_configure'):
             wrapper.start_tag_configure()
         self.configure_fonts()
@@ -999,9 +1009,35 @@ class BaseJEditColorizer(BaseColorizer):
         self.n_setTag += 1
         if i == j:
             return
+        # Computing formats is expensive, so cache them.
+        try:
+            format = self.formats_dict[tag]
+        except KeyError:
+            format = self.formats_dict[tag] = self.tag_to_format(tag)
+        if format is None:
+            return
+        self.tagCount += 1
+        if trace:
+            # A superb trace.
+            if len(repr(s[i:j])) <= 20:
+                s2 = repr(s[i:j])
+            else:
+                s2 = repr(s[i : i + 17 - 2] + '...')
+            kind_s = f"{self.language}.{tag.lower().strip()}"
+            kind_s2 = f"{self.delegate_name}:" if self.delegate_name else ''
+            print(
+                f"setTag: {kind_s:25} {i:3} {j:3} {s2:>20} "
+                f"{self.rulesetName}:{kind_s2}{self.matcher_name}"
+            )
+        self.highlighter.setFormat(i, j - i, format)
+        if self.format_runs is not None:
+            self.format_runs.append((i, j - i, format))
+    #@+node:ekr.20211109082249.1: *3* bjc.tag_to_format
+    def tag_to_format(self, tag):
+        """Return the QTextCharFormat for the given tag, or None."""
         wrapper = self.wrapper  # A QTextEditWrapper
         if not tag.strip():
-            return
+            return None
         tag = tag.lower().strip()
         # A hack to allow continuation dots on any tag.
         dots = tag.startswith('dots')
@@ -1010,7 +1046,7 @@ class BaseJEditColorizer(BaseColorizer):
         colorName = wrapper.configDict.get(tag)
             # This color name should already be valid.
         if not colorName:
-            return
+            return None
         #
         # New in Leo 5.8.1: allow symbolic color names here.
         # This now works because all keys in leo_color_database are normalized.
@@ -1025,7 +1061,7 @@ class BaseJEditColorizer(BaseColorizer):
                 self.actualColorDict[colorName] = color
             else:
                 g.trace('unknown color name', colorName, g.callers())
-                return
+                return None
         underline = wrapper.configUnderlineDict.get(tag)
         format = QtGui.QTextCharFormat()
         font = self.fonts.get(tag)
@@ -1047,20 +1083,7 @@ class BaseJEditColorizer(BaseColorizer):
         else:
             format.setForeground(color)
             format.setUnderlineStyle(UnderlineStyle.NoUnderline)
-        self.tagCount += 1
-        if trace:
-            # A superb trace.
-            if len(repr(s[i:j])) <= 20:
-                s2 = repr(s[i:j])
-            else:
-                s2 = repr(s[i : i + 17 - 2] + '...')
-            kind_s = f"{self.language}.{tag}"
-            kind_s2 = f"{self.delegate_name}:" if self.delegate_name else ''
-            print(
-                f"setTag: {kind_s:25} {i:3} {j:3} {s2:>20} "
-                f"{self.rulesetName}:{kind_s2}{self.matcher_name}"
-            )
-        self.highlighter.setFormat(i, j - i, format)
+        return format
     #@-others
 #@+node:ekr.20110605121601.18569: ** class JEditColorizer(BaseJEditColorizer)
 # This is c.frame.body.colorizer
@@ -1098,8 +1121,23 @@ class JEditColorizer(BaseJEditColorizer):
         self.section_delim1 = '<<'
         self.section_delim2 = '>>'
         #
+        # The color cache...
+        self.cache_entry = None  # The cache entry for old_v.
+        self.color_cache = {}  # Keys are gnx's, values are cache entries.
+        self.format_runs = None  # A list of (i, length, format) for the line being colored.
+        self.precolor_job = None  # The node being colored at idle time.
+        self.precolor_positions = None  # A generator yielding candidates for precoloring.
+        self.precolor_touched = None  # The vnodes touched since the last idle-time call.
+        self.replay_count = 0  # The number of lines colored from the cache.
+        #
         # Init common data...
         self.reloadSettings()
+        if isinstance(widget, QtWidgets.QTextEdit) and self.precolor_lines > 0:
+            self.precolor_timer = g.IdleTime(
+                self.precolor_handler, delay=200, tag='jedit.precolor_handler')
+            if self.precolor_timer:
+                self.precolor_touched = c.addVnodeObserver()
+                self.precolor_timer.start()
     #@+node:ekr.20110605121601.18580: *4* jedit.init
     def init(self, p=None):
         """Init the colorizer, but *not* state."""
@@ -1118,7 +1156,7 @@ class JEditColorizer(BaseJEditColorizer):
         self.prev = None
         # Must be done to support per-language @font/@color settings.
         self.configure_tags()
-        self.init_section_delims()  # #2276
+        self.init_section_delims(p)  # #2276
     #@+node:ekr.20170201082248.1: *4* jedit.init_all_state
     def init_all_state(self, v):
         """Completely init all state data."""
@@ -1130,9 +1168,9 @@ class JEditColorizer(BaseJEditColorizer):
         self.stateDict = {}
         self.stateNameDict = {}
     #@+node:ekr.20211029073553.1: *4* jedit.init_section_delims
-    def init_section_delims(self):
+    def init_section_delims(self, p=None):
 
-        p = self.c.p
+        p = p or self.c.p
 
         def find_delims(v):
             for s in g.splitLines(v.b):
@@ -1156,6 +1194,11 @@ class JEditColorizer(BaseJEditColorizer):
             print('jedit.reloadSettings.')
         # Do the basic inits.
         BaseJEditColorizer.reloadSettings(self)
+        # The cached formats may be out of date.
+        c = self.c
+        self.cache_size = c.config.getInt('colorizer-cache-size') or 0
+        self.precolor_lines = c.config.getInt('colorizer-precolor-lines') or 0
+        self.clear_color_cache()
         # Init everything else.
         self.init_style_ivars()
         self.defineLeoKeywordsDict()
@@ -1616,6 +1659,9 @@ class JEditColorizer(BaseJEditColorizer):
     #@+node:ekr.20110605121601.18614: *4* jedit.match_keywords
     # This is a time-critical method.
 
+    word_pattern_key = None
+    word_pattern = None  # Matches runs of self.word_chars.
+
     def match_keywords(self, s, i):
         """
         Succeed if s[i:] is a keyword.
@@ -1627,16 +1673,17 @@ class JEditColorizer(BaseJEditColorizer):
         if i > 0 and s[i - 1] in self.word_chars:
             return 0
         # Get the word as quickly as possible.
-        j = i
-        n = len(s)
         chars = self.word_chars
         # Special cases...
         if self.language in ('haskell', 'clojure'):
             chars["'"] = "'"
         if self.language == 'c':
             chars['_'] = '_'
-        while j < n and s[j] in chars:
-            j += 1
+        key = (id(chars), len(chars))
+        if key != self.word_pattern_key:
+            self.word_pattern_key = key
+            self.word_pattern = re.compile(f"[{re.escape(''.join(chars))}]*")
+        j = self.word_pattern.match(s, i).end()
         word = s[i:j]
         # Fix part of #585: A kludge for css.
         if self.language == 'css' and word.endswith(':'):
@@ -1750,19 +1797,29 @@ class JEditColorizer(BaseJEditColorizer):
         # This match was causing most of the syntax-color problems.
         return 0  # 2009/6/23
     #@+node:ekr.20110605121601.18619: *4* jedit.match_regexp_helper
+    regexp_dict: Dict[Tuple[str, bool], Any] = {}
+        # Keys are (pattern, ignore_case), values are compiled regexps or None.
+
     def match_regexp_helper(self, s, i, pattern):
         """
         Return the length of the matching text if
         seq (a regular expression) matches the present position.
         """
+        key = (pattern, self.ignore_case)
         try:
-            flags = re.MULTILINE
-            if self.ignore_case:
-                flags |= re.IGNORECASE
-            re_obj = re.compile(pattern, flags)
-        except Exception:
-            # Do not call g.es here!
-            g.trace(f"Invalid regular expression: {pattern}")
+            re_obj = self.regexp_dict[key]
+        except KeyError:
+            try:
+                flags = re.MULTILINE
+                if self.ignore_case:
+                    flags |= re.IGNORECASE
+                re_obj = re.compile(pattern, flags)
+            except Exception:
+                # Do not call g.es here!
+                g.trace(f"Invalid regular expression: {pattern}")
+                re_obj = None
+            self.regexp_dict[key] = re_obj
+        if not re_obj:
             return 0
         # Match succeeds or fails more quickly than search.
         self.match_obj = mo = re_obj.match(s, i)  # re_obj.search(s,i)
@@ -2107,7 +2164,185 @@ class JEditColorizer(BaseJEditColorizer):
 
         if j != i and self.trace_match_flag:
             g.trace(kind, i, j, g.callers(2), self.dump(s[i:j]))
-    #@+node:ekr.20110605121601.18629: *3*  jedit.State methods
+    #@+node:ekr.20211109081935.1: *3*  jedit.Color cache
+    # The color cache contains the end states and format runs of each line
+    # of recently colored nodes. Selecting a cached node whose body and
+    # language have not changed replays the cached runs instead of running
+    # the pattern matchers.
+    #
+    # State numbers are meaningful only within the state tables that created
+    # them, so each cache entry owns its own state tables.
+    #@+node:ekr.20211109081935.2: *4* jedit.cache_line
+    def cache_line(self, block_n, n, s):
+        """Remember the end state and format runs of line s, starting in state n."""
+        entry, runs = self.cache_entry, self.format_runs
+        self.format_runs = None
+        if entry and block_n >= 0:
+            entry.lines[block_n] = (s, n, self.currentState(), runs)
+    #@+node:ekr.20211109081935.3: *4* jedit.clear_color_cache
+    def clear_color_cache(self):
+        """Clear the color cache. Call this when settings or rules change."""
+        self.cache_entry = None
+        self.color_cache = {}
+        self.old_v = None  # Force init_all_state.
+        self.precolor_job = None
+    #@+node:ekr.20211109081935.4: *4* jedit.enter_cache_entry
+    def enter_cache_entry(self, p):
+        """
+        Init all state for p.v, the newly selected node.
+
+        Reuse the cache entry for p.v if p.v's body and language have not
+        changed. Otherwise, create a new cache entry.
+        """
+        self.leave_cache_entry()
+        self.updateSyntaxColorer(p)
+        assert self.language
+        self.init_all_state(p.v)
+        entry = self.color_cache.pop(p.v.gnx, None)
+        if entry and (
+            entry.body_hash == hash(p.b) and
+            entry.enabled == self.enabled and
+            entry.language == self.language
+        ):
+            # Use the entry's state tables.
+            self.n2languageDict = entry.n2languageDict
+            self.nextState = entry.nextState
+            self.restartDict = entry.restartDict
+            self.stateDict = entry.stateDict
+            self.stateNameDict = entry.stateNameDict
+        else:
+            entry = g.Bunch(
+                body_hash=hash(p.b),
+                enabled=self.enabled,
+                language=self.language,
+                lines={},  # Keys are block numbers, values are tuples.
+                n2languageDict=self.n2languageDict,
+                nextState=self.nextState,
+                restartDict=self.restartDict,
+                stateDict=self.stateDict,
+                stateNameDict=self.stateNameDict,
+            )
+        # The most recently used entry is last.
+        self.cache_entry = self.color_cache[p.v.gnx] = entry
+        while len(self.color_cache) > max(1, self.cache_size):
+            gnx = next(iter(self.color_cache))
+            del self.color_cache[gnx]
+        self.init(p)
+    #@+node:ekr.20211109081935.5: *4* jedit.leave_cache_entry
+    def leave_cache_entry(self):
+        """Update the cache entry for old_v, the previously colored node."""
+        entry, v = self.cache_entry, self.old_v
+        self.cache_entry = None
+        if entry and v:
+            entry.body_hash = hash(v.b)
+            entry.nextState = self.nextState
+    #@+node:ekr.20211109081935.6: *4* jedit.replay_line
+    def replay_line(self, block_n, n, s):
+        """
+        Color line s from the cache if it was cached with the same starting
+        state. Return True if the line has been colored.
+        """
+        entry = self.cache_entry
+        data = entry and entry.lines.get(block_n)
+        if not data or data[0] != s or data[1] != n:
+            return False
+        setFormat = self.highlighter.setFormat
+        for i, length, format in data[3]:
+            setFormat(i, length, format)
+        self.setState(data[2])
+        self.replay_count += 1
+        return True
+    #@+node:ekr.20211109081935.7: *3*  jedit.Precoloring
+    # At idle time, the precolor handler colors large bodies that are not in
+    # the color cache, a few hundred lines at a time. Selecting such nodes
+    # later just replays the cached format runs. The handler stops after one
+    # full scan of the outline. It skips bodies that have not been loaded.
+    #
+    # Precoloring uses this colorizer's matchers, so precolor_next_lines swaps all
+    # colorizer ivars between the selected node and the precolored node.
+    #@+node:ekr.20211109081935.8: *4* jedit.next_precolor_job
+    precolor_scan_count = 100  # The number of positions to examine per call.
+
+    def next_precolor_job(self):
+        """
+        Return a g.Bunch describing the next node to precolor, or None.
+        Set self.precolor_positions to False after a full scan of the outline.
+        """
+        c = self.c
+        if len(self.color_cache) >= self.cache_size:
+            return None  # Never evict nodes the user has visited.
+        if self.precolor_touched:
+            # The generator is invalid: start again.
+            self.precolor_touched.clear()
+            self.precolor_positions = None
+        if self.precolor_positions is None:
+            self.precolor_positions = c.all_unique_positions()
+        n = 0
+        for p in itertools.islice(self.precolor_positions, self.precolor_scan_count):
+            n += 1
+            if not isinstance(p.v._bodyString, str):
+                continue  # Don't load lazy bodies.
+            entry = self.color_cache.get(p.v.gnx)
+            if (
+                p.v != self.old_v and
+                p.b.count('\n') >= self.precolor_lines and
+                not (entry and entry.body_hash == hash(p.b))
+            ):
+                highlighter = PrecolorHighlighter()
+                return g.Bunch(
+                    highlighter=highlighter,
+                    ivars=dict(highlighter=highlighter, cache_entry=None, old_v=None),
+                    lines=g.splitLines(p.b),
+                    p=p.copy(),
+                )
+        if n < self.precolor_scan_count:
+            self.precolor_positions = False  # The scan is complete.
+        return None
+    #@+node:ekr.20211109081935.9: *4* jedit.precolor_handler & helper
+    def precolor_handler(self, timer):
+        """The idle-time handler that precolors large bodies."""
+        c = self.c
+        if not c.exists or g.app.killed:
+            self.stop_precoloring(timer)
+            return
+        job = self.precolor_job
+        if job and (job.p.v == self.old_v or not c.positionExists(job.p)):
+            job = None  # The user has selected or deleted the node.
+        self.precolor_job = job or self.next_precolor_job()
+        if self.precolor_job:
+            self.precolor_next_lines()
+        elif self.precolor_positions is False:
+            self.stop_precoloring(timer)
+
+    def stop_precoloring(self, timer):
+        """Stop the idle-time precolor handler."""
+        timer.stop()
+        if self.precolor_touched is not None:
+            self.c.removeVnodeObserver(self.precolor_touched)
+            self.precolor_touched = None
+    #@+node:ekr.20211109081935.10: *4* jedit.precolor_next_lines
+    precolor_chunk = 500  # The number of lines to color per call.
+
+    def precolor_next_lines(self):
+        """Color the next chunk of lines of self.precolor_job."""
+        job = self.precolor_job
+        live_ivars = self.__dict__.copy()
+        self.__dict__.update(job.ivars)
+        try:
+            highlighter = job.highlighter
+            i = highlighter.block_n + 1
+            for s in job.lines[i : i + self.precolor_chunk]:
+                highlighter.next_block()
+                self.recolor(s.rstrip('\n'), p=job.p)
+            if self.cache_entry:
+                self.cache_entry.nextState = self.nextState
+            done = highlighter.block_n + 1 >= len(job.lines)
+        finally:
+            job.ivars = self.__dict__.copy()
+            self.__dict__.clear()
+            self.__dict__.update(live_ivars)
+        if done:
+            self.precolor_job = None
     #@+node:ekr.20110605121601.18630: *4* jedit.clearState
     def clearState(self):
         """
@@ -2219,6 +2454,8 @@ class JEditColorizer(BaseJEditColorizer):
             self.n2languageDict[n] = self.language
         return n
     #@+node:ekr.20110605121601.18637: *3* jedit.colorRangeWithTag
+    url_leadin_pat = re.compile(r'[fhuFHU]')
+
     def colorRangeWithTag(self, s, i, j, tag, delegate='', exclude_match=False):
         """
         Actually colorize the selected range.
@@ -2271,16 +2508,16 @@ class JEditColorizer(BaseJEditColorizer):
             # Allow UNL's and URL's *everywhere*.
             j = min(j, len(s))
             while i < j:
-                ch = s[i].lower()
-                if ch == 'u':
+                m = self.url_leadin_pat.search(s, i, j)
+                if not m:
+                    break
+                i = m.start()
+                if s[i] in 'uU':
                     n = self.match_unl(s, i)
-                    i += max(1, n)
-                elif ch in 'fh':  # file|ftp|http|https
+                else:  # file|ftp|http|https
                     n = self.match_any_url(s, i)
-                    i += max(1, n)
-                else:
-                    i += 1
-    #@+node:ekr.20110605121601.18638: *3* jedit.mainLoop
+                i += max(1, n)
+    #@+node:ekr.20110605121601.18638: *3* jedit.mainLoop & helpers
     tot_time = 0.0
 
     def mainLoop(self, n, s):
@@ -2296,9 +2533,49 @@ class JEditColorizer(BaseJEditColorizer):
                 print('')
                 g.trace(f"NEW NODE: state {n} = {f_name} {p.h}\n")
         i = f(s) if f else 0
+        rulesDict = ruleset = None
         while i < len(s):
+            if self.rulesDict is not rulesDict:
+                # Matchers may change the ruleset at any time.
+                rulesDict = self.rulesDict
+                ruleset = self.compile_ruleset(rulesDict)
+            # Skip all characters that have no rules.
+            m = ruleset.skip_pat.match(s, i)
+            if m:
+                i = m.end()
+                continue
             progress = i
-            functions = self.rulesDict.get(s[i], [])
+            ch = s[i]
+            if ch in ruleset.seq_dict:
+                # Inline match_seq.
+                pattern, kinds, names = ruleset.seq_dict[ch]
+                m = pattern.match(s, i)
+                if m:
+                    j, k = m.end(), m.lastindex - 1
+                    self.colorRangeWithTag(s, i, j, kinds[k])
+                    self.prev = (i, j, kinds[k])
+                    self.trace_match(kinds[k], s, i, j)
+                    self.matcher_name = names[k]  # For traces.
+                    i = j
+                else:
+                    i += 1
+                continue
+            if ch in ruleset.keyword_chars:
+                # Call match_keywords directly.
+                n = self.match_keywords(s, i)
+                if n > 0:
+                    self.matcher_name = ruleset.keywords_rule_name  # For traces.
+                i += n if n > 0 else -n if n < 0 else 1
+                continue
+            if ch in ruleset.ws_chars:
+                # Inline match_trailing_ws.
+                j = ruleset.ws_pat.match(s, i).end()
+                if j == len(s):
+                    self.colorRangeWithTag(s, i, j, 'trailing_whitespace')
+                    self.matcher_name = 'match_trailing_ws'  # For traces.
+                i = j
+                continue
+            functions = ruleset.rulesDict.get(ch, [])
             for f in functions:
                 n = f(self, s, i)
                 if n is None:
@@ -2318,13 +2595,123 @@ class JEditColorizer(BaseJEditColorizer):
             assert i > progress
         # Don't even *think* about changing state here.
         self.tot_time += time.process_time() - t1
+    #@+node:ekr.20211109082249.2: *4* jedit.analyze_rule
+    def analyze_rule(self, f):
+        """
+        Return (matcher_name, keys) if rule f, defined in leo/modes, does
+        nothing but call match_seq or match_keywords. Otherwise return None.
+        """
+        code = getattr(f, '__code__', None)
+        if (
+            not code or
+            not getattr(f, '__module__', '').startswith('leo.modes.') or
+            code.co_names not in (('match_seq',), ('match_keywords',))
+        ):
+            return None
+        name, calls = code.co_names[0], []
+        s, i = object(), object()
+
+        def matcher(*args, **keys):
+            calls.append((args, keys))
+            return 0
+
+        try:
+            f(g.Bunch(**{name: matcher}), s, i)
+        except Exception:
+            return None
+        if len(calls) != 1:
+            return None
+        args, keys = calls[0]
+        if len(args) != 2 or args[0] is not s or args[1] is not i:
+            return None
+        return name, keys
+    #@+node:ekr.20211109082249.3: *4* jedit.compile_ruleset
+    seq_keys = ('at_line_start', 'at_whitespace_end', 'at_word_start', 'delegate', 'kind', 'seq')
+
+    def compile_ruleset(self, rulesDict):
+        """
+        Return a g.Bunch that allows mainLoop to color rulesDict's simplest
+        rules without calling them:
+
+        rulesDict:          rulesDict, without rules that always fail.
+        skip_pat:           Matches runs of characters that have no rules.
+        seq_dict:           Keys are characters whose rules all call match_seq
+                            without qualifiers. Values are tuples:
+                            (pattern matching all seqs, kinds, rule names).
+        keyword_chars:      A frozenset of characters whose only rule calls
+                            match_keywords.
+        keywords_rule_name: The name of a rule calling match_keywords.
+        ws_chars:           A frozenset of blanks and tabs if their only rule
+                            is match_trailing_ws. Otherwise, empty.
+        ws_pat:             Matches runs of ws_chars.
+        """
+        ruleset = self.compiled_rulesets.get(id(rulesDict))
+        if ruleset and ruleset.original_rulesDict is rulesDict:
+            return ruleset
+        keyword_chars, leadins, seq_dict, ws_chars = [], [], {}, []
+        keywords_rule_name = None
+        null_rules = (JEditColorizer.match_blanks, JEditColorizer.match_tabs)
+        if isinstance(rulesDict, dict):
+            d = {
+                ch: [f for f in aList if f not in null_rules]
+                for ch, aList in rulesDict.items()
+            }
+        else:
+            # plain.py defines a RulesDict class that has a rule for every character.
+            d = rulesDict
+        for ch, aList in d.items() if isinstance(d, dict) else []:
+            if not aList or len(ch) != 1:
+                continue
+            leadins.append(ch)
+            if ch in ' \t' and aList == [JEditColorizer.match_trailing_ws]:
+                ws_chars.append(ch)
+                continue
+            rules = [self.analyze_rule(f) for f in aList]
+            if len(rules) == 1 and rules[0] and rules[0] == ('match_keywords', {}):
+                keyword_chars.append(ch)
+                keywords_rule_name = aList[0].__name__
+            elif all(rule and rule[0] == 'match_seq' for rule in rules):
+                seqs = [keys for name, keys in rules]
+                if all(
+                    set(keys) <= set(self.seq_keys) and
+                    keys.get('seq') and isinstance(keys.get('seq'), str) and
+                    isinstance(keys.get('kind'), str) and
+                    not any(keys.get(z) for z in self.seq_keys[:4])
+                    for keys in seqs
+                ):
+                    pattern = re.compile('|'.join(f"({re.escape(z['seq'])})" for z in seqs))
+                    kinds = [z['kind'] for z in seqs]
+                    names = [f.__name__ for f in aList]
+                    seq_dict[ch] = (pattern, kinds, names)
+        if len(ws_chars) != 2:
+            ws_chars = []  # match_trailing_ws matches both blanks and tabs.
+        if not isinstance(rulesDict, dict):
+            skip_pat = re.compile('(?!)')  # Never matches.
+        elif leadins:
+            skip_pat = re.compile(f"[^{re.escape(''.join(sorted(leadins)))}]+")
+        else:
+            skip_pat = re.compile('.+', re.DOTALL)
+        ruleset = g.Bunch(
+            keyword_chars=frozenset(keyword_chars),
+            keywords_rule_name=keywords_rule_name,
+            original_rulesDict=rulesDict,
+            rulesDict=d,
+            seq_dict=seq_dict,
+            skip_pat=skip_pat,
+            ws_chars=frozenset(ws_chars),
+            ws_pat=re.compile(f"[{re.escape(''.join(ws_chars))}]+") if ws_chars else None,
+        )
+        self.compiled_rulesets[id(rulesDict)] = ruleset
+        return ruleset
     #@+node:ekr.20110605121601.18640: *3* jedit.recolor & helpers
-    def recolor(self, s):
+    def recolor(self, s, p=None):
         """
         jEdit.recolor: Recolor a *single* line, s.
         QSyntaxHighligher calls this method repeatedly and automatically.
+
+        p is the node being colored at idle time, or None for c.p.
         """
-        p = self.c.p
+        p = p or self.c.p
         self.recolorCount += 1
         block_n = self.currentBlockNumber()
         n = self.prevState()
@@ -2334,16 +2721,16 @@ class JEditColorizer(BaseJEditColorizer):
                 self.language = new_language
                 self.init(p)
         else:
-            self.updateSyntaxColorer(p)  # Force a full recolor
-            assert self.language
-            self.init_all_state(p.v)
-            self.init(p)
+            # Force a full recolor, reusing the cached lines if possible.
+            self.enter_cache_entry(p)
         if block_n == 0:
             n = self.initBlock0()
         n = self.setState(n)  # Required.
         # Always color the line, even if colorizing is disabled.
-        if s:
+        if s and not self.replay_line(block_n, n, s):
+            self.format_runs = []
             self.mainLoop(n, s)
+            self.cache_line(block_n, n, s)
     #@+node:ekr.20170126100139.1: *4* jedit.initBlock0
     def initBlock0(self):
         """
@@ -2390,6 +2777,8 @@ class JEditColorizer(BaseJEditColorizer):
         Init the colorizer so it will *skip* all patterns.
         The wikiview plugin calls this method.
         """
+        self.clear_color_cache()
+        self.compiled_rulesets.clear()
         d = self.rulesDict
         for leadins_list, pattern in zip(leadins, patterns):
             for ch in leadins_list:
@@ -2404,6 +2793,46 @@ class JEditColorizer(BaseJEditColorizer):
                     d[ch] = aList
         self.rulesDict = d
     #@-others
+#@+node:ekr.20211109081935.11: ** class PrecolorHighlighter
+class PrecolorHighlighter:
+    """
+    A stand-in for a LeoHighlighter, used to precolor bodies that are not in
+    any QTextDocument.
+    """
+    #@+others
+    #@+node:ekr.20211109081935.12: *3* precolor_h.ctor
+    def __init__(self):
+        self.block_n = -1
+        self.prev_state = -1
+        self.state = -1
+    #@+node:ekr.20211109081935.13: *3* precolor_h.QSyntaxHighlighter methods
+    def currentBlock(self):
+        return self
+
+    def currentBlockState(self):
+        return self.state
+
+    def previousBlockState(self):
+        return self.prev_state
+
+    def setCurrentBlockState(self, n):
+        self.state = n
+
+    def setFormat(self, i, length, format):
+        pass
+    #@+node:ekr.20211109081935.14: *3* precolor_h.QTextBlock methods
+    def blockNumber(self):
+        return self.block_n
+
+    def isValid(self):
+        return True
+    #@+node:ekr.20211109081935.15: *3* precolor_h.next_block
+    def next_block(self):
+        """Move to the next line."""
+        self.block_n += 1
+        self.prev_state = self.state
+        self.state = -1
+    #@-others
 #@+node:ekr.20110605121601.18565: ** class LeoHighlighter (QSyntaxHighlighter)
 # Careful: we may be running from the bridge.
 
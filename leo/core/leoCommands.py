@@ -124,11 +124,14 @@ class Commands:
     #@+node:ekr.20120217070122.10471: *5* c.initDocumentIvars
     def initDocumentIvars(self):
         """Init per-document ivars."""
+        self.directivesCache = g.DirectivesCache()  # The directives in each vnode.
         self.expansionLevel = 0  # The expansion level of this outline.
         self.expansionNode = None  # The last node we expanded or contracted.
         self.nodeConflictList = []  # List of nodes with conflicting read-time data.
         self.nodeConflictFileName: Optional[str] = None  # The fileName for c.nodeConflictList.
         self.user_dict = {}  # Non-persistent dictionary for free use by scripts and plugins.
+        self.vnode_observers: List[Set["leoNodes.VNode"]] = []  # c.touchVnodes adds vnodes to these sets.
+        self.status_observers: List[Set["leoNodes.VNode"]] = []  # The vnode observers that see status changes.
     #@+node:ekr.20120217070122.10467: *5* c.initEventIvars
     def initEventIvars(self):
         """Init ivars relating to gui events."""
@@ -816,14 +819,14 @@ class Commands:
     def all_nodes(self):
         """A generator returning all vnodes in the outline, in outline order."""
         c = self
-        for p in c.all_positions():
-            yield p.v
+        for v, level in c.walk_vnodes():
+            yield v
 
     def all_unique_nodes(self):
         """A generator returning each vnode of the outline."""
         c = self
-        for p in c.all_unique_positions(copy=False):
-            yield p.v
+        for v, level in c.walk_vnodes(unique=True):
+            yield v
 
     # Compatibility with old code...
 
@@ -835,10 +838,16 @@ class Commands:
     def all_positions(self, copy=True):
         """A generator return all positions of the outline, in outline order."""
         c = self
-        p = c.rootPosition()
-        while p:
-            yield p.copy() if copy else p
-            p.moveToThreadNext()
+        if not copy:
+            # Callers may move the yielded position.
+            p = c.rootPosition()
+            while p:
+                yield p
+                p.moveToThreadNext()
+            return
+        walker = c.walk_vnodes()
+        for v, level in walker:
+            yield walker.position()
 
     # Compatibility with old code...
 
@@ -898,13 +907,12 @@ class Commands:
             def predicate(p):
                 return p.isAnyAtFileNode()
 
-        p = c.rootPosition()
-        while p:
-            if predicate(p):
+        walker = c.walk_vnodes()
+        p = leoNodes.Position(None)
+        for v, level in walker:
+            if predicate(walker.position(p)):
                 yield p.copy()  # 2017/02/19
-                p.moveToNodeAfterTree()
-            else:
-                p.moveToThreadNext()
+                walker.skip_subtree()
     #@+node:ekr.20091001141621.6062: *5* c.all_unique_positions
     def all_unique_positions(self, copy=True):
         """
@@ -912,15 +920,21 @@ class Commands:
         Returns only the first position for each vnode.
         """
         c = self
-        p = c.rootPosition()
-        seen = set()
-        while p:
-            if p.v in seen:
-                p.moveToNodeAfterTree()
-            else:
-                seen.add(p.v)
-                yield p.copy() if copy else p
-                p.moveToThreadNext()
+        if not copy:
+            # Callers may move the yielded position.
+            p = c.rootPosition()
+            seen = set()
+            while p:
+                if p.v in seen:
+                    p.moveToNodeAfterTree()
+                else:
+                    seen.add(p.v)
+                    yield p
+                    p.moveToThreadNext()
+            return
+        walker = c.walk_vnodes(unique=True)
+        for v, level in walker:
+            yield walker.position()
 
     # Compatibility with old code...
 
@@ -942,14 +956,13 @@ class Commands:
                 return p.isAnyAtFileNode()
 
         seen = set()
-        p = c.rootPosition()
-        while p:
-            if p.v not in seen and predicate(p):
-                seen.add(p.v)
+        walker = c.walk_vnodes()
+        p = leoNodes.Position(None)
+        for v, level in walker:
+            if v not in seen and predicate(walker.position(p)):
+                seen.add(v)
                 yield p.copy() if copy else p
-                p.moveToNodeAfterTree()
-            else:
-                p.moveToThreadNext()
+                walker.skip_subtree()
     #@+node:ekr.20150316175921.5: *5* c.safe_all_positions
     def safe_all_positions(self, copy=True):
         """
@@ -961,6 +974,14 @@ class Commands:
         while p:
             yield p.copy() if copy else p
             p.safeMoveToThreadNext()
+    #@+node:ekr.20211109083054.4: *5* c.walk_vnodes
+    def walk_vnodes(self, unique=False):
+        """
+        Return a leoNodes.VNodeWalker yielding (v, level) for all vnodes of
+        the outline, in outline order, without allocating positions.
+        """
+        c = self
+        return leoNodes.VNodeWalker(c.hiddenRootNode, unique=unique)
     #@+node:ekr.20060906211747: *4* c.Getters
     #@+node:ekr.20040803140033: *5* c.currentPosition
     def currentPosition(self):
@@ -1196,6 +1217,59 @@ class Commands:
             limitIsVisible = not cc or not p.h.startswith('@chapter')
             return p, limitIsVisible
         return None, None
+    #@+node:ekr.20211109071946.1: *5* c.gnx2position & c.gnx2positions
+    def gnx2position(self, gnx):
+        """
+        Return the first position p in outline order such that p.gnx == gnx,
+        or None.
+
+        c.fileCommands.gnxDict maps gnxs to vnodes, so this method visits
+        only the ancestors of p.v and needs no bookkeeping when the outline
+        changes.
+        """
+        c = self
+        v = c.fileCommands.gnxDict.get(gnx)
+        if not v:
+            return None
+        # Keys are vnodes, values are the child indices leading to their
+        # first positions in outline order, or None for unlinked vnodes.
+        paths_d: Dict["leoNodes.VNode", Optional[List[int]]] = {c.hiddenRootNode: []}
+
+        def first_path(v):
+            if v in paths_d:
+                return paths_d[v]
+            paths_d[v] = None  # Guard against corrupted links.
+            result = None
+            for parent_v in v.parents:
+                path = first_path(parent_v)
+                if path is not None and v in parent_v.children:
+                    path = path + [parent_v.children.index(v)]
+                    if result is None or path < result:
+                        result = path
+            paths_d[v] = result
+            return result
+
+        path = first_path(v)
+        if not path:
+            return None
+        stack = []
+        v = c.hiddenRootNode
+        for n in path:
+            v = v.children[n]
+            stack.append((v, n))
+        v, n = stack.pop()
+        return leoNodes.Position(v, n, stack)
+
+    def gnx2positions(self, gnx):
+        """
+        Return a list of valid positions p such that p.gnx == gnx,
+        one for each of the distinct parents of p.v.
+        """
+        c = self
+        v = c.fileCommands.gnxDict.get(gnx)
+        if not v:
+            return []
+        return [p for p in c.vnode2allPositions(v) if c.positionExists(p)]
     #@+node:tbrown.20091206142842.10296: *5* c.vnode2allPositions
     def vnode2allPositions(self, v):
         """Given a VNode v, find all valid positions p such that p.v = v.
@@ -1447,9 +1521,11 @@ class Commands:
         Check the consistency of all gnx's and remove any tnodeLists.
         Reallocate gnx's for duplicates or empty gnx's.
         Return the number of structure_errors found.
+
+        This method visits each vnode once, however many clones it has.
         """
         c = self
-        d: Dict[str, Set["leoNodes.VNode"]] = {}  # Keys are gnx's; values are sets of vnodes with that gnx.
+        d: Dict[str, List["leoNodes.VNode"]] = {}  # Keys are gnx's; values are lists of vnodes with that gnx.
         ni = g.app.nodeIndices
         t1 = time.time()
 
@@ -1457,24 +1533,37 @@ class Commands:
             """Set v.fileIndex."""
             v.fileIndex = ni.getNewIndex(v)
 
-        count, gnx_errors = 0, 0
-        for p in c.safe_all_positions(copy=False):
-            count += 1
-            v = p.v
+        # Find each vnode in the outline once, in outline order.
+        vnodes: List["leoNodes.VNode"] = []
+        seen: Set["leoNodes.VNode"] = set()
+        stack = [iter(c.hiddenRootNode.children)]
+        while stack:
+            for v in stack[-1]:
+                if v not in seen:
+                    seen.add(v)
+                    vnodes.append(v)
+                    stack.append(iter(v.children))
+                    break
+            else:
+                stack.pop()
+        count, gnx_errors = len(vnodes), 0
+        for v in vnodes:
             if hasattr(v, "tnodeList"):
                 delattr(v, "tnodeList")
                 v._p_changed = True
             gnx = v.fileIndex
             if gnx:  # gnx must be a string.
-                aSet: Set["leoNodes.VNode"] = d.get(gnx, set())
-                aSet.add(v)
-                d[gnx] = aSet
+                aList = d.get(gnx)
+                if aList is None:
+                    d[gnx] = [v]
+                else:
+                    aList.append(v)
             else:
                 gnx_errors += 1
                 new_gnx(v)
-                g.es_print(f"empty v.fileIndex: {v} new: {p.v.gnx!r}", color='red')
+                g.es_print(f"empty v.fileIndex: {v} new: {v.gnx!r}", color='red')
         for gnx in sorted(d.keys()):
-            aList = list(d.get(gnx))
+            aList = d.get(gnx)
             if len(aList) != 1:
                 print('\nc.checkGnxs...')
                 g.es_print(f"multiple vnodes with gnx: {gnx!r}", color='red')
@@ -1498,127 +1587,73 @@ class Commands:
                 f"check-outline OK: {t2 - t1:4.2f} sec. "
                 f"{c.shortFileName()} {count} nodes")
         return g.app.structure_errors
-    #@+node:ekr.20150318131947.7: *4* c.checkLinks & helpers
+    #@+node:ekr.20150318131947.7: *4* c.checkLinks
     def checkLinks(self):
-        """Check the consistency of all links in the outline."""
+        """
+        Check the consistency of all links in the outline:
+
+        - Each vnode appears in the parents list of each of its children
+          exactly as often as the child appears in the vnode's children list.
+        - All the parents of a vnode are in the outline.
+        - No vnode is its own ancestor.
+
+        Return the number of errors found.
+
+        This method visits each vnode and each link once, however many
+        clones the outline contains.
+        """
         c = self
         t1 = time.time()
-        count, errors = 0, 0
-        for p in c.safe_all_positions():
-            count += 1
-            # try:
-            if not c.checkThreadLinks(p):
-                errors += 1
-                break
-            if not c.checkSiblings(p):
-                errors += 1
-                break
-            if not c.checkParentAndChildren(p):
-                errors += 1
-                break
-            # except AssertionError:
-                # errors += 1
-                # junk, value, junk = sys.exc_info()
-                # g.error("test failed at position %s\n%s" % (repr(p), value))
+        hidden = c.hiddenRootNode
+        # Keys are (parent_v, child_v) tuples, values are counts.
+        links: Dict[Tuple["leoNodes.VNode", "leoNodes.VNode"], int] = {}
+        errors = 0
+
+        def report(message):
+            nonlocal errors
+            errors += 1
+            if errors <= 20:
+                g.es_print(f"check-links: {message}", color='red')
+
+        # Count the child links, checking for cycles.
+        seen, on_stack = {hidden}, {hidden}
+        stack = [(hidden, iter(hidden.children))]
+        while stack:
+            parent_v, it = stack[-1]
+            for v in it:
+                key = (parent_v, v)
+                links[key] = links.get(key, 0) + 1
+                if v in on_stack:
+                    report(f"{v} is its own ancestor")
+                elif v not in seen:
+                    seen.add(v)
+                    on_stack.add(v)
+                    stack.append((v, iter(v.children)))
+                    break
+            else:
+                stack.pop()
+                on_stack.discard(parent_v)
+        # Match the parent links with the child links.
+        for v in seen:
+            for parent_v in v.parents:
+                key = (parent_v, v)
+                n = links.get(key)
+                if n:
+                    links[key] = n - 1
+                elif parent_v in seen:
+                    report(f"{v} has parent {parent_v}, which does not contain it")
+                else:
+                    report(f"{v} has parent {parent_v}, which is not in the outline")
+        for (parent_v, v), n in links.items():
+            if n:
+                report(f"{v} is a child of {parent_v}, which is not its parent")
+        if errors > 20:
+            g.es_print(f"check-links: {errors - 20} more errors", color='red')
         t2 = time.time()
         g.es_print(
             f"check-links: {t2 - t1:4.2f} sec. "
-            f"{c.shortFileName()} {count} nodes", color='blue')
+            f"{c.shortFileName()} {len(seen) - 1} nodes", color='blue')
         return errors
-    #@+node:ekr.20040314035615.2: *5* c.checkParentAndChildren
-    def checkParentAndChildren(self, p):
-        """Check consistency of parent and child data structures."""
-        c = self
-
-        def _assert(condition):
-            return g._assert(condition, show_callers=False)
-
-        def dump(p):
-            if p and p.v:
-                p.v.dump()
-            elif p:
-                print('<no p.v>')
-            else:
-                print('<no p>')
-            if g.unitTesting:
-                assert False, g.callers()
-
-        if p.hasParent():
-            n = p.childIndex()
-            if not _assert(p == p.parent().moveToNthChild(n)):
-                g.trace(f"p != parent().moveToNthChild({n})")
-                dump(p)
-                dump(p.parent())
-                return False
-        if p.level() > 0 and not _assert(p.v.parents):
-            g.trace("no parents")
-            dump(p)
-            return False
-        for child in p.children():
-            if not c.checkParentAndChildren(child):
-                return False
-            if not _assert(p == child.parent()):
-                g.trace("p != child.parent()")
-                dump(p)
-                dump(child.parent())
-                return False
-        if p.hasNext():
-            if not _assert(p.next().parent() == p.parent()):
-                g.trace("p.next().parent() != p.parent()")
-                dump(p.next().parent())
-                dump(p.parent())
-                return False
-        if p.hasBack():
-            if not _assert(p.back().parent() == p.parent()):
-                g.trace("p.back().parent() != parent()")
-                dump(p.back().parent())
-                dump(p.parent())
-                return False
-        # Check consistency of parent and children arrays.
-        # Every nodes gets visited, so a strong test need only check consistency
-        # between p and its parent, not between p and its children.
-        parent_v = p._parentVnode()
-        n = p.childIndex()
-        if not _assert(parent_v.children[n] == p.v):
-            g.trace("parent_v.children[n] != p.v")
-            parent_v.dump()
-            p.v.dump()
-            return False
-        return True
-    #@+node:ekr.20040314035615.1: *5* c.checkSiblings
-    def checkSiblings(self, p):
-        """Check the consistency of next and back links."""
-        back = p.back()
-        next = p.next()
-        if back:
-            if not g._assert(p == back.next()):
-                g.trace(
-                    f"p!=p.back().next()\n"
-                    f"     back: {back}\n"
-                    f"back.next: {back.next()}")
-                return False
-        if next:
-            if not g._assert(p == next.back()):
-                g.trace(
-                    f"p!=p.next().back\n"
-                    f"     next: {next}\n"
-                    f"next.back: {next.back()}")
-                return False
-        return True
-    #@+node:ekr.20040314035615: *5* c.checkThreadLinks
-    def checkThreadLinks(self, p):
-        """Check consistency of threadNext & threadBack links."""
-        threadBack = p.threadBack()
-        threadNext = p.threadNext()
-        if threadBack:
-            if not g._assert(p == threadBack.threadNext()):
-                g.trace("p!=p.threadBack().threadNext()")
-                return False
-        if threadNext:
-            if not g._assert(p == threadNext.threadBack()):
-                g.trace("p!=p.threadNext().threadBack()")
-                return False
-        return True
     #@+node:ekr.20031218072017.1760: *4* c.checkMoveWithParentWithWarning & c.checkDrag
     #@+node:ekr.20070910105044: *5* c.checkMoveWithParentWithWarning
     def checkMoveWithParentWithWarning(self, root, parent, warningFlag):
@@ -1653,18 +1688,117 @@ class Commands:
                 return False
         return True
     #@+node:ekr.20031218072017.2072: *4* c.checkOutline
-    def checkOutline(self, event=None, check_links=False):
+    def checkOutline(self, event=None, check_links=False, vnodes=None):
         """
         Check for errors in the outline.
         Return the count of serious structure errors.
+
+        vnodes: Check the gnx's and links of only these vnodes, typically
+        the vnodes whose links an undo or redo changed. Such checks are
+        cheap enough to do after every undo.
         """
         # The check-outline command sets check_links = True.
         c = self
         g.app.structure_errors = 0
+        if vnodes is not None:
+            return c.checkTouchedVnodes(vnodes)
         structure_errors = c.checkGnxs()
         if check_links and not structure_errors:
             structure_errors += c.checkLinks()
         return structure_errors
+    #@+node:ekr.20211109082917.1: *4* c.checkTouchedVnodes
+    def checkTouchedVnodes(self, vnodes):
+        """
+        Check the gnx's and links of the given vnodes, ignoring deleted vnodes.
+        Reallocate gnx's for duplicates or empty gnx's.
+        Return the number of structure errors found.
+
+        The checks are local: each vnode is checked against its parents,
+        its children, its ancestors and c.fileCommands.gnxDict.
+        """
+        c = self
+        gnxDict = c.fileCommands.gnxDict
+        hidden = c.hiddenRootNode
+        ni = g.app.nodeIndices
+        errors = 0
+
+        def report(message):
+            nonlocal errors
+            errors += 1
+            g.es_print(f"check-outline: {message}", color='red')
+
+        for v in vnodes:
+            if v is hidden or not v.parents:
+                continue
+            # Check the gnx.
+            gnx = v.fileIndex
+            if not gnx:
+                v.fileIndex = ni.getNewIndex(v)
+                g.es_print(f"empty v.fileIndex: {v} new: {v.gnx!r}", color='red')
+            else:
+                v2 = gnxDict.get(gnx)
+                if v2 is not None and v2 is not v and v2.parents:
+                    g.es_print(f"multiple vnodes with gnx: {gnx!r}", color='red')
+                    for z in (v, v2):
+                        g.es_print(f"id(v): {id(z)} gnx: {z.fileIndex} {z.h}", color='red')
+                        z.fileIndex = ni.getNewIndex(z)
+            # Check the links to and from the children and parents.
+            d: Dict["leoNodes.VNode", int] = {}
+            for child in v.children:
+                d[child] = d.get(child, 0) + 1
+            for child, n in d.items():
+                if child.parents.count(v) != n:
+                    report(f"{child} is a child of {v}, which is not its parent")
+            d = {}
+            for parent_v in v.parents:
+                d[parent_v] = d.get(parent_v, 0) + 1
+            for parent_v, n in d.items():
+                if parent_v is not hidden and not parent_v.parents:
+                    report(f"{v} has parent {parent_v}, which is not in the outline")
+                elif parent_v.children.count(v) != n:
+                    report(f"{v} has parent {parent_v}, which does not contain it")
+            # Check that v is not its own ancestor.
+            if v.children:
+                seen, stack = set(), list(v.parents)
+                while stack:
+                    parent_v = stack.pop()
+                    if parent_v is v:
+                        report(f"{v} is its own ancestor")
+                        break
+                    if parent_v not in seen:
+                        seen.add(parent_v)
+                        stack.extend(parent_v.parents)
+        return g.app.structure_errors + errors
+    #@+node:ekr.20211109083231.11: *4* c.touchVnodes & vnode observers
+    def touchVnodes(self, vnodes, status=False):
+        """
+        Add the given vnodes, whose links or contents have changed, to all the
+        sets in c.vnode_observers.
+
+        status: True if only the vnodes' status bits have changed. Only the
+                sets in c.status_observers see such changes.
+        """
+        for aSet in self.status_observers if status else self.vnode_observers:
+            aSet.update(vnodes)
+
+    def addVnodeObserver(self, status=True):
+        """
+        Return a new set to which c.touchVnodes will add vnodes.
+        Call c.removeVnodeObserver when the set is no longer needed.
+
+        status: False if the set should ignore changes to status bits.
+        """
+        aSet: Set["leoNodes.VNode"] = set()
+        self.vnode_observers.append(aSet)
+        if status:
+            self.status_observers.append(aSet)
+        return aSet
+
+    def removeVnodeObserver(self, aSet):
+        """Stop adding vnodes to aSet."""
+        # Compare identities: observers' sets may be equal.
+        self.vnode_observers = [z for z in self.vnode_observers if z is not aSet]
+        self.status_observers = [z for z in self.status_observers if z is not aSet]
     #@+node:ekr.20031218072017.1765: *4* c.validateOutline
     # Makes sure all nodes are valid.
 
@@ -2150,6 +2284,8 @@ class Commands:
         if len(c.recent_commands_list) > 99:
             c.recent_commands_list.pop()
         c.recent_commands_list.insert(0, command_name)
+        stats = g.app.perfStats
+        t1 = time.perf_counter() if stats.enabled else None
         if not g.doHook("command1", c=c, p=p, label=command_name):
             try:
                 c.inCommand = True
@@ -2177,6 +2313,8 @@ class Commands:
         if c and c.exists:
             p = c.p
             g.doHook("command2", c=c, p=p, label=command_name)
+        if t1 is not None:
+            stats.record('commands', command_name, time.perf_counter() - t1)
         return return_value
     #@+node:ekr.20200522075411.1: *4* c.doCommandByName
     def doCommandByName(self, command_name, event):
@@ -2701,6 +2839,34 @@ class Commands:
         if g.app.externalFilesController:
             return g.app.externalFilesController.check_overwrite(c, fn)
         return True
+    #@+node:ekr.20211109062939.1: *4* c.compactOutline
+    def compactOutline(self):
+        """
+        Reduce the memory used by c's vnodes without changing the outline:
+
+        - Intern all headlines, so that equal headlines share one string.
+        - Trim the unused capacity of all children and parents lists.
+        - Remove empty uA dicts. v.u recreates them when needed.
+
+        Return the number of vnodes.
+        """
+        c = self
+        intern = sys.intern
+        seen = set()
+        stack = [c.hiddenRootNode]
+        while stack:
+            v = stack.pop()
+            if v in seen:
+                continue
+            seen.add(v)
+            if isinstance(v._headString, str):
+                v._headString = intern(v._headString)
+            v.children = v.children[:]
+            v.parents = v.parents[:]
+            if hasattr(v, 'unknownAttributes') and not v.unknownAttributes:
+                delattr(v, 'unknownAttributes')
+            stack.extend(v.children)
+        return len(seen)
     #@+node:ekr.20090212054250.9: *4* c.createNodeFromExternalFile
     def createNodeFromExternalFile(self, fn):
         """
@@ -4041,12 +4207,16 @@ class Commands:
             changed_node = False
         u.afterChangeGroup(parent, undoType, undoData)
         return parent  # actually the last created/found position
-    #@+node:ekr.20100802121531.5804: *4* c.deletePositionsInList
+    #@+node:ekr.20100802121531.5804: *4* c.deletePositionsInList & helpers
     def deletePositionsInList(self, aList, redraw=True):
         """
         Delete all vnodes corresponding to the positions in aList.
 
         See "Theory of operation of c.deletePositionsInList" in LeoDocs.leo.
+
+        Return a list of (parent gnx, child index, child gnx, deleted)
+        tuples. deleted is True for the first link to each vnode that is no
+        longer in the outline.
         """
         # New implementation by Vitalije 2020-03-17 17:29
         c = self
@@ -4060,17 +4230,46 @@ class Commands:
             return p._childIndex, parent_v
 
         links_to_be_cut = sorted(set(map(p2link, aList)), key=lambda x: -x[0])
-        undodata = []
+        links = []
         for i, v in links_to_be_cut:
             ch = v.children.pop(i)
             ch.parents.remove(v)
-            undodata.append((v.gnx, i, ch.gnx))
+            c.touchVnodes((v, ch))
+            links.append((v, i, ch))
+        # Cut the subtrees' parent links only after cutting all the links in
+        # aList: aList may contain both a position and its descendants.
+        undodata, seen = [], set()
+        for v, i, ch in links:
+            undodata.append((v.gnx, i, ch.gnx, not ch.parents and ch not in seen))
+            seen.add(ch)
+        c.cutDeletedParentLinks(undodata)
         if redraw:
             if not c.positionExists(c.p):
                 c.setCurrentPosition(c.rootPosition())
             c.redraw()
         return undodata
 
+    #@+node:ekr.20211109083231.9: *5* c.cutDeletedParentLinks
+    def cutDeletedParentLinks(self, data):
+        """
+        Remove the stale parent links in the subtrees of the vnodes that
+        c.deletePositionsInList deleted, as v._cutLink does.
+        """
+        gnx2v = self.fileCommands.gnxDict
+        for pgnx, i, chgnx, deleted in data:
+            if deleted:
+                ch = gnx2v[chgnx]
+                for child in ch.children:
+                    child._cutParentLinks(ch)
+    #@+node:ekr.20211109083231.10: *5* c.restoreDeletedParentLinks
+    def restoreDeletedParentLinks(self, data):
+        """Undo c.cutDeletedParentLinks(data)."""
+        gnx2v = self.fileCommands.gnxDict
+        for pgnx, i, chgnx, deleted in reversed(data):
+            if deleted:
+                ch = gnx2v[chgnx]
+                for child in reversed(ch.children):
+                    child._addParentLinks(ch)
     #@+node:vitalije.20200318161844.1: *4* c.undoableDeletePositions
     def undoableDeletePositions(self, aList):
         """
@@ -4079,29 +4278,37 @@ class Commands:
         """
         c = self
         u = c.undoer
+        bunch = u.createCommonBunch(c.p)
         data = c.deletePositionsInList(aList)
-        gnx2v = c.fileCommands.gnxDict
+        hidden, gnxDict = c.hiddenRootNode, c.fileCommands.gnxDict
+        def gnx2v(gnx):
+            return hidden if gnx == hidden.gnx else gnxDict[gnx]
         def undo():
-            for pgnx, i, chgnx in reversed(u.getBead(u.bead).data):
-                v = gnx2v[pgnx]
-                ch = gnx2v[chgnx]
+            data = u.getBead(u.bead).data
+            c.restoreDeletedParentLinks(data)
+            for pgnx, i, chgnx, deleted in reversed(data):
+                v = gnx2v(pgnx)
+                ch = gnx2v(chgnx)
                 v.children.insert(i, ch)
                 ch.parents.append(v)
+                c.touchVnodes((v, ch))
             if not c.positionExists(c.p):
                 c.setCurrentPosition(c.rootPosition())
         def redo():
-            for pgnx, i, chgnx in u.getBead(u.bead + 1).data:
-                v = gnx2v[pgnx]
+            data = u.getBead(u.bead + 1).data
+            for pgnx, i, chgnx, deleted in data:
+                v = gnx2v(pgnx)
                 ch = v.children.pop(i)
                 ch.parents.remove(v)
+                c.touchVnodes((v, ch))
+            c.cutDeletedParentLinks(data)
             if not c.positionExists(c.p):
                 c.setCurrentPosition(c.rootPosition())
-        u.pushBead(g.Bunch(
-            data=data,
-            undoType='delete nodes',
-            undoHelper=undo,
-            redoHelper=redo,
-        ))
+        bunch.data = data
+        bunch.undoType = 'delete nodes'
+        bunch.undoHelper = undo
+        bunch.redoHelper = redo
+        u.pushBead(bunch)
     #@+node:ekr.20091211111443.6265: *4* c.doBatchOperations & helpers
     def doBatchOperations(self, aList=None):
         # Validate aList and create the parents dict
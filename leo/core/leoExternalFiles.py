@@ -2,9 +2,13 @@
 #@+leo-ver=5-thin
 #@+node:ekr.20160306114544.1: * @file leoExternalFiles.py
 #@@first
+import ctypes
+import ctypes.util
 import getpass
 import os
+import struct
 import subprocess
+import sys
 import tempfile
 from leo.core import leoGlobals as g
 #@+others
@@ -67,6 +71,14 @@ class ExternalFilesController:
         self.has_changed_d = {}
             # Keys are commanders. Values are bools.
             # Used only to limit traces.
+        self.path_d = {}
+            # For efc.idle_check_watcher.
+            # Keys are real paths, values are lists of (c, v) tuples.
+        self.registered_commanders = set()
+            # Commanders whose @<file> nodes are in self.path_d.
+        self.touched_d = {}
+            # For efc.register_commander.
+            # Keys are registered commanders, values are vnode observers.
         self.unchecked_commanders = []
             # Copy of g.app.commanders()
         self.unchecked_files = []
@@ -75,6 +87,9 @@ class ExternalFilesController:
             # Keys are full paths, values are modification times.
             # DO NOT alter directly, use set_time(path) and
             # get_time(path), see set_time() for notes.
+        self.watcher = None
+            # An InotifyWatcher, or None if efc.on_idle polls all files.
+        self.watcher_inited = False
         self.yesno_all_answer = None  # answer, 'yes-all', or 'no-all'
         g.app.idleTimeManager.add_callback(self.on_idle)
     #@+node:ekr.20150405105938.1: *3* efc.entries
@@ -138,12 +153,21 @@ class ExternalFilesController:
             c = g.app.log and g.app.log.c
             if c:
                 c.outerUpdate()
+        if not self.watcher_inited:
+            self.watcher_inited = True
+            self.watcher = self.create_watcher()
+            if self.watcher:
+                for ef in self.files:
+                    self.watcher.add_path(g.os_path_realpath(ef.path))
         # Fix #262: Improve performance when @bool check-for-changed-external-files is True.
         if self.unchecked_files:
             # Check all external files.
             while self.unchecked_files:
                 ef = self.unchecked_files.pop()  # #1959: ensure progress.
                 self.idle_check_open_with_file(c, ef)
+        elif self.watcher:
+            # Check only the files for which the watcher has seen changes.
+            self.idle_check_watcher()
         elif self.unchecked_commanders:
             # Check the next commander for which
             # @bool check_for_changed_external_file is True.
@@ -172,22 +196,30 @@ class ExternalFilesController:
             if not p.isAnyAtFileNode():
                 continue
             path = g.fullPath(c, p)
-            if not self.has_changed(path):
-                continue
-            # Prevent further checks for path.
-            self.set_time(path)
-            self.checksum_d[path] = self.checksum(path)
-            # Check file.
-            if p.isAtAsisFileNode() or p.isAtNoSentFileNode():
-                # #1081: issue a warning.
-                self.warn(c, path, p=p)
-                continue
-            if state in ('yes', 'no'):
-                state = self.ask(c, path, p=p)
-            if state in ('yes', 'yes-all'):
-                c.redraw(p=p)
-                c.refreshFromDisk(p)
-                c.redraw()
+            state = self.idle_check_at_file_node(c, p, path, state)
+    #@+node:ekr.20211109054250.1: *5* efc.idle_check_at_file_node
+    def idle_check_at_file_node(self, c, p, path, state):
+        """
+        Check the @<file> node at p, whose full path is path, for changes.
+        Return the new state: one of ('yes', 'no', 'yes-all', 'no-all').
+        """
+        if not self.has_changed(path):
+            return state
+        # Prevent further checks for path.
+        self.set_time(path)
+        self.checksum_d[path] = self.checksum(path)
+        # Check file.
+        if p.isAtAsisFileNode() or p.isAtNoSentFileNode():
+            # #1081: issue a warning.
+            self.warn(c, path, p=p)
+            return state
+        if state in ('yes', 'no'):
+            state = self.ask(c, path, p=p)
+        if state in ('yes', 'yes-all'):
+            c.redraw(p=p)
+            c.refreshFromDisk(p)
+            c.redraw()
+        return state
     #@+node:ekr.20201207055713.1: *5* efc.idle_check_leo_file
     def idle_check_leo_file(self, c):
         """Check c's .leo file for external changes."""
@@ -203,6 +235,142 @@ class ExternalFilesController:
             # Do a complete restart of Leo.
             g.es_print('restarting Leo...')
             c.restartLeo()
+    #@+node:ekr.20211109054427.1: *5* efc.idle_check_watcher & helpers
+    def idle_check_watcher(self):
+        """
+        Check only the external files that have changed since the last call,
+        as reported by self.watcher, without polling any other files.
+        Queue the changed open-with files in self.unchecked_files.
+        """
+        commanders = [z for z in g.app.commanders() if self.is_enabled(z)]
+        # Forget closed commanders.
+        closed = self.registered_commanders - set(commanders)
+        if closed:
+            self.registered_commanders -= closed
+            self.unregister_commanders(closed)
+        # Watch the files of newly opened commanders.
+        for c in commanders:
+            if c not in self.registered_commanders:
+                self.register_commander(c)
+        changed = self.watcher.changed_paths()
+        if changed:
+            self.unchecked_files = [
+                z for z in self.files if g.os_path_realpath(z.path) in changed
+            ]
+        state = 'no'
+        for path in sorted(changed):
+            state = self.idle_check_path(path, commanders, state)
+    #@+node:ekr.20211109054604.1: *6* efc.idle_check_path
+    def idle_check_path(self, path, commanders, state):
+        """
+        Check all @<file> nodes whose full path is path, given by self.path_d.
+        Return the new state: one of ('yes', 'no', 'yes-all', 'no-all').
+        """
+        # Check .leo files.
+        for c in commanders:
+            if c.fileName() and g.os_path_realpath(c.fileName()) == path:
+                self.idle_check_leo_file(c)
+                # Saving the outline may have added or removed @<file> nodes.
+                self.register_commander(c)
+        aList = self.path_d.get(path)
+        if not aList:
+            # Ignore paths that belong to no @<file> node.
+            return state
+        positions = self.positions_for_path(path, commanders)
+        if len(positions) < len(aList):
+            # Some outlines have changed since self.path_d was computed.
+            for c in {z[0] for z in aList}:
+                if c in commanders:
+                    self.register_commander(c)
+            positions = self.positions_for_path(path, commanders)
+        for c, p in positions:
+            state = self.idle_check_at_file_node(c, p, g.fullPath(c, p), state)
+        return state
+    #@+node:ekr.20211109054741.1: *6* efc.positions_for_path
+    def positions_for_path(self, path, commanders):
+        """
+        Return a list of (c, p) for all *valid* entries of self.path_d[path].
+        """
+        result = []
+        for c, v in self.path_d.get(path, []):
+            if c not in commanders:
+                continue
+            p = c.vnode2position(v)
+            if (
+                p and p.isAnyAtFileNode() and
+                g.os_path_realpath(g.fullPath(c, p)) == path
+            ):
+                result.append((c, p))
+        return result
+    #@+node:ekr.20211109054918.1: *6* efc.register_commander
+    def register_commander(self, c):
+        """
+        Watch c's .leo file and all its external files, updating self.path_d.
+
+        The first call scans c's entire outline. Later calls rescan only the
+        subtrees of vnodes whose links or contents have changed since then.
+        """
+        self.registered_commanders.add(c)
+        if c.fileName():
+            self.watcher.add_path(g.os_path_realpath(c.fileName()))
+        touched = self.touched_d.get(c)
+        if touched is None:
+            self.unregister_commanders({c})
+            self.touched_d[c] = c.addVnodeObserver(status=False)
+            positions = c.all_unique_positions()
+        else:
+            vnodes = self.changed_subtrees(c, touched)
+            touched.clear()
+            self.unregister_vnodes(c, vnodes)
+            positions = self.positions_for_vnodes(c, vnodes)
+        for p in positions:
+            if p.isAnyAtFileNode():
+                path = g.os_path_realpath(g.fullPath(c, p))
+                aList = self.path_d.setdefault(path, [])
+                aList.append((c, p.v),)
+                self.watcher.add_path(path)
+    #@+node:ekr.20211109083231.23: *7* efc.changed_subtrees & positions_for_vnodes
+    def changed_subtrees(self, c, touched):
+        """Return the set of all vnodes in the subtrees of the touched vnodes."""
+        result = set()
+        # The hidden root is touched whenever top-level nodes move.
+        stack = [v for v in touched if v is not c.hiddenRootNode]
+        while stack:
+            v = stack.pop()
+            if v not in result:
+                result.add(v)
+                stack.extend(v.children)
+        return result
+
+    def positions_for_vnodes(self, c, vnodes):
+        """Yield a position for each @<file> vnode that is still in c's outline."""
+        for v in vnodes:
+            if v.isAnyAtFileNode():
+                p = c.vnode2position(v)
+                if p and c.positionExists(p):
+                    yield p
+    #@+node:ekr.20211109083231.2: *6* efc.unregister_commanders & unregister_vnodes
+    def unregister_commanders(self, commanders):
+        """Remove all entries for the given set of commanders from self.path_d."""
+        for c in commanders:
+            touched = self.touched_d.pop(c, None)
+            if touched is not None:
+                c.removeVnodeObserver(touched)
+        for path in list(self.path_d):
+            aList = [z for z in self.path_d[path] if z[0] not in commanders]
+            if aList:
+                self.path_d[path] = aList
+            else:
+                del self.path_d[path]
+
+    def unregister_vnodes(self, c, vnodes):
+        """Remove all entries for c and the given set of vnodes from self.path_d."""
+        for path in list(self.path_d):
+            aList = [z for z in self.path_d[path] if z[0] is not c or z[1] not in vnodes]
+            if aList:
+                self.path_d[path] = aList
+            else:
+                del self.path_d[path]
     #@+node:ekr.20150407124259.1: *5* efc.idle_check_open_with_file & helper
     def idle_check_open_with_file(self, c, ef):
         """Update the open-with node given by ef."""
@@ -383,6 +551,8 @@ class ExternalFilesController:
         time = self.get_mtime(path)
         self.files = [z for z in self.files if z.path != path]
         self.files.append(ExternalFile(c, ext, p, path, time))
+        if self.watcher:
+            self.watcher.add_path(g.os_path_realpath(path))
         return path
     #@+node:ekr.20031218072017.2829: *5* efc.open_file_in_external_editor
     def open_file_in_external_editor(self, c, d, fn, testing=False):
@@ -482,6 +652,12 @@ class ExternalFilesController:
         for ef in self.files[:]:
             self.destroy_temp_file(ef)
         self.files = []
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = None
+        self.unregister_commanders(self.registered_commanders)
+        self.path_d = {}
+        self.registered_commanders = set()
     #@+node:ekr.20150405110219.1: *3* efc.utilities
     # pylint: disable=no-value-for-parameter
     #@+node:ekr.20150405200212.1: *4* efc.ask
@@ -525,6 +701,20 @@ class ExternalFilesController:
         #
         # #1888: return one of ('yes', 'no', 'yes-all', 'no-all')
         return result.lower() if result else 'no'
+    #@+node:ekr.20211109055055.1: *4* efc.create_watcher
+    def create_watcher(self):
+        """
+        Return an InotifyWatcher, or None if efc.on_idle must poll all files.
+        """
+        if not sys.platform.startswith('linux'):
+            return None
+        if not g.app.config or not g.app.config.getBool('watch-external-files', default=True):
+            return None
+        try:
+            return InotifyWatcher()
+        except Exception:
+            # Fall back to polling.
+            return None
     #@+node:ekr.20150404052819.1: *4* efc.checksum
     def checksum(self, path):
         """Return the checksum of the file at the given path."""
@@ -614,6 +804,9 @@ class ExternalFilesController:
         """
         t = new_time or self.get_mtime(path)
         self._time_d[g.os_path_realpath(path)] = t
+        if self.watcher:
+            # Leo has just read or written the file. Watch it from now on.
+            self.watcher.add_path(g.os_path_realpath(path))
     #@+node:ekr.20190218055230.1: *4* efc.warn
     def warn(self, c, path, p):
         """
@@ -637,6 +830,93 @@ class ExternalFilesController:
             title='External file changed',
         )
     #@-others
+#@+node:ekr.20211109055232.1: ** class InotifyWatcher
+class InotifyWatcher:
+    """
+    Report changes to a set of files using Linux's inotify api, via ctypes.
+
+    The watcher watches the *directories* containing the files, so it
+    reports files replaced by editors that write a new file and rename it.
+    """
+
+    # Flags from <sys/inotify.h>.
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    mask = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    event_header = struct.Struct('iIII')  # wd, mask, cookie, len.
+
+    def __init__(self):
+        """Ctor for the InotifyWatcher class. Raise OSError on failure."""
+        name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = ctypes.CDLL(name, use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.paths = set()  # The real paths of all watched files.
+        self.overflow = False  # True: the kernel dropped events.
+        self.wd_d = {}  # Keys are watch descriptors, values are directories.
+        self.dir_d = {}  # Keys are directories, values are watch descriptors.
+    #@+others
+    #@+node:ekr.20211109055409.1: *3* watcher.add_path
+    def add_path(self, path):
+        """Watch the file at the given real path."""
+        if not path or path in self.paths:
+            return
+        directory = os.path.dirname(path)
+        if directory not in self.dir_d:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.mask)
+            if wd < 0:
+                return  # The directory does not exist, or can not be watched.
+            self.wd_d[wd] = directory
+            self.dir_d[directory] = wd
+        self.paths.add(path)
+    #@+node:ekr.20211109055546.1: *3* watcher.changed_paths
+    def changed_paths(self):
+        """
+        Return the set of watched paths that have changed since the last call.
+        This method never blocks.
+        """
+        result = set()
+        header = self.event_header
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            except OSError:
+                break
+            if not data:
+                break
+            i = 0
+            while i + header.size <= len(data):
+                wd, mask, cookie, n = header.unpack_from(data, i)
+                i += header.size
+                name = data[i : i + n].rstrip(b'\0')
+                i += n
+                if mask & self.IN_Q_OVERFLOW:
+                    self.overflow = True
+                directory = self.wd_d.get(wd)
+                if directory and name:
+                    path = os.path.join(directory, os.fsdecode(name))
+                    if path in self.paths:
+                        result.add(path)
+        if self.overflow:
+            # Events have been lost. Assume all files have changed.
+            self.overflow = False
+            return set(self.paths)
+        return result
+    #@+node:ekr.20211109055723.1: *3* watcher.close
+    def close(self):
+        """Close the inotify file descriptor, releasing all watches."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+    #@-others
 #@-others
 #@@language python
 #@@tabwidth -4
@@ -8,7 +8,8 @@ Gui-independent fast-redraw code.
 For an explanation, see this thread:
 https://groups.google.com/forum/#!topic/leo-editor/hpHyHU2sWtM
 """
-import difflib
+import bisect
+from collections import defaultdict, deque
 import re
 import time
 from typing import List
@@ -87,14 +88,15 @@ class FastRedraw:
             return [z.strip() for z in aList]
         #@+others # Define local helpers
         #@-others
-        d = difflib.SequenceMatcher(None, a, b)
-        op_codes = list(d.get_opcodes())
+        op_codes = self.get_opcodes(a, b)
         # dump_diff_op_codes(a, b, op_codes)
         #
         # Generate the instruction list, and verify the result.
         opcodes, result = [], []
         for tag, i1, i2, j1, j2 in op_codes:
-            if tag == 'insert':
+            if tag == 'equal':
+                pass
+            elif tag == 'insert':
                 opcodes.append(['insert', i1, gnxs(b[j1:j2])])
             elif tag == 'delete':
                 opcodes.append(['delete', i1, gnxs(a[i1:i2])])
@@ -109,6 +111,111 @@ class FastRedraw:
             print('app.make_redraw_list: opcodes after peephole...')
             self.dump_opcodes(opcodes)
         return opcodes
+    #@+node:ekr.20211109075206.1: ** LeoGui.get_opcodes & helpers
+    def get_opcodes(self, a, b):
+        """
+        Diff the a (old) and b (new) flattened outlines in O(N log N) time.
+
+        Return a list of (tag, i1, i2, j1, j2) tuples, like
+        difflib.SequenceMatcher.get_opcodes.
+
+        Entries must start with "level:gnx:". Entries with the same level and
+        gnx but different contents (headlines, say) become one-line replaces.
+        """
+        n, m = len(a), len(b)
+        # Find the common prefix and suffix.
+        i = 0
+        while i < n and i < m and a[i] == b[i]:
+            i += 1
+        j = 0
+        while j < n - i and j < m - i and a[n - 1 - j] == b[m - 1 - j]:
+            j += 1
+        result = []
+        if i:
+            result.append(('equal', 0, i, 0, i))
+        result.extend(self.match_opcodes(a, b, i, n - j, i, m - j))
+        if j:
+            result.append(('equal', n - j, n, m - j, m))
+        return result
+    #@+node:ekr.20211109075343.1: *3* LeoGui.entry_key
+    def entry_key(self, s):
+        """Return the "level:gnx" part of an entry in a flattened outline."""
+        i = s.find(':', s.find(':') + 1)
+        return s if i == -1 else s[:i]
+    #@+node:ekr.20211109075520.1: *3* LeoGui.match_opcodes
+    def match_opcodes(self, a, b, a1, a2, b1, b2):
+        """
+        Return opcodes for a[a1:a2] and b[b1:b2].
+
+        Match the n-th entry of b having a given level and gnx with the n-th
+        such entry of a, then keep the longest run of matches in the same
+        order in both lists. Moving a short block past a long one changes
+        only the short block, even if the moved entries' contents differ.
+        """
+        if a1 == a2 and b1 == b2:
+            return []
+        if a1 == a2:
+            return [('insert', a1, a1, b1, b2)]
+        if b1 == b2:
+            return [('delete', a1, a2, b1, b1)]
+        key = self.entry_key
+        d = defaultdict(deque)  # Keys are entry keys, values are indices into a.
+        for i in range(a1, a2):
+            d[key(a[i])].append(i)
+        pairs = []  # (i, j) such that key(a[i]) == key(b[j]), in increasing j order.
+        for j in range(b1, b2):
+            q = d.get(key(b[j]))
+            if q:
+                pairs.append((q.popleft(), j))
+        matches = self.longest_increasing_pairs(pairs)
+        matches.append((a2, b2))  # A sentinel.
+        result: List[tuple] = []
+
+        def add(tag, i1, i2, j1, j2):
+            if result and result[-1][0] == tag and result[-1][2] == i1 and result[-1][4] == j1:
+                result[-1] = (tag, result[-1][1], i2, result[-1][3], j2)
+            else:
+                result.append((tag, i1, i2, j1, j2))
+
+        i, j = a1, b1
+        for i2, j2 in matches:
+            if i < i2 and j < j2:
+                add('replace', i, i2, j, j2)
+            elif i < i2:
+                add('delete', i, i2, j, j)
+            elif j < j2:
+                add('insert', i, i, j, j2)
+            if i2 < a2:
+                add('equal' if a[i2] == b[j2] else 'replace', i2, i2 + 1, j2, j2 + 1)
+            i, j = i2 + 1, j2 + 1
+        return result
+    #@+node:ekr.20211109075657.1: *3* LeoGui.longest_increasing_pairs
+    def longest_increasing_pairs(self, pairs):
+        """
+        Return the longest sublist of pairs whose first elements increase.
+
+        The second elements of pairs must already increase.
+        This is patience sorting: O(N log N).
+        """
+        tails: List[int] = []  # tails[n] is the least first element ending a run of length n+1.
+        tail_indices: List[int] = []  # Indices into pairs of the tails.
+        prev = [-1] * len(pairs)  # Back links into pairs.
+        for k, (i, j) in enumerate(pairs):
+            n = bisect.bisect_left(tails, i)
+            if n == len(tails):
+                tails.append(i)
+                tail_indices.append(k)
+            else:
+                tails[n] = i
+                tail_indices[n] = k
+            prev[k] = tail_indices[n - 1] if n else -1
+        result = []
+        k = tail_indices[-1] if tail_indices else -1
+        while k > -1:
+            result.append(pairs[k])
+            k = prev[k]
+        result.reverse()
+        return result
     #@+node:ekr.20181202060924.6: ** LeoGui.peep_hole
     def peep_hole(self, opcodes):
         """Scan the list of opcodes, merging adjacent op-codes."""
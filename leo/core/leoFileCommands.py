@@ -4,6 +4,7 @@
 #@+<< imports >>
 #@+node:ekr.20050405141130: ** << imports >> (leoFileCommands)
 import binascii
+import codecs
 from collections import defaultdict
 from contextlib import contextmanager
 import difflib
@@ -14,9 +15,10 @@ import os
 import pickle
 import shutil
 import sqlite3
+import sys
 import tempfile
 import time
-from typing import Dict
+from typing import Any, Dict, List, Set, Tuple
 import zipfile
 import xml.etree.ElementTree as ElementTree
 import xml.sax
@@ -81,8 +83,7 @@ class FastRead:
     #@+node:ekr.20180604110143.1: *3* fast.readFile
     def readFile(self, theFile, path):
         """Read the file, change splitter ratiors, and return its hidden vnode."""
-        s = theFile.read()
-        v, g_element = self.readWithElementTree(path, s)
+        v, g_element = self.readWithPullParser(path, theFile)
         if not v:  # #1510.
             return None
         self.scanGlobals(g_element)
@@ -295,7 +296,7 @@ class FastRead:
     #@+node:ekr.20180602062323.9: *4* fast.scanVnodes & helper
     def scanVnodes(self, gnx2body, gnx2vnode, gnx2ua, v_elements):
 
-        c, fc = self.c, self.c.fileCommands
+        c = self.c
         #@+<< define v_element_visitor >>
         #@+node:ekr.20180605102822.1: *5* << define v_element_visitor >>
         def v_element_visitor(parent_e, parent_v):
@@ -335,36 +336,9 @@ class FastRead:
                     #@-<< Make a new vnode, linked to the parent >>
                     #@+<< handle all other v attributes >>
                     #@+node:ekr.20180605075113.1: *6* << handle all other v attributes >>
-                    # Like fc.handleVnodeSaxAttrutes.
-                    #
-                    # The native attributes of <v> elements are a, t, vtag, tnodeList,
-                    # marks, expanded, and descendentTnode/VnodeUnknownAttributes.
-                    d = e.attrib
-                    s = d.get('tnodeList', '')
-                    tnodeList = s and s.split(',')
-                    if tnodeList:
-                        # This tnodeList will be resolved later.
-                        v.tempTnodeList = tnodeList
-                    s = d.get('descendentTnodeUnknownAttributes')
-                    if s:
-                        aDict = fc.getDescendentUnknownAttributes(s, v=v)
-                        if aDict:
-                            fc.descendentTnodeUaDictList.append(aDict)
-                    s = d.get('descendentVnodeUnknownAttributes')
-                    if s:
-                        aDict = fc.getDescendentUnknownAttributes(s, v=v)
-                        if aDict:
-                            fc.descendentVnodeUaDictList.append((v, aDict),)
-                    #
-                    # Handle vnode uA's
-                    uaDict = gnx2ua[gnx]
-                        # gnx2ua is a defaultdict(dict)
-                        # It might already exists because of tnode uA's.
-                    for key, val in d.items():
-                        if key not in self.nativeVnodeAttributes:
-                            uaDict[key] = self.resolveUa(key, val)
-                    if uaDict:
-                        v.unknownAttributes = uaDict
+                    # gnx2ua is a defaultdict(dict)
+                    # It might already exists because of tnode uA's.
+                    self.handleVnodeAttributes(v, e.attrib, gnx2ua[gnx])
                     #@-<< handle all other v attributes >>
                     # Handle all inner elements.
                     v_element_visitor(e, v)
@@ -381,6 +355,208 @@ class FastRead:
         # Traverse the tree of v elements.
         v_element_visitor(v_elements, hidden_v)
         return hidden_v
+    #@+node:ekr.20211109061957.1: *4* fast.handleVnodeAttributes
+    def handleVnodeAttributes(self, v, d, uaDict):
+        """
+        Handle all attributes of a <v> element, except 't'.
+
+        d:      The attributes of the <v> element.
+        uaDict: The uA's of v's <t> element, if known.
+        """
+        # Like fc.handleVnodeSaxAttrutes.
+        #
+        # The native attributes of <v> elements are a, t, vtag, tnodeList,
+        # marks, expanded, and descendentTnode/VnodeUnknownAttributes.
+        fc = self.c.fileCommands
+        s = d.get('tnodeList', '')
+        tnodeList = s and s.split(',')
+        if tnodeList:
+            # This tnodeList will be resolved later.
+            v.tempTnodeList = tnodeList
+        s = d.get('descendentTnodeUnknownAttributes')
+        if s:
+            aDict = fc.getDescendentUnknownAttributes(s, v=v)
+            if aDict:
+                fc.descendentTnodeUaDictList.append(aDict)
+        s = d.get('descendentVnodeUnknownAttributes')
+        if s:
+            aDict = fc.getDescendentUnknownAttributes(s, v=v)
+            if aDict:
+                fc.descendentVnodeUaDictList.append((v, aDict),)
+        #
+        # Handle vnode uA's
+        for key, val in d.items():
+            if key not in self.nativeVnodeAttributes:
+                uaDict[key] = self.resolveUa(key, val)
+        if uaDict:
+            v.unknownAttributes = uaDict
+    #@+node:ekr.20211109062134.1: *3* fast.readWithPullParser & helper
+    chunk_size = 1024 * 1024
+
+    def readWithPullParser(self, path, theFile):
+        """
+        Read theFile incrementally, creating vnodes as the parser returns
+        elements, and discarding elements as soon as they have been handled.
+
+        Unlike fast.readWithElementTree, neither the contents of the file nor
+        the entire element tree ever exist in memory.
+
+        Return (hidden_v, g_element) or (None, None).
+
+        On failure, remove all vnodes created by this read from
+        fast.gnx2vnode and restore all vnodes that existed before the read.
+        """
+        gnx2vnode = self.gnx2vnode
+        hidden_gnx = 'hidden-root-vnode-gnx'
+        old_hidden_v = gnx2vnode.get(hidden_gnx)
+        new_gnxs: Set[str] = set()  # Gnx's of vnodes created by this read.
+        saved_d: Dict[Any, Tuple] = {}  # Keys are old vnodes, values are (parents, body).
+        parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        # Decode like g.toUnicode.
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        scanner = self.scanEvents(parser, new_gnxs, saved_d)
+        next(scanner)
+        try:
+            while True:
+                chunk = theFile.read(self.chunk_size)
+                if isinstance(chunk, bytes):
+                    s = decoder.decode(chunk, final=not chunk)
+                else:
+                    s = chunk
+                s = s.translate(self.translate_table)  # #1036 and #1046.
+                if s:
+                    parser.feed(s)
+                    scanner.send(True)
+                if not chunk:
+                    break
+            parser.close()
+            hidden_v, g_element = scanner.send(False)
+        except Exception as e:
+            # #970: Report failure here.
+            g.es_print(f"\nbad .leo file: {g.shortFileName(path)}", color='red')
+            g.es_print(g.toUnicode(e))
+            print('')
+            # Roll back all changes to the outline.
+            for gnx in new_gnxs:
+                gnx2vnode.pop(gnx, None)
+            for v, (parents, body) in saved_d.items():
+                v.parents, v._bodyString = parents, body
+            if old_hidden_v:
+                gnx2vnode[hidden_gnx] = old_hidden_v
+            else:
+                gnx2vnode.pop(hidden_gnx, None)
+            return None, None  # #1510: Return a tuple.
+        self.handleBits()
+        return hidden_v, g_element
+    #@+node:ekr.20211109062311.1: *4* fast.scanEvents
+    def scanEvents(self, parser, new_gnxs, saved_d):
+        """
+        A generator handling all pending events of the parser each time the
+        caller sends True. Sending False yields (hidden_v, g_element).
+
+        Like fast.scanVnodes, but <t> elements may follow <v> elements.
+
+        new_gnxs: Set to the gnx's of all vnodes created by this read.
+        saved_d:  Set to the original (parents, body) of all changed old vnodes.
+        """
+        c, gnx2vnode = self.c, self.gnx2vnode
+        gnx2body: Dict[str, str] = {}  # Bodies of <t> elements before their <v> elements.
+        gnx2ua: Dict[str, dict] = {}  # uA's of those <t> elements.
+        seen_gnxs = set()  # Gnx's of all vnodes in this read.
+        elements: List = []  # The stack of open elements.
+        g_element = None
+        #
+        # Create the hidden root vnode.
+        gnx = 'hidden-root-vnode-gnx'
+        hidden_v = leoNodes.VNode(context=c, gnx=gnx)
+        hidden_v._headString = '<hidden root vnode>'
+        gnx2vnode[gnx] = hidden_v
+        vnodes = [hidden_v]  # The stack of open vnodes.
+        skip = 0  # > 0: within the <v> element of a clone.
+        while (yield None):
+            for event, e in parser.read_events():
+                tag = e.tag
+                if event == 'start':
+                    elements.append(e)
+                    if tag != 'v':
+                        pass
+                    elif skip:
+                        skip += 1
+                    else:
+                        parent_v = vnodes[-1]
+                        # #1581: Attempt to handle old Leo outlines.
+                        gnx = e.attrib.get('t')
+                        v = gnx2vnode.get(gnx) if gnx else None
+                        if v:
+                            # A clone. Ignore all inner elements.
+                            seen_gnxs.add(gnx)
+                            if gnx not in new_gnxs and v not in saved_d:
+                                saved_d[v] = v.parents[:], v._bodyString
+                            parent_v.children.append(v)
+                            v.parents.append(parent_v)
+                            if gnx not in new_gnxs:
+                                # The body overrides any previous body text.
+                                v._bodyString = gnx2body.get(gnx, '')
+                            skip = 1
+                        else:
+                            # Make a new vnode, linked to the parent.
+                            # A missing 't' attribute gets a new gnx.
+                            v = leoNodes.VNode(context=c, gnx=gnx)
+                            gnx = v.gnx
+                            seen_gnxs.add(gnx)
+                            gnx2vnode[gnx] = v
+                            new_gnxs.add(gnx)
+                            parent_v.children.append(v)
+                            v.parents.append(parent_v)
+                            v._bodyString = gnx2body.pop(gnx, '')
+                            v._headString = 'PLACE HOLDER'
+                            self.handleVnodeAttributes(v, e.attrib, gnx2ua.pop(gnx, {}))
+                            vnodes.append(v)
+                    continue
+                # An 'end' event.
+                elements.pop()
+                if tag == 'v':
+                    if skip:
+                        skip -= 1
+                    else:
+                        vnodes.pop()
+                elif tag == 'vh':
+                    if not skip:
+                        vnodes[-1]._headString = g.toUnicode(e.text or '')
+                elif tag == 't':
+                    self.scanTnode(e, gnx2body, gnx2ua, new_gnxs, seen_gnxs, saved_d)
+                elif tag == 'globals':
+                    g_element = e
+                    continue
+                else:
+                    continue
+                # Discard the element.
+                if elements:
+                    elements[-1].remove(e)
+        yield hidden_v, g_element
+    #@+node:ekr.20211109062448.1: *5* fast.scanTnode
+    def scanTnode(self, e, gnx2body, gnx2ua, new_gnxs, seen_gnxs, saved_d):
+        """Handle a <t> element for fast.scanEvents."""
+        gnx = e.attrib['tx']
+        body = e.text or ''
+        uaDict = {key: self.resolveUa(key, val)
+            for key, val in e.attrib.items() if key != 'tx'}
+        if gnx not in seen_gnxs:
+            # Remember the data for the vnode to come.
+            gnx2body[gnx] = body
+            if uaDict:
+                gnx2ua[gnx] = uaDict
+            return
+        v = self.gnx2vnode.get(gnx)
+        if not v:
+            return  # pragma: no cover
+        if gnx not in new_gnxs and v not in saved_d:
+            saved_d[v] = v.parents[:], v._bodyString
+        v._bodyString = body
+        if uaDict and gnx in new_gnxs:
+            # The uA's of <v> elements override those of <t> elements.
+            uaDict.update(getattr(v, 'unknownAttributes', {}))
+            v.unknownAttributes = uaDict
     #@-others
 #@+node:ekr.20160514120347.1: ** class FileCommands
 class FileCommands:
@@ -709,7 +885,10 @@ class FileCommands:
                 v = fc.read_leojs(theFile, fileName)
                 readAtFileNodesFlag = False  # Suppress post-processing.
             else:
+                t_read = time.time()
                 v = FastRead(c, self.gnxDict).readFile(theFile, fileName)
+                if 'speed' in g.app.debug:
+                    fc.reportReadSpeed(fileName, time.time() - t_read)
                 if v:
                     c.hiddenRootNode = v
             if v:
@@ -722,6 +901,8 @@ class FileCommands:
                         # Redraw before reading the @file nodes so the screen isn't blank.
                         # This is important for big files like LeoPy.leo.
                     recoveryNode = fc.readExternalFiles(fileName)
+                if c.config.getBool('compact-outlines', default=False):
+                    c.compactOutline()
         finally:
             p = recoveryNode or c.p or c.lastTopLevel()
                 # lastTopLevel is a better fallback, imo.
@@ -743,6 +924,23 @@ class FileCommands:
         t2 = time.time()
         g.es(f"read outline in {t2 - t1:2.2f} seconds")
         return v, c.frame.ratio
+    #@+node:ekr.20211109062802.1: *6* fc.reportReadSpeed
+    def reportReadSpeed(self, fileName, t):
+        """Report the throughput and peak memory of FastRead.readFile."""
+        try:
+            size = os.path.getsize(fileName) / 1e6
+        except OSError:
+            size = 0
+        try:
+            import resource  # Not available on Windows.
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Kilobytes on Linux, bytes on MacOS.
+            rss_s = f"{rss / (1e6 if sys.platform == 'darwin' else 1e3):.1f} MB"
+        except Exception:
+            rss_s = 'unknown'
+        g.es_print(
+            f"read {g.shortFileName(fileName)}: {size:.1f} MB in {t:.2f} sec "
+            f"({size / max(t, 1e-6):.1f} MB/sec), peak RSS: {rss_s}")
     #@+node:ekr.20031218072017.2297: *5* fc.openLeoFile
     def openLeoFile(self, theFile, fileName, readAtFileNodesFlag=True, silent=False):
         """
@@ -1706,7 +1904,7 @@ class FileCommands:
         return {
             'leoHeader': {'fileFormat': 2},
             'globals': self.leojs_globals(),
-            'tnodes': {v.gnx: v._bodyString for v in c.all_unique_nodes()},
+            'tnodes': {v.gnx: v.bodyString() for v in c.all_unique_nodes()},
             # 'tnodes': [
                 # {
                     # 'tx': v.fileIndex,
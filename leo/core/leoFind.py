@@ -1,6 +1,7 @@
 #@+leo-ver=5-thin
 #@+node:ekr.20060123151617: * @file leoFind.py
 """Leo's gui-independent find classes."""
+from collections import defaultdict
 import keyword
 import re
 import sys
@@ -125,6 +126,10 @@ class LeoFind:
         self.root = None  # The start of the search, especially for suboutline-only.
         self.unique_matches = set()
         #
+        # For batch searches: None, or the set of vnodes that might match.
+        self.candidates = None
+        self.search_index = SearchIndex(c)
+        #
         # User settings.
         self.minibuffer_mode = None
         self.reload_settings()
@@ -203,6 +208,7 @@ class LeoFind:
         c = self.c
         self.minibuffer_mode = c.config.getBool('minibuffer-find-mode', default=False)
         self.reverse_find_defs = c.config.getBool('reverse-find-defs', default=False)
+        self.use_find_index = c.config.getBool('use-find-index', default=False)
     #@+node:ekr.20210108053422.1: *3* find.batch_change (script helper) & helpers
     def batch_change(self, root, replacements, settings=None):
         #@+<< docstring: find.batch_change >>
@@ -1072,7 +1078,10 @@ class LeoFind:
         else:
             positions = c.all_unique_positions()
         count = 0
+        candidates = self.compute_candidates()
         for p in positions:
+            if candidates is not None and p.v not in candidates:
+                continue
             count_h, count_b = 0, 0
             undoData = u.beforeChangeNodeContents(p)
             if self.search_headline:
@@ -1602,10 +1611,12 @@ class LeoFind:
         old_sparse_find = c.sparse_find
         try:
             c.sparse_find = False
+            self.candidates = self.compute_candidates()
             count = self._find_all_helper(after, data, p, 'Find All')
             c.contractAllHeadlines()
         finally:
             c.sparse_find = old_sparse_find
+            self.candidates = None
             self.root = None
         if count:
             c.redraw()
@@ -1984,12 +1995,15 @@ class LeoFind:
             after = None
         count, found = 0, None
         clones, skip = [], set()
+        candidates = self.compute_candidates()
         while p and p != after:
             progress = p.copy()
             if p.v in skip:  # pragma: no cover (minor)
                 p.moveToThreadNext()
             elif g.inAtNosearch(p):
                 p.moveToNodeAfterTree()
+            elif candidates is not None and p.v not in candidates:
+                p.moveToThreadNext()
             elif self._cfa_find_next_match(p):
                 count += 1
                 if p not in clones:
@@ -2249,6 +2263,8 @@ class LeoFind:
         Search self.work_s for self.find_text with present options.
         Returns (pos, newpos) or (None, dNone).
         """
+        if self.candidates is not None and p.v not in self.candidates:
+            return None, None  # The search index shows that p can not match.
         index = self.work_sel[2]
         s = self.work_s
         if sys.platform.lower().startswith('win'):
@@ -2282,6 +2298,20 @@ class LeoFind:
             self.search_headline and self.search_body and (
             (self.reverse and not self.in_headline) or
             (not self.reverse and self.in_headline)))
+    #@+node:ekr.20211109064058.1: *4* find.compute_candidates
+    def compute_candidates(self):
+        """
+        Return None, or the set of all vnodes that might match the present
+        find text, as given by self.search_index.
+        """
+        if not self.use_find_index:
+            return None
+        find_text = self.find_text
+        if not self.pattern_match:
+            # Plain searches replace \n, \t and \\ before searching.
+            find_text = self.replace_back_slashes(find_text)
+        return self.search_index.candidates(
+            find_text, self.pattern_match, self.whole_word)
     #@+node:ekr.20210110073117.43: *4* find.inner_search_helper & helpers
     def inner_search_helper(self, s, i, j, pattern):
         """
@@ -3010,6 +3040,247 @@ class LeoFind:
         if s not in self.findTextList:
             self.findTextList.append(s)
     #@-others
+#@+node:ekr.20211109064235.1: ** class SearchIndex
+class SearchIndex:
+    """
+    An inverted index from lower-case words to the vnodes containing them.
+
+    The batch find commands use this index to skip nodes that can not match.
+
+    The index never walks the outline. si.candidates returns a
+    SearchCandidates object, and the find commands test each node they
+    visit against it. That test checks the identity of v._headString and
+    v._bodyString, so the index re-indexes only new or changed vnodes, and
+    only when a search visits them.
+    """
+
+    word_pat = re.compile(r'\w+')
+
+    # The prefix of a (?...) group: flags, non-capturing and named groups,
+    # lookarounds, and the non-group forms: backreferences, comments and
+    # inline flags. Anything else, say a conditional group, is unknown.
+    group_prefix_pat = re.compile(
+        r'\(\?(?:'
+        r'(?P<flags>[aiLmsux]*(?:-[imsx]+)?)[:)]'  # (?:, (?i:, (?i).
+        r'|P<\w+>'  # A named group.
+        r'|P=\w+\)'  # A backreference.
+        r'|\#[^)]*\)'  # A comment.
+        r'|<?[=!]'  # A lookahead or lookbehind.
+        r')')
+
+    def __init__(self, c):
+        self.c = c
+        self.entries = {}  # Keys are vnodes, values are (h, b, words).
+        self.postings = defaultdict(set)  # Keys are words, values are sets of vnodes.
+        self.purge_size = 1000  # Purge deleted vnodes when len(self.entries) exceeds this.
+        self.unindexed = set()  # Vnodes whose body text has not been loaded.
+    #@+others
+    #@+node:ekr.20211109064412.1: *3* si.candidates
+    def candidates(self, find_text, pattern_match, whole_word):
+        """
+        Return a SearchCandidates object containing all vnodes that might
+        contain a match for find_text, or None if the index can't narrow the
+        search.
+        """
+        if pattern_match:
+            runs = self.required_literals(find_text)
+        else:
+            runs = [find_text]
+        tokens = []
+        for run in runs:
+            tokens.extend(self.tokens(run.lower(), exact=whole_word and not pattern_match))
+        if not tokens:
+            return None
+        if len(self.entries) > self.purge_size:
+            self.purge()
+        result = None
+        for token, kind in tokens:
+            vnodes = set()
+            for word in self.matching_words(token, kind):
+                vnodes |= self.postings[word]
+            result = vnodes if result is None else result & vnodes
+            if not result:
+                break
+        return SearchCandidates(self, tokens, result | self.unindexed)
+    #@+node:ekr.20211109083231.5: *3* si.index_vnode
+    def index_vnode(self, v):
+        """Index v if it is new or has changed. Return v's set of words."""
+        h, b = v._headString, v._bodyString
+        entry = self.entries.get(v)
+        if entry and entry[0] is h and entry[1] is b:
+            return entry[2]
+        if entry:
+            self.remove(v, entry)
+        if isinstance(b, str):
+            words = set(self.word_pat.findall(h.lower()))
+            words.update(self.word_pat.findall(b.lower()))
+            for word in words:
+                self.postings[word].add(v)
+        else:
+            # Don't load the body text now.
+            words = set()
+            self.unindexed.add(v)
+        self.entries[v] = h, b, words
+        return words
+    #@+node:ekr.20211109083231.19: *3* si.index_outline
+    def index_outline(self):
+        """
+        Index all new or changed vnodes of the outline.
+
+        This method reads only c's outline and this index, so leoserver may
+        call it in c's worker thread before a batch find command.
+        """
+        for v in self.c.all_unique_nodes():
+            self.index_vnode(v)
+    #@+node:ekr.20211109064549.1: *3* si.matching_words
+    def matching_words(self, token, kind, words=None):
+        """Return all words matching the token in words or in the index."""
+        if words is None:
+            words = self.postings
+        if kind == 'exact':
+            return [token] if token in words else []
+        if kind == 'prefix':
+            return [z for z in words if z.startswith(token)]
+        if kind == 'suffix':
+            return [z for z in words if z.endswith(token)]
+        return [z for z in words if token in z]
+    #@+node:ekr.20211109083231.6: *3* si.purge
+    def purge(self):
+        """
+        Forget all deleted vnodes, that is, vnodes without parents.
+
+        si.candidates calls this method only when the number of entries has
+        doubled since the last purge, so purging takes amortized O(1) time.
+        """
+        for v in [z for z in self.entries if not z.parents]:
+            self.remove(v, self.entries.pop(v))
+        self.purge_size = max(1000, 2 * len(self.entries))
+    #@+node:ekr.20211109064726.1: *3* si.required_literals
+    def required_literals(self, pattern):
+        """
+        Return a list of literal strings that any match of the regex pattern
+        must contain. Return [] if there are no such strings.
+        """
+        runs = []  # Completed runs.
+        groups = []  # Stack of (len(runs), is_negative) for open groups.
+        run = ''
+        i, n = 0, len(pattern)
+        while i < n:
+            ch = pattern[i]
+            if ch in '?*{':
+                # The previous character is optional, so it ends the run.
+                if len(run) > 1:
+                    runs.append(run[:-1])
+                run = ''
+                i += 1
+                if ch == '{':
+                    j = pattern.find('}', i)
+                    i = n if j == -1 else j + 1
+                continue
+            if ch.isalnum() or ch in ' _-:;,=<>@#%&!"\'/~`\n\t':
+                run += ch
+                i += 1
+                continue
+            # Anything else ends the run.
+            if run:
+                runs.append(run)
+                run = ''
+            if ch == '|':
+                if not groups:
+                    return []  # Alternatives at the top level.
+                # Forget the runs in the group.
+                del runs[groups[-1][0]:]
+                groups[-1] = (groups[-1][0], True)
+            elif ch == '\\':
+                i += 1  # Skip the escaped character.
+            elif ch == '[':
+                j = pattern.find(']', i + 2)
+                i = n if j == -1 else j
+            elif ch == '(' and pattern.startswith('(?', i):
+                m = self.group_prefix_pat.match(pattern, i)
+                if not m or 'x' in (m.group('flags') or ''):
+                    return []  # An unknown group, or a verbose pattern.
+                i = m.end()
+                if not m.group(0).endswith(')'):
+                    # Forget the runs of lookarounds.
+                    groups.append((len(runs), m.group(0)[-1] in '=!'))
+                continue
+            elif ch == '(':
+                groups.append((len(runs), False))
+            elif ch == ')' and groups:
+                start, forget = groups.pop()
+                if forget or pattern[i + 1 : i + 2] in ('?', '*', '{'):
+                    del runs[start:]
+                    if pattern[i + 1 : i + 2] in ('?', '*', '{'):
+                        i += 1  # Don't remove a character from the run.
+                        if pattern[i] == '{':
+                            j = pattern.find('}', i)
+                            i = n - 1 if j == -1 else j
+            i += 1
+        if run:
+            runs.append(run)
+        return runs
+    #@+node:ekr.20211109064903.1: *3* si.tokens
+    def tokens(self, s, exact):
+        """
+        Return a list of (word, kind) for all words in the literal string s.
+
+        kind is 'exact' for words that must appear in the text as a whole
+        word, 'prefix' or 'suffix' for words that must start or end a word
+        in the text, and 'substring' otherwise.
+        """
+        result = []
+        for m in self.word_pat.finditer(s):
+            at_start, at_end = m.start() == 0, m.end() == len(s)
+            if exact or not (at_start or at_end):
+                kind = 'exact'
+            elif at_start and at_end:
+                kind = 'substring'
+            elif at_start:
+                kind = 'suffix'
+            else:
+                kind = 'prefix'
+            result.append((m.group(0), kind),)
+        return result
+    #@+node:ekr.20211109065217.1: *3* si.remove
+    def remove(self, v, entry):
+        """Remove v's words from the postings."""
+        for word in entry[2]:
+            vnodes = self.postings[word]
+            vnodes.discard(v)
+            if not vnodes:
+                del self.postings[word]
+        self.unindexed.discard(v)
+    #@-others
+#@+node:ekr.20211109083231.7: ** class SearchCandidates
+class SearchCandidates:
+    """
+    The vnodes that might match the find text of one batch find command.
+
+    `v in candidates` indexes v first if v is new or has changed, so the
+    result is always correct, even though si.candidates never walks the
+    outline.
+    """
+
+    def __init__(self, si, tokens, vnodes):
+        self.si = si
+        self.tokens = tokens  # List of (word, kind).
+        self.vnodes = vnodes  # Vnodes whose index entries matched.
+
+    def __contains__(self, v):
+        si = self.si
+        entry = si.entries.get(v)
+        if entry and entry[0] is v._headString and entry[1] is v._bodyString:
+            return v in self.vnodes
+        # A new or changed vnode.
+        words = si.index_vnode(v)
+        if v in si.unindexed or all(
+            si.matching_words(token, kind, words) for token, kind in self.tokens
+        ):
+            self.vnodes.add(v)
+            return True
+        self.vnodes.discard(v)
+        return False
 #@-others
 #@@language python
 #@@tabwidth -4
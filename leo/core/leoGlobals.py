@@ -474,6 +474,63 @@ class Bunch:
         return key in self.__dict__
 
 bunch = Bunch
+#@+node:ekr.20211109053936.1: *3* class g.DirectivesCache
+class DirectivesCache:
+    """
+    A per-commander cache, c.directivesCache, of data computed by scanning
+    the headline and body of individual vnodes for directives.
+
+    An entry is valid only while the vnode's headline and body remain
+    unchanged. Strings are immutable, and each entry retains the strings it
+    was computed from, so identity tests detect all changes, regardless of
+    how the headline or body were changed.
+
+    The cache never loads lazy bodies: v.directiveString contains all the
+    directives of the body.
+
+    Entries for deleted or changed vnodes are purged whenever the number of
+    entries doubles, so the cache stays proportional to the outline.
+    """
+
+    def __init__(self) -> None:
+        self.d: Dict[Tuple[Any, str], Tuple[str, str, Any, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.purge_size = 1000  # Purge stale entries when len(self.d) exceeds this.
+
+    def clear(self) -> None:
+        self.d = {}
+        self.purge_size = 1000
+
+    def purge(self) -> None:
+        """Forget the entries of deleted vnodes and of changed vnodes."""
+        for key, entry in list(self.d.items()):
+            v = key[0]
+            if (
+                not v.parents or entry[0] is not v._headString
+                or entry[1] is not v._bodyString or entry[2] is not directives_pat
+            ):
+                del self.d[key]
+        self.purge_size = max(1000, 2 * len(self.d))
+
+    def get(self, v: Any, kind: str, func: Callable) -> Any:
+        """
+        Return func(h, b) for v's headline and body, using the cache.
+        Callers must not change the returned value.
+        """
+        h, b = v._headString, v._bodyString
+        key = (v, kind)
+        entry = self.d.get(key)
+        # Recompute the value if g.directives_pat has changed.
+        if entry and entry[0] is h and entry[1] is b and entry[2] is directives_pat:
+            self.hits += 1
+            return entry[3]
+        self.misses += 1
+        if len(self.d) > self.purge_size:
+            self.purge()
+        val = func(v.headString(), v.directiveString())
+        self.d[key] = (h, b, directives_pat, val)
+        return val
 #@+node:ekr.20120219154958.10492: *3* class g.EmergencyDialog
 class EmergencyDialog:
     """A class that creates an tkinter dialog with a single OK button."""
@@ -3272,18 +3329,24 @@ def findLanguageDirectives(c: Cmdr, p: Pos):
         return None  # c may be None for testing.
 
     v0 = p.v
+    cache = getattr(c, 'directivesCache', None)
 
-    def find_language(p_or_v):
-        for s in p_or_v.h, p_or_v.b:
+    def find_language_in_strings(h, b):
+        for s in h, b:
             for m in g_language_pat.finditer(s):
                 language = m.group(1)
                 if g.isValidLanguage(language):
                     return language
         return None
 
+    def find_language(v):
+        if cache:
+            return cache.get(v, 'language', find_language_in_strings)
+        return find_language_in_strings(v.h, v.b)
+
     # First, search up the tree.
     for p in p.self_and_parents(copy=False):
-        language = find_language(p)
+        language = find_language(p.v)
         if language:
             return language
     # #1625: Second, expand the search for cloned nodes.
@@ -3324,15 +3387,35 @@ def get_directives_dict(p: Pos, root=None):
     Returns a dict containing the stripped remainder of the line
     following the first occurrence of each recognized directive
     """
+    v = p.v
+    cache = getattr(v.context, 'directivesCache', None)
+    if cache:
+        d = dict(cache.get(v, 'directives', scan_directives))
+    else:
+        d = scan_directives(p.h, p.b)
     if root:
         root_node = root[0]
+        anIter = g_noweb_root.finditer(p.b)
+        for m in anIter:
+            if root_node:
+                d["root"] = 0  # value not immportant
+            else:
+                g.es(f'{g.angleBrackets("*")} may only occur in a topmost node (i.e., without a parent)')
+            break
+    return d
+
+def scan_directives(h: str, b: str):
+    """
+    Scan the given headline and body for Leo directives found in
+    globalDirectiveList. A helper for g.get_directives_dict.
+    """
     d = {}
     #
     # #1688:    legacy: Always compute the pattern.
     #           g.directives_pat is updated whenever loading a plugin.
     #
     # The headline has higher precedence because it is more visible.
-    for kind, s in (('head', p.h), ('body', p.b)):
+    for kind, s in (('head', h), ('body', b)):
         anIter = g.directives_pat.finditer(s)
         for m in anIter:
             word = m.group(1).strip()
@@ -3347,14 +3430,6 @@ def get_directives_dict(p: Pos, root=None):
             k = g.skip_line(s, j)
             val = s[j:k].strip()
             d[word] = val
-    if root:
-        anIter = g_noweb_root.finditer(p.b)
-        for m in anIter:
-            if root_node:
-                d["root"] = 0  # value not immportant
-            else:
-                g.es(f'{g.angleBrackets("*")} may only occur in a topmost node (i.e., without a parent)')
-            break
     return d
 #@+node:ekr.20080827175609.1: *3* g.get_directives_dict_list (must be fast)
 def get_directives_dict_list(p: Pos):
@@ -3858,11 +3933,12 @@ def fullPath(c: Cmdr, p: Pos, simulate=False):
     """
     # Search p and p's parents.
     for p in p.self_and_parents(copy=False):
-        aList = g.get_directives_dict_list(p)
-        path = c.scanAtPathDirectives(aList)
         fn = p.h if simulate else p.anyAtFileNodeName()
             # Use p.h for unit tests.
         if fn:
+            # Scan for @path directives only once.
+            aList = g.get_directives_dict_list(p)
+            path = c.scanAtPathDirectives(aList)
             # Fix #102: expand path expressions.
             fn = c.expand_path_expression(fn)  # #1341.
             fn = os.path.expanduser(fn)  # 1900.
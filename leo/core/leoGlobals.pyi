@@ -54,6 +54,10 @@ class Bunch:
     def __getitem__(self, key: str) -> Any: ...
     def get(self, key: str, theDefault: Any=None) -> Any: ...
     def __contains__(self, key: str) -> bool: ...
+class DirectivesCache:
+    def __init__(self) -> None: ...
+    def clear(self) -> None: ...
+    def get(self, v: Any, kind: str, func: Callable) -> Any: ...
 class EmergencyDialog:
     def __init__(self, title: str, message: str) -> None: ...
     def createButtons(self, buttons: List[Dict[str, Any]]) -> List[Any]: ...
@@ -316,7 +320,8 @@ def findAllValidLanguageDirectives(p: Pos) -> List[str]: ...
 def findTabWidthDirectives(c: Cmdr, p: Pos) -> Optional[str]: ...
 def findFirstValidAtLanguageDirective(p: Pos) -> Optional[str]: ...
 def findLanguageDirectives(c: Cmdr, p: Pos) -> Optional[str]: ...
-#    def find_language(p_or_v): ...
+#    def find_language_in_strings(h, b): ...
+#    def find_language(v): ...
 def findReference(name: str, root: Pos) -> Optional[Pos]: ...
 def get_directives_dict(p: Pos, root: Pos=None) -> Dict[str, str]: ...
 def get_directives_dict_list(p: Pos) -> List[Dict[Any, Any]]: ...
@@ -336,6 +341,7 @@ def scanAtPathDirectives(c: Cmdr, aList: List[Any]) -> str: ...
 def scanAllAtPathDirectives(c: Cmdr, p: Pos) -> str: ...
 def scanAtTabwidthDirectives(aList: List[Any], issue_error_flag: bool=False) -> Optional[int]: ...
 def scanAllAtTabWidthDirectives(c: Cmdr, p: Pos) -> Optional[int]: ...
+def scan_directives(h: str, b: str) -> Dict[str, str]: ...
 def scanAtWrapDirectives(aList: List[Any], issue_error_flag: bool=False) -> Optional[bool]: ...
 def scanAllAtWrapDirectives(c: Cmdr, p: Pos) -> Optional[Any]: ...
 def scanForAtIgnore(c: Cmdr, p: Pos) -> bool: ...
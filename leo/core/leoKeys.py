@@ -2980,7 +2980,26 @@ class KeyHandlerClass:
     #@+node:ekr.20061031131434.145: *3* k.Master event handlers
     #@+node:ekr.20061031131434.146: *4* k.masterKeyHandler & helpers
     def masterKeyHandler(self, event):
-        """The master key handler for almost all key bindings."""
+        """
+        The master key handler for almost all key bindings.
+
+        Call k.dispatchKeyEvent, recording the keystroke's latency
+        when g.app.perfStats is enabled.
+        """
+        stats = g.app.perfStats
+        if not stats.enabled:
+            self.dispatchKeyEvent(event)
+            return
+        t1 = time.perf_counter()
+        try:
+            self.dispatchKeyEvent(event)
+        finally:
+            stroke = event.stroke
+            name = '<plain keys>' if self.isPlainKey(stroke) else getattr(stroke, 's', repr(stroke))
+            stats.record('keys', name, time.perf_counter() - t1)
+
+    def dispatchKeyEvent(self, event):
+        """Handle the event: dispatch it to a mode, binding or plain-key handler."""
         trace = 'keys' in g.app.debug
         c, k = self.c, self
         # Setup...
@@ -10,7 +10,7 @@ import copy
 import itertools
 import time
 import re
-from typing import Dict, List, Optional, Tuple  # Any, Callable, Generator, Sequence, Union
+from typing import List, Optional, Set, Tuple  # Any, Callable, Dict, Generator, Sequence, Union
 from leo.core import leoGlobals as g
 from leo.core import signal_manager
 from leo.core.leoCommands import Commands as Cmdr
@@ -502,11 +502,8 @@ class Position:
     def nodes(self):
         """Yield p.v and all vnodes in p's subtree."""
         p = self
-        p = p.copy()
-        after = p.nodeAfterTree()
-        while p and p != after:  # bug fix: 2013/10/12
-            yield p.v
-            p.moveToThreadNext()
+        for v, level in p.walk_vnodes():
+            yield v
 
     # Compatibility with old code.
 
@@ -554,11 +551,17 @@ class Position:
     def self_and_subtree(self, copy=True):
         """Yield p and all positions in p's subtree."""
         p = self
-        p = p.copy()
-        after = p.nodeAfterTree()
-        while p and p != after:
-            yield p.copy() if copy else p
-            p.moveToThreadNext()
+        if not copy:
+            # Callers may move the yielded position.
+            p = p.copy()
+            after = p.nodeAfterTree()
+            while p and p != after:
+                yield p
+                p.moveToThreadNext()
+            return
+        walker = p.walk_vnodes()
+        for v, level in walker:
+            yield walker.position()
 
     # Compatibility with old code...
 
@@ -567,12 +570,18 @@ class Position:
     def subtree(self, copy=True):
         """Yield all positions in p's subtree, but not p."""
         p = self
-        p = p.copy()
-        after = p.nodeAfterTree()
-        p.moveToThreadNext()
-        while p and p != after:
-            yield p.copy() if copy else p
+        if not copy:
+            # Callers may move the yielded position.
+            p = p.copy()
+            after = p.nodeAfterTree()
             p.moveToThreadNext()
+            while p and p != after:
+                yield p
+                p.moveToThreadNext()
+            return
+        walker = p.walk_vnodes(include_self=False)
+        for v, level in walker:
+            yield walker.position()
 
     # Compatibility with old code...
 
@@ -581,11 +590,8 @@ class Position:
     def unique_nodes(self):
         """Yield p.v and all unique vnodes in p's subtree."""
         p = self
-        seen = set()
-        for p in p.self_and_subtree(copy=False):
-            if p.v not in seen:
-                seen.add(p.v)
-                yield p.v
+        for v, level in p.walk_vnodes(unique=True):
+            yield v
 
     # Compatibility with old code.
 
@@ -606,6 +612,14 @@ class Position:
 
     subtree_with_unique_tnodes_iter = unique_subtree
     subtree_with_unique_vnodes_iter = unique_subtree
+    #@+node:ekr.20211109083054.5: *4* p.walk_vnodes
+    def walk_vnodes(self, include_self=True, unique=False):
+        """
+        Return a VNodeWalker yielding (v, level) for p.v (if include_self is
+        True) and all the vnodes of p's subtree, without allocating positions.
+        """
+        p = self
+        return VNodeWalker(p.v, p._childIndex, p.stack, include_self=include_self, unique=unique)
     #@+node:ekr.20040306212636: *3* p.Getters
     #@+node:ekr.20040306210951: *4* p.VNode proxies
     #@+node:ekr.20040306211032: *5* p.Comparisons
@@ -1122,8 +1136,11 @@ class Position:
         if parent_v.children[p._childIndex] == v:
             parent_v.children[p._childIndex] = v2
             v2.parents.append(parent_v)
+            v2.context.touchVnodes((v2, parent_v))
             # p.v no longer truly exists.
             # p.v = p2.v
+            if parent_v in v.parents:
+                v._cutParentLinks(parent_v)
         else:
             g.internalError(
                 'parent_v.children[childIndex] != v',
@@ -1624,6 +1641,7 @@ class Position:
         for child in children:
             child.parents.remove(p.v)
             child.parents.append(parent_v)
+        p.v.context.touchVnodes([p.v, parent_v] + children)
     #@+node:ekr.20040303175026.13: *4* p.validateOutlineWithParent
     # This routine checks the structure of the receiver's tree.
 
@@ -2050,8 +2068,7 @@ class VNode:
         self.selectionStart = 0
             # The start of the selected body text.
         #
-        # For at.read logic.
-        self.at_read: Dict[str, set] = {}
+        # For at.read logic: at.rememberReadPath creates v.at_read when needed.
         #
         # To make VNode's independent of Leo's core,
         # wrap all calls to the VNode ctor::
@@ -2155,7 +2172,7 @@ class VNode:
     #@+node:EKR.20040430152000: *4* v.isAtAllNode
     def isAtAllNode(self):
         """Returns True if the receiver contains @others in its body at the start of a line."""
-        flag, i = g.is_special(self._bodyString, "@all")
+        flag, i = g.is_special(self.directiveString(), "@all")
         return flag
     #@+node:ekr.20040326031436: *4* v.isAnyAtFileNode
     def isAnyAtFileNode(self):
@@ -2208,12 +2225,12 @@ class VNode:
         # v = self
         if g.match_word(self._headString, 0, '@ignore'):
             return True
-        flag, i = g.is_special(self._bodyString, "@ignore")
+        flag, i = g.is_special(self.directiveString(), "@ignore")
         return flag
     #@+node:ekr.20031218072017.3352: *4* v.isAtOthersNode
     def isAtOthersNode(self):
         """Returns True if the receiver contains @others in its body at the start of a line."""
-        flag, i = g.is_special(self._bodyString, "@others")
+        flag, i = g.is_special(self.directiveString(), "@others")
         return flag
     #@+node:ekr.20031218072017.3353: *4* v.matchHeadline
     def matchHeadline(self, pattern):
@@ -2247,7 +2264,7 @@ class VNode:
         assert v.gnx != v2.gnx
         # Copy vnode fields. Do **not** set v2.parents.
         v2._headString = g.toUnicode(v._headString, reportErrors=True)
-        v2._bodyString = g.toUnicode(v._bodyString, reportErrors=True)
+        v2._bodyString = g.toUnicode(v.bodyString(), reportErrors=True)
         v2.u = copy.deepcopy(v.u)
         if copyMarked and v.isMarked():
             v2.setMarked()
@@ -2258,11 +2275,24 @@ class VNode:
     #@+node:ekr.20031218072017.3359: *3* v.Getters
     #@+node:ekr.20031218072017.3378: *4* v.bodyString
     def bodyString(self):
-        # This message should never be printed and we want to avoid crashing here!
         if isinstance(self._bodyString, str):
             return self._bodyString
+        if hasattr(self._bodyString, 'load'):
+            # A LazyBodies object: compute the body text now.
+            return self._bodyString.load(self)
+        # This message should never be printed and we want to avoid crashing here!
         g.internalError(f"body not unicode: {self._bodyString!r}")
         return g.toUnicode(self._bodyString)
+    #@+node:ekr.20211109083231.22: *4* v.directiveString
+    def directiveString(self):
+        """
+        Return the body text, or, if the body has not been loaded, the lines
+        of the body that might contain directives. See LazyBodies.
+        """
+        b = self._bodyString
+        if not isinstance(b, str) and getattr(b, 'data', None) is not None:
+            return b.directive_lines.get(self.gnx, '')
+        return self.bodyString()
     #@+node:ekr.20031218072017.3360: *4* v.Children
     #@+node:ekr.20031218072017.3362: *5* v.firstChild
     def firstChild(self):
@@ -2300,7 +2330,11 @@ class VNode:
     #@+node:ekr.20080429053831.6: *4* v.hasBody
     def hasBody(self):
         """Return True if this VNode contains body text."""
-        s = self._bodyString
+        b = self._bodyString
+        if not isinstance(b, str) and getattr(b, 'data', None) is not None:
+            # Don't load the body. See LazyBodies.
+            return self.gnx in b.directive_lines
+        s = self.bodyString()
         return bool(s) and len(s) > 0
     #@+node:ekr.20031218072017.1581: *4* v.headString
     def headString(self):
@@ -2358,7 +2392,9 @@ class VNode:
     def clearDirty(self):
         """Clear the vnode dirty bit."""
         v = self
-        v.statusBits &= ~v.dirtyBit
+        if v.statusBits & v.dirtyBit:
+            v.statusBits &= ~v.dirtyBit
+            v.context.touchVnodes((v,), status=True)
     #@+node:ekr.20031218072017.3391: *5* v.clearMarked
     def clearMarked(self):
         self.statusBits &= ~self.markedBit
@@ -2407,7 +2443,10 @@ class VNode:
         This method is fast, but dangerous. Unlike p.setDirty, this method does
         not call v.setAllAncestorAtFileNodesDirty.
         """
-        self.statusBits |= self.dirtyBit
+        v = self
+        if not v.statusBits & v.dirtyBit:
+            v.statusBits |= v.dirtyBit
+            v.context.touchVnodes((v,), status=True)
     #@+node:ekr.20031218072017.3398: *5* v.setMarked & initMarkedBit
     def setMarked(self):
         self.statusBits |= self.markedBit
@@ -2522,6 +2561,7 @@ class VNode:
     #@+node:ekr.20040315032144: *4* v.setBodyString & v.setHeadString
     def setBodyString(self, s):
         v = self
+        v.context.touchVnodes((v,))
         if isinstance(s, str):
             v._bodyString = s
             return
@@ -2533,6 +2573,7 @@ class VNode:
         # Fix bug: https://bugs.launchpad.net/leo-editor/+bug/1245535
         # API allows headlines to contain newlines.
         v = self
+        v.context.touchVnodes((v,))
         if isinstance(s, str):
             v._headString = s.replace('\n', '')
             return
@@ -2582,6 +2623,7 @@ class VNode:
         # Update parent_v.children & v.parents.
         parent_v.children.insert(childIndex, v)
         v.parents.append(parent_v)
+        v.context.touchVnodes((v, parent_v))
         # Set zodb changed flags.
         v._p_changed = True
         parent_v._p_changed = True
@@ -2595,6 +2637,7 @@ class VNode:
         # Update parent_v.children & v.parents.
         parent_v.children.insert(childIndex, v)
         v.parents.append(parent_v)
+        v.context.touchVnodes((v, parent_v))
         # Set zodb changed flags.
         v._p_changed = True
         parent_v._p_changed = True
@@ -2609,6 +2652,7 @@ class VNode:
 
         v = self
         v.parents.append(parent)
+        v.context.touchVnodes([v])
         if len(v.parents) == 1:
             for child in v.children:
                 child._addParentLinks(parent=v)
@@ -2620,6 +2664,7 @@ class VNode:
         parent_v.childrenModified()
         assert parent_v.children[childIndex] == v
         del parent_v.children[childIndex]
+        v.context.touchVnodes((v, parent_v))
         if parent_v in v.parents:
             try:
                 v.parents.remove(parent_v)
@@ -2640,6 +2685,7 @@ class VNode:
 
         v = self
         v.parents.remove(parent)
+        v.context.touchVnodes([v])
         if not v.parents:
             for child in v.children:
                 child._cutParentLinks(parent=v)
@@ -2652,6 +2698,7 @@ class VNode:
         It is not intended as a general replacement for p.doDelete().
         """
         v = self
+        v.context.touchVnodes([v] + v.children)
         for v2 in v.children:
             try:
                 v2.parents.remove(v)
@@ -2722,6 +2769,94 @@ class VNode:
         doc="VNode gnx property")
     #@-others
 vnode = VNode  # compatibility.
+#@+node:ekr.20211109083054.1: ** class VNodeWalker
+class VNodeWalker:
+    """
+    An iterative depth-first traversal of the vnode graph, in outline order.
+
+    Iterating over a walker yields (v, level) tuples, where level is the
+    level p.level() of the corresponding position p. The walker allocates
+    no positions: walker.position() creates the position of the last vnode
+    yielded, on demand, and walker.skip_subtree() prunes that vnode's
+    subtree.
+
+    unique: yield only the first occurrence of each vnode, skipping the
+            subtrees of all later occurrences, like c.all_unique_positions.
+
+    Use c.walk_vnodes or p.walk_vnodes to create walkers.
+    """
+
+    __slots__ = ['include_self', 'offset', 'path', 'prune', 'seen', 'unique']
+
+    def __init__(self, v, childIndex=0, stack=None, include_self=True, unique=False):
+        """
+        Ctor for VNodeWalker: walk the subtree of the position (v, childIndex, stack).
+        v may be c.hiddenRootNode, which is never yielded.
+        v may be None, the vnode of a null position: the walker yields nothing.
+        """
+        hidden = v.context.hiddenRootNode if v is not None else None
+        self.include_self = include_self and v is not hidden
+        self.offset = 1 if v is hidden else 0
+        self.path: List[Tuple["VNode", int]] = list(stack or []) + [(v, childIndex)]
+        self.prune = False
+        self.seen: Set["VNode"] = set()
+        self.unique = unique
+
+    #@+others
+    #@+node:ekr.20211109083054.2: *3* walker.__iter__
+    def __iter__(self):
+        path, seen, unique = self.path, self.seen, self.unique
+        base, delta = len(path), 1 + self.offset
+        v = path[-1][0]
+        if v is None:
+            return
+        if unique:
+            seen.add(v)
+        if self.include_self:
+            yield v, base - delta
+        descend = not self.prune
+        while True:
+            children = v.children if descend else None
+            if children:
+                v = children[0]
+                path.append((v, 0))
+            else:
+                # Move to the next sibling of v or of v's nearest ancestor.
+                while True:
+                    if len(path) == base:
+                        return
+                    i = path.pop()[1] + 1
+                    siblings = path[-1][0].children
+                    if i < len(siblings):
+                        v = siblings[i]
+                        path.append((v, i))
+                        break
+            if unique:
+                if v in seen:
+                    descend = False
+                    continue
+                seen.add(v)
+            self.prune = False
+            yield v, len(path) - delta
+            descend = not self.prune
+    #@+node:ekr.20211109083054.3: *3* walker.position & skip_subtree
+    def position(self, p=None):
+        """
+        Return a new position for the last vnode yielded.
+        If p is given, move p to that position instead and return p.
+        """
+        v, childIndex = self.path[-1]
+        if p is None:
+            p = Position(v, childIndex)
+        else:
+            p.v, p._childIndex = v, childIndex
+        p.stack = self.path[self.offset : -1]
+        return p
+
+    def skip_subtree(self):
+        """Do not visit the descendants of the last vnode yielded."""
+        self.prune = True
+    #@-others
 
 #@@beautify
 #@-others
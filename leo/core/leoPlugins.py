@@ -2,6 +2,7 @@
 #@+node:ekr.20031218072017.3439: * @file leoPlugins.py
 """Classes relating to Leo's plugin architecture."""
 import sys
+import time
 from typing import List
 from leo.core import leoGlobals as g
 # Define modules that may be enabled by default
@@ -319,12 +320,17 @@ class LeoPluginsController:
                     return None
         # Calls to registerHandler from inside the handler belong to moduleName.
         self.loadingModuleNameStack.append(moduleName)
+        stats = g.app.perfStats
+        t1 = time.perf_counter() if stats.enabled else None
         try:
             result = handler(tag, keywords)
         except Exception:
             g.es(f"hook failed: {tag}, {handler}, {moduleName}")
             g.es_exception()
             result = None
+        if t1 is not None:
+            name = getattr(handler, '__qualname__', None) or repr(handler)
+            stats.record('hooks', f"{moduleName}.{name}:{tag}", time.perf_counter() - t1)
         self.loadingModuleNameStack.pop()
         return result
     #@+node:ekr.20100908125007.6018: *4* plugins.doPlugins (g.app.hookFunction)
@@ -559,6 +565,7 @@ class LeoPluginsController:
         moduleName = g.toUnicode(moduleName)
         #
         # Try to load the plugin.
+        t1 = time.perf_counter()
         try:
             self.loadingModuleNameStack.append(moduleName)
             result = loadOnePluginHelper(moduleName)
@@ -576,6 +583,7 @@ class LeoPluginsController:
         finally:
             self.loadingModuleNameStack.pop()
         if result:
+            g.app.import_times[moduleName] = time.perf_counter() - t1
             # #1688: Plugins can update globalDirectiveList.
             #        Recalculate g.directives_pat.
             g.update_directives_pat()
@@ -42,6 +42,8 @@
 #
 # I first saw this model of unlimited undo in the documentation for Apple's Yellow Box classes.
 #@-<< How Leo implements unlimited undo >>
+import tempfile
+import weakref
 from leo.core import leoGlobals as g
 # pylint: disable=unpacking-non-sequence
 #@+others
@@ -62,9 +64,17 @@ class Undoer:
         self.c = c
         self.granularity = None  # Set in reloadSettings.
         self.max_undo_stack_size = c.config.getInt('max-undo-stack-size') or 0
+        self.memory_budget = 0  # Set in reloadSettings. In bytes. 0: no limit.
+        self.spill_to_disk = False  # Set in reloadSettings.
         # State ivars...
         self.beads = []  # List of undo nodes.
         self.bead = -1  # Index of the present bead: -1:len(beads)
+        # Memory ivars...
+        self.bead_sizes = {}  # Keys are id(bunch), values are (bunch, size).
+        self.discarded_beads = 0  # The number of beads discarded by u.cutStackToBudget.
+        self.live_texts = {}  # Keys are vnodes, values are g.Bunches. See u.encodeText.
+        self.spill_file = None  # A temp file holding spilled text.
+        self.spilled_beads = 0  # The number of beads spilled to the spill file.
         self.undoType = "Can't Undo"
         # These must be set here, _not_ in clearUndoState.
         self.redoMenuLabel = "Can't Redo"
@@ -125,6 +135,8 @@ class Undoer:
             self.granularity = self.granularity.lower()
         if self.granularity not in ('node', 'line', 'word', 'char'):
             self.granularity = 'line'
+        self.memory_budget = 1024 * max(0, c.config.getInt('undo-memory-budget') or 0)
+        self.spill_to_disk = c.config.getBool('undo-spill-to-disk', default=False)
     #@+node:ekr.20050416092908.1: *3* u.Internal helpers
     #@+node:ekr.20031218072017.3607: *4* u.clearOptionalIvars
     def clearOptionalIvars(self):
@@ -148,8 +160,155 @@ class Undoer:
                 # g.trace('Cutting undo stack to %d entries' % (n))
             u.beads = u.beads[-n :]
             u.bead = n - 1
+            u.pruneLiveTexts()
+        if u.memory_budget > 0:
+            u.cutStackToBudget()
         if 'undo' in g.app.debug and 'verbose' in g.app.debug:
             print(f"u.cutStack: {len(u.beads):3}")
+    #@+node:ekr.20211109082426.3: *4* u.cutStackToBudget & helpers
+    def cutStackToBudget(self):
+        """
+        Discard the oldest beads until the text in the remaining beads takes
+        at most u.memory_budget bytes. If u.spill_to_disk is True, move the
+        text of those beads to u.spill_file instead of discarding them.
+
+        Never discards the present bead or any bead that could be redone.
+        Reports the first discard in each outline.
+        """
+        u = self
+        # Do nothing if we are in the middle of creating a group.
+        if any(bunch.get('kind') == 'beforeGroup' for bunch in u.beads):
+            return
+        # Only the two topmost beads can change after they have been pushed.
+        sizes, total, cut = {}, 0, 0
+        for i in range(len(u.beads) - 1, -1, -1):
+            bunch = u.beads[i]
+            data = u.bead_sizes.get(id(bunch))
+            if data and data[0] is bunch and i < u.bead - 1:
+                size = data[1]
+            else:
+                size = u.beadSize(bunch)
+            sizes[id(bunch)] = bunch, size
+            total += size
+            if total > u.memory_budget and not cut and i < u.bead:
+                cut = i + 1
+        u.bead_sizes = sizes
+        if not cut:
+            return
+        if u.spill_to_disk:
+            for bunch in u.beads[:cut]:
+                if sizes[id(bunch)][1] > 0:
+                    u.spillBead(bunch)
+                    u.spilled_beads += 1
+                    # Count the remaining short strings as nothing.
+                    sizes[id(bunch)] = bunch, 0
+        else:
+            for bunch in u.beads[:cut]:
+                del sizes[id(bunch)]
+            u.beads = u.beads[cut:]
+            u.bead -= cut
+            if not u.discarded_beads:
+                g.es_print(
+                    f"undo: discarded the oldest undo entries of "
+                    f"{u.c.shortFileName() or u.c.frame.title}: "
+                    f"see @int undo-memory-budget", color='red')
+            u.discarded_beads += cut
+        u.pruneLiveTexts()
+        if 'undo' in g.app.debug:
+            print(f"u.cutStackToBudget: {cut} beads {'spilled' if u.spill_to_disk else 'cut'}")
+    #@+node:ekr.20211109082426.4: *5* u.beadSize
+    def beadSize(self, bunch, seen=None):
+        """Return the approximate number of bytes of text in bunch."""
+        u = self
+        n = 0
+        if seen is None:
+            seen = set()  # Count shared strings once.
+        for holder, key in u.textFields(bunch):
+            val = getattr(holder, key)
+            if id(val) in seen:
+                continue
+            seen.add(id(val))
+            if isinstance(val, str):
+                n += len(val)
+            elif isinstance(val, UndoText):
+                n += len(val.middle)
+        for key in ('oldMiddleLines', 'newMiddleLines'):
+            n += sum(len(z) for z in bunch.get(key) or [])
+        for z in bunch.get('items') or []:
+            n += u.beadSize(z, seen)
+        return n
+    #@+node:ekr.20211109083231.17: *5* u.pruneLiveTexts
+    def pruneLiveTexts(self):
+        """
+        Remove the entries of u.live_texts that no remaining bead uses.
+
+        Discarded beads may still be alive when this runs, so an entry is
+        used only if some holder is reachable from u.beads and still holds
+        the entry's text.
+        """
+        u = self
+        reachable = set()  # ids of bunches, tInfos and UndoTexts in u.beads.
+
+        def visit(bunch):
+            reachable.add(id(bunch))
+            for holder, key in u.textFields(bunch):
+                reachable.add(id(holder))
+                val = getattr(holder, key)
+                while isinstance(val, UndoText):
+                    reachable.add(id(val))
+                    val = val.base
+            for z in bunch.get('items') or []:
+                visit(z)
+
+        for bunch in u.beads:
+            visit(bunch)
+        for v, entry in list(u.live_texts.items()):
+            holders = [(ref(), key) for ref, key in entry.holders]
+            if not any(
+                holder is not None and id(holder) in reachable
+                and getattr(holder, key, None) is entry.text
+                for holder, key in holders
+            ):
+                del u.live_texts[v]
+    #@+node:ekr.20211109082426.5: *5* u.spillBead & spillText
+    spill_threshold = 256  # Don't spill shorter strings.
+
+    def spillBead(self, bunch):
+        """Move the long texts of bunch and its group items to u.spill_file."""
+        u = self
+        for holder, key in u.textFields(bunch):
+            val = u.getText(getattr(holder, key))
+            if isinstance(val, str) and len(val) >= u.spill_threshold:
+                setattr(holder, key, u.spillText(val))
+        for z in bunch.get('items') or []:
+            u.spillBead(z)
+
+    def spillText(self, s):
+        """Write s to u.spill_file and return a SpilledText for it."""
+        u = self
+        if not u.spill_file:
+            u.spill_file = tempfile.TemporaryFile()
+        f = u.spill_file
+        data = s.encode('utf-8')
+        f.seek(0, 2)
+        offset = f.tell()
+        f.write(data)
+        return SpilledText(f, offset, len(data))
+    #@+node:ekr.20211109082426.6: *5* u.textFields
+    def textFields(self, bunch):
+        """
+        Return a list of (holder, key) tuples such that getattr(holder, key)
+        is a text snapshot in bunch, not including bunch's group items.
+        """
+        result = []
+        # bunch is not a dict, so bunch.keys() is required.
+        for key in list(bunch.keys()):
+            val = bunch.get(key)
+            if isinstance(val, (str, UndoText, SpilledText)):
+                result.append((bunch, key))
+            elif key in ('oldTree', 'newTree') and val:
+                result.extend((tInfo, 'bodyString') for v, vInfo, tInfo in val)
+        return result
     #@+node:ekr.20080623083646.10: *4* u.dumpBead
     def dumpBead(self, n):
         u = self
@@ -169,6 +328,115 @@ class Undoer:
         if n > 0:
             return self.dumpBead(n - 1)
         return '<no top bead>'
+    #@+node:ekr.20211109082426.7: *4* u.encodeBead & helpers
+    def encodeBead(self, bunch):
+        """
+        Replace the old text snapshots in bunch by deltas against the new
+        snapshots. See u.encodeText.
+        """
+        u = self
+        kind, p = bunch.get('kind'), bunch.get('p')
+        if kind in ('body', 'node') and p:
+            u.encodeText(p.v, bunch, 'oldBody', bunch, 'newBody')
+        elif kind == 'tree':
+            old_d = {v: tInfo for v, vInfo, tInfo in bunch.get('oldTree') or []}
+            new_d = {v: tInfo for v, vInfo, tInfo in bunch.get('newTree') or []}
+            # oldText and newText are usually copies of p's old and new bodies.
+            v = p and p.v
+            share_old = v in old_d and old_d[v].bodyString == bunch.get('oldText')
+            share_new = v in new_d and new_d[v].bodyString == bunch.get('newText')
+            for v2, vInfo, tInfo in bunch.get('oldTree') or []:
+                if v2 in new_d:
+                    u.encodeText(v2, tInfo, 'bodyString', new_d[v2], 'bodyString')
+            if share_new:
+                bunch.newText = new_d[v].bodyString
+                entry = u.live_texts.get(v)
+                if entry and entry.text is bunch.newText:
+                    entry.holders.append((weakref.ref(bunch), 'newText'))
+            if share_old:
+                bunch.oldText = old_d[v].bodyString
+            else:
+                u.encodeText(None, bunch, 'oldText', bunch, 'newText')
+    #@+node:ekr.20211109082426.8: *5* u.encodeText
+    max_delta_chain = 50  # The maximum number of deltas applied to get a text.
+
+    def encodeText(self, v, old_holder, old_key, new_holder, new_key):
+        """
+        Replace old_holder.old_key, a snapshot of some text, by a delta
+        against new_holder.new_key, a later snapshot of the same text.
+
+        If v is not None, u.live_texts[v] remembers all objects holding the
+        new snapshot. Encoding the next change to v replaces the snapshot in
+        those objects by a delta too, so each version of v's body appears in
+        full at most once.
+        """
+        u = self
+        old = getattr(old_holder, old_key, None)
+        new = getattr(new_holder, new_key, None)
+        if not isinstance(old, str) or not isinstance(new, str):
+            return
+        delta = u.makeDelta(old, new)
+        setattr(old_holder, old_key, delta)
+        if v is None:
+            return
+        # Replace the previous snapshot of v, if it is the same as old.
+        entry = u.live_texts.get(v)
+        rebase = entry and entry.depth < u.max_delta_chain and entry.text == old
+        holders = []
+        if rebase:
+            for ref, key in entry.holders:
+                holder = ref()
+                if holder is not None and getattr(holder, key, None) is entry.text:
+                    setattr(holder, key, delta)
+                    holders.append((ref, key))
+        # Remember the objects holding the new snapshot.
+        if delta is new:
+            holders.append((weakref.ref(old_holder), old_key))
+            depth = entry.depth if rebase else 0
+        else:
+            holders, depth = [], 0
+            if isinstance(delta, UndoText):
+                holders.append((weakref.ref(delta), 'base'))
+                depth = entry.depth + 1 if rebase else 0
+        holders.append((weakref.ref(new_holder), new_key))
+        u.live_texts[v] = g.Bunch(depth=depth, holders=holders, text=new)
+    #@+node:ekr.20211109082426.9: *5* u.getText
+    def getText(self, val):
+        """Return the text of val if val is an UndoText or SpilledText."""
+        if isinstance(val, (UndoText, SpilledText)):
+            return val.text()
+        return val
+    #@+node:ekr.20211109082426.10: *5* u.makeDelta
+    def makeDelta(self, old, new):
+        """
+        Return an UndoText that computes old from new, or old itself if the
+        delta would not be much smaller than old.
+        """
+        if old == new:
+            return new  # Share the string.
+        n = min(len(old), len(new))
+        # Binary search for the length of the common prefix.
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if old[:mid] == new[:mid]:
+                lo = mid
+            else:
+                hi = mid - 1
+        head = lo
+        # Binary search for the length of the common suffix.
+        lo, hi = 0, n - head
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if old[len(old) - mid :] == new[len(new) - mid :]:
+                lo = mid
+            else:
+                hi = mid - 1
+        tail = lo
+        middle = old[head : len(old) - tail]
+        if 2 * len(middle) > len(old):
+            return old
+        return UndoText(new, head, middle, tail)
     #@+node:EKR.20040526150818: *4* u.getBead
     def getBead(self, n):
         """Set Undoer ivars from the bunch at the top of the undo stack."""
@@ -192,6 +460,8 @@ class Undoer:
         u = self
         # New in 4.4b2:  Add this to the group if it is being accumulated.
         bunch2 = u.bead >= 0 and u.bead < len(u.beads) and u.beads[u.bead]
+        # Replace old text by deltas before u.cutStack computes sizes.
+        u.encodeBead(bunch)
         if bunch2 and hasattr(bunch2, 'kind') and bunch2.kind == 'beforeGroup':
             # Just append the new bunch the group's items.
             bunch2.items.append(bunch)
@@ -227,7 +497,7 @@ class Undoer:
             assert val in (True, False), f"{val!r} {g.callers()!s}"
         # bunch is not a dict, so bunch.keys() is required.
         for key in list(bunch.keys()):
-            val = bunch.get(key)
+            val = u.getText(bunch.get(key))
             setattr(u, key, val)
             if key not in u.optionalIvars:
                 u.optionalIvars.append(key)
@@ -310,9 +580,11 @@ class Undoer:
     def restoreVnodeUndoInfo(self, bunch):
         """Restore all ivars saved in the bunch."""
         v = bunch.v
+        v.context.touchVnodes([v] + v.children + v.parents)
         v.statusBits = bunch.statusBits
         v.children = bunch.children
         v.parents = bunch.parents
+        v.context.touchVnodes(v.children + v.parents)
         uA = bunch.get('unknownAttributes')
         if uA is not None:
             v.unknownAttributes = uA
@@ -321,7 +593,7 @@ class Undoer:
     def restoreTnodeUndoInfo(self, bunch):
         v = bunch.v
         v.h = bunch.headString
-        v.b = bunch.bodyString
+        v.b = self.getText(bunch.bodyString)
         v.statusBits = bunch.statusBits
         uA = bunch.get('unknownAttributes')
         if uA is not None:
@@ -913,6 +1185,8 @@ class Undoer:
         u.setUndoType("Can't Undo")
         u.beads = []  # List of undo nodes.
         u.bead = -1  # Index of the present bead: -1:len(beads)
+        u.bead_sizes = {}
+        u.live_texts = {}
     #@+node:ekr.20031218072017.1490: *4* u.doTyping & helper
     def doTyping(self, p, undo_type, oldText, newText,
         newInsert=None, oldSel=None, newSel=None, oldYview=None,
@@ -1294,13 +1568,17 @@ class Undoer:
         # Init status.
         u.redoing = True
         u.groupCount = 0
-        if u.redoHelper:
-            u.redoHelper()
-        else:
-            g.trace(f"no redo helper for {u.kind} {u.undoType}")
+        touched = c.addVnodeObserver()
+        try:
+            if u.redoHelper:
+                u.redoHelper()
+            else:
+                g.trace(f"no redo helper for {u.kind} {u.undoType}")
+        finally:
+            c.removeVnodeObserver(touched)
         #
         # Finish.
-        c.checkOutline()
+        c.checkOutline(vnodes=touched)
         u.update_status()
         u.redoing = False
         u.bead += 1
@@ -1409,6 +1687,8 @@ class Undoer:
         for v in u.followingSibs:
             v.parents.remove(parent_v)
             v.parents.append(u.p.v)
+        c.touchVnodes((parent_v, u.p.v))
+        c.touchVnodes(u.followingSibs)
         u.p.setDirty()
         c.setCurrentPosition(u.p)
     #@+node:ekr.20050318085432.6: *4* u.redoGroup
@@ -1506,6 +1786,7 @@ class Undoer:
         parent_v.children.insert(u.newN, v)
         v.parents.append(u.newParent_v)
         v.parents.remove(u.oldParent_v)
+        c.touchVnodes((v, u.oldParent_v, u.newParent_v))
         u.newParent_v.setDirty()
         #
         u.updateMarks('new')
@@ -1555,6 +1836,8 @@ class Undoer:
         for child in u.children:
             child.parents.remove(u.p.v)
             child.parents.append(parent_v)
+        c.touchVnodes((parent_v, u.p.v))
+        c.touchVnodes(u.children)
         u.p.setDirty()
         c.setCurrentPosition(u.p)
     #@+node:ekr.20080425060424.4: *4* u.redoSort
@@ -1600,6 +1883,29 @@ class Undoer:
         if u.yview:
             c.bodyWantsFocus()
             w.setYScrollPosition(u.yview)
+    #@+node:ekr.20211109082426.11: *3* u.showUndoStats
+    @cmd('show-undo-stats')
+    def showUndoStats(self, event=None):
+        """
+        Print the approximate memory used by the undo stack of each open
+        outline, the amount of undo text spilled to disk and the number of
+        discarded undo entries.
+        """
+        lines = ['undo stats...']
+        for c in g.app.commanders():
+            u = c.undoer
+            size = sum(u.beadSize(z) for z in u.beads)
+            spilled = 0
+            if u.spill_file:
+                u.spill_file.seek(0, 2)
+                spilled = u.spill_file.tell()
+            budget = f"{u.memory_budget // 1024} KB" if u.memory_budget else 'no limit'
+            lines.append(
+                f"{len(u.beads):5} beads, {size // 1024:7} KB in memory, "
+                f"{spilled // 1024:7} KB on disk ({u.spilled_beads} beads), "
+                f"{u.discarded_beads} beads discarded, "
+                f"budget: {budget}: {c.shortFileName() or c.frame.title}")
+        g.es_print('\n'.join(lines))
     #@+node:ekr.20031218072017.2039: *3* u.undo
     @cmd('undo')
     def undo(self, event=None):
@@ -1623,13 +1929,17 @@ class Undoer:
         u.groupCount = 0
         #
         # Dispatch.
-        if u.undoHelper:
-            u.undoHelper()
-        else:
-            g.trace(f"no undo helper for {u.kind} {u.undoType}")
+        touched = c.addVnodeObserver()
+        try:
+            if u.undoHelper:
+                u.undoHelper()
+            else:
+                g.trace(f"no undo helper for {u.kind} {u.undoType}")
+        finally:
+            c.removeVnodeObserver(touched)
         #
         # Finish.
-        c.checkOutline()
+        c.checkOutline(vnodes=touched)
         u.update_status()
         u.undoing = False
         u.bead -= 1
@@ -1755,6 +2065,8 @@ class Undoer:
         for sib in u.followingSibs:
             sib.parents.remove(u.p.v)
             sib.parents.append(parent_v)
+        c.touchVnodes((parent_v, u.p.v))
+        c.touchVnodes(u.followingSibs)
         u.p.setAllAncestorAtFileNodesDirty()
         c.setCurrentPosition(u.p)
     #@+node:ekr.20050318085713: *4* u.undoGroup
@@ -1854,6 +2166,7 @@ class Undoer:
         # Recompute the parent links.
         v.parents.append(u.oldParent_v)
         v.parents.remove(u.newParent_v)
+        c.touchVnodes((v, u.oldParent_v, u.newParent_v))
         u.updateMarks('old')
         u.p.setDirty()
         c.selectPosition(u.p)
@@ -1902,6 +2215,8 @@ class Undoer:
         for child in u.children:
             child.parents.remove(parent_v)
             child.parents.append(u.p.v)
+        c.touchVnodes((parent_v, u.p.v))
+        c.touchVnodes(u.children)
         u.p.setAllAncestorAtFileNodesDirty()
         c.setCurrentPosition(u.p)
     #@+node:ekr.20031218072017.1493: *4* u.undoRedoText
@@ -2036,6 +2351,48 @@ class Undoer:
             w.setSelectionRange(i, j, insert=ins)
             w.seeInsertPoint()
     #@-others
+#@+node:ekr.20211109082426.12: ** class SpilledText
+class SpilledText:
+    """A text snapshot that u.cutStackToBudget has written to a temp file."""
+
+    __slots__ = ('f', 'n', 'offset')
+
+    def __init__(self, f, offset, n):
+        self.f = f
+        self.n = n  # The length of the encoded text.
+        self.offset = offset
+
+    def text(self):
+        self.f.seek(self.offset)
+        return self.f.read(self.n).decode('utf-8')
+#@+node:ekr.20211109082426.13: ** class UndoText
+class UndoText:
+    """
+    A text snapshot, stored as a delta against a later snapshot, self.base.
+
+    self.base is either a string or another UndoText. The text is
+    base[:head] + middle + base[len(base)-tail:].
+    """
+
+    __slots__ = ('__weakref__', 'base', 'head', 'middle', 'tail')
+
+    def __init__(self, base, head, middle, tail):
+        self.base = base
+        self.head = head
+        self.middle = middle
+        self.tail = tail
+
+    def text(self):
+        # Don't recurse: chains can be long.
+        chain = []
+        obj = self
+        while isinstance(obj, UndoText):
+            chain.append(obj)
+            obj = obj.base
+        s = obj
+        for delta in reversed(chain):
+            s = s[: delta.head] + delta.middle + s[len(s) - delta.tail :]
+        return s
 #@-others
 #@@language python
 #@@tabwidth -4
@@ -12,6 +12,7 @@ Written by Félix Malboeuf and Edward K. Ream.
 #@+node:felix.20210621233316.2: ** << imports >>
 import argparse
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import inspect
 import json
 import os
@@ -20,12 +21,17 @@ import socket
 import textwrap
 import time
 import tkinter as Tk
+import zlib
 # Third-party.
 # #2300
 try:
     import websockets
 except Exception:
     websockets = None
+try:
+    import msgpack
+except Exception:
+    msgpack = None
 # Make sure leo-editor folder is on sys.path.
 core_dir = os.path.dirname(__file__)
 leo_path = os.path.normpath(os.path.join(core_dir, '..', '..'))
@@ -62,6 +68,54 @@ class SetEncoder(json.JSONEncoder):
         if isinstance(obj, set):
             return list(obj)
         return json.JSONEncoder.default(self, obj)
+#@+node:ekr.20211109071318.1: ** message framing
+#@+at Clients may send requests as text or as binary websocket messages.
+# The first byte of a binary message gives its encoding:
+#
+# - ZLIB_FRAME:    zlib-compressed json.
+# - MSGPACK_FRAME: MessagePack. Requires the msgpack package.
+#
+# Other binary messages contain utf-8 encoded json.
+# The server answers each request with the encoding of the request.
+#
+# The server's commands create their responses as json text. For MessagePack
+# requests, encode_message transcodes that text: it parses the json and packs
+# the result. MessagePack therefore saves the client work, not the server.
+#@@c
+
+ZLIB_FRAME = 1
+MSGPACK_FRAME = 2
+
+def decode_message(message):
+    """
+    Return (d, encoding) for message, a str or bytes received from a client.
+    encoding is 'json', 'zlib' or 'msgpack'.
+    """
+    if isinstance(message, str) or not message:
+        return json.loads(message), 'json'
+    frame, data = message[0], message[1:]
+    if frame == ZLIB_FRAME:
+        try:
+            return json.loads(zlib.decompress(data)), 'zlib'
+        except zlib.error as e:
+            raise ServerError(f"decode_message: bad zlib frame: {e}")
+    if frame == MSGPACK_FRAME:
+        if not msgpack:
+            raise ServerError("decode_message: msgpack is not installed")
+        return msgpack.unpackb(data), 'msgpack'
+    return json.loads(message), 'json'
+
+def encode_message(s, encoding):
+    """
+    Return s, a json string, encoded as given by encoding.
+
+    The 'msgpack' encoding parses s and packs the result, a full round trip.
+    """
+    if encoding == 'zlib':
+        return bytes([ZLIB_FRAME]) + zlib.compress(s.encode('utf-8'))
+    if encoding == 'msgpack' and msgpack:
+        return bytes([MSGPACK_FRAME]) + msgpack.packb(json.loads(s))
+    return s
 #@+node:felix.20210621233316.3: ** Exception classes
 class InternalServerError(Exception):  # pragma: no cover
     """The server violated its own coding conventions."""
@@ -175,6 +229,8 @@ class ServerExternalFilesController(ExternalFilesController):
             # Check the next commander for which
             # @bool check_for_changed_external_file is True.
             c = self.unchecked_commanders.pop()
+            if c in getattr(g.leoServer, 'busy', ()):
+                return  # A worker thread is using c.
             self.lastCommander = c
             self.lastPNode = None  # when none, a client result means its for the leo file.
             self.idle_check_commander(c)
@@ -352,9 +408,202 @@ class ServerExternalFilesController(ExternalFilesController):
         g.leoServer._send_async_output(package, True)
         self.waitingForAnswer = True
     #@-others
+#@+node:ekr.20211109065845.1: ** class OutlineChangeLog
+class OutlineChangeLog:
+    """
+    A versioned log of the changes to the headlines, bodies, structure and
+    dirty bits of all the nodes of one commander.
+
+    The log observes c.touchVnodes, so ocl.update compares only the touched
+    vnodes and the nodes of newly linked subtrees with a snapshot of their
+    last known state. String identity suffices to detect changed headlines
+    and bodies. The snapshot holds v._bodyString itself, so taking it never
+    loads lazy bodies. The deltas sent to the clients contain only the
+    changed nodes.
+    """
+
+    max_entries = 500  # The number of deltas to keep.
+
+    def __init__(self, c):
+        self.c = c
+        self.seq = 0  # The sequence number of the last delta.
+        self.entries = []  # List of (seq, delta).
+        self.root = c.hiddenRootNode
+        self.touched = c.addVnodeObserver()  # The vnodes touched since the last update.
+        self.snapshot = self.take_snapshot()
+    #@+others
+    #@+node:ekr.20211109083231.13: *3* ocl.close
+    def close(self):
+        """Stop observing the commander's vnodes."""
+        self.c.removeVnodeObserver(self.touched)
+    #@+node:ekr.20211109070022.1: *3* ocl.take_snapshot & helper
+    def take_snapshot(self):
+        """Return a dict describing the state of all vnodes."""
+        d = {}
+        self.snapshot_subtree(self.c.hiddenRootNode, d)
+        return d
+
+    def snapshot_subtree(self, v, d):
+        """Add entries to d for v and all its descendants not already in d."""
+        stack = [v]
+        while stack:
+            v = stack.pop()
+            if v in d:
+                continue
+            d[v] = self.state(v)
+            stack.extend(v.children)
+    #@+node:ekr.20211109083231.14: *3* ocl.state
+    def state(self, v):
+        """
+        Return a tuple describing the state of v.
+        Only the dirty bit matters: other status bits are UI-only.
+
+        Don't call v.bodyString: v._bodyString may be a LazyBodies object.
+        """
+        return (
+            v._headString,
+            v._bodyString,
+            tuple(z.gnx for z in v.children),
+            v.isDirty(),
+        )
+    #@+node:ekr.20211109070159.1: *3* ocl.update & helper
+    def update(self):
+        """
+        Add a new delta to the log describing all changes since the last update.
+        Return the delta, or None if nothing has changed.
+        """
+        c = self.c
+        touched = list(self.touched)
+        self.touched.clear()
+        if c.hiddenRootNode is self.root:
+            changed, deleted = self.update_snapshot(touched)
+        else:
+            # The commander has read a new outline.
+            self.root = c.hiddenRootNode
+            old, self.snapshot = self.snapshot, self.take_snapshot()
+            changed = {v: old.get(v) for v in self.snapshot}
+            deleted = [v.gnx for v in old if v not in self.snapshot]
+        bodies, headlines, children, status = {}, {}, {}, {}
+        for v, old_state in changed.items():
+            h, b, gnxs, dirty = self.snapshot[v]
+            old_h, old_b, old_gnxs, old_dirty = old_state or (None, None, None, None)
+            if v == c.hiddenRootNode:
+                # The root's children, but not its fake headline.
+                if gnxs != old_gnxs:
+                    children[v.gnx] = list(gnxs)
+                continue
+            if h is not old_h:
+                headlines[v.gnx] = h
+            if b is not old_b:
+                # None: the body has changed, but has not been loaded.
+                bodies[v.gnx] = b if isinstance(b, str) else None
+            if gnxs != old_gnxs:
+                children[v.gnx] = list(gnxs)
+            if dirty != old_dirty:
+                status[v.gnx] = self.status_d(v)
+        delta = {}
+        for key, value in (
+            ('body', bodies),
+            ('children', children),
+            ('deleted', deleted),
+            ('headline', headlines),
+            ('status', status),
+        ):
+            if value:
+                delta[key] = value
+        if not delta:
+            return None
+        self.seq += 1
+        self.entries.append((self.seq, delta))
+        del self.entries[: -self.max_entries]
+        return delta
+
+    def update_snapshot(self, touched):
+        """
+        Update the snapshot for the touched vnodes, the nodes of newly linked
+        subtrees and the descendants of deleted vnodes.
+
+        Return (changed, deleted). changed is a dict whose keys are the
+        updated vnodes and whose values are their previous states, or None.
+        deleted is a list of the gnxs of the deleted vnodes.
+        """
+        d = self.snapshot
+        changed, deleted, seen = {}, [], set()
+        stack = touched
+        while stack:
+            v = stack.pop()
+            if v in seen:
+                continue
+            seen.add(v)
+            if self.is_live(v):
+                changed[v] = d.get(v)
+                d[v] = self.state(v)
+                stack.extend(z for z in v.children if z not in d)
+            elif v in d:
+                # Some of v's descendants may also have been deleted.
+                deleted.append(v.gnx)
+                del d[v]
+                stack.extend(v.children)
+        return changed, deleted
+    #@+node:ekr.20211109083231.15: *3* ocl.is_live
+    def is_live(self, v):
+        """Return True if v is in the outline."""
+        root = self.c.hiddenRootNode
+        seen, stack = set(), [v]
+        while stack:
+            v = stack.pop()
+            if v is root:
+                return True
+            if v not in seen:
+                seen.add(v)
+                stack.extend(v.parents)
+        return False
+    #@+node:ekr.20211109070336.1: *3* ocl.changes_since
+    def changes_since(self, seq):
+        """
+        Return a delta describing all changes after the given sequence number,
+        or None if the log no longer contains all such changes.
+        """
+        if seq > self.seq:
+            return None
+        if seq < self.seq and (not self.entries or self.entries[0][0] > seq + 1):
+            return None
+        result, deleted = {}, {}
+        for seq2, delta in self.entries:
+            if seq2 <= seq:
+                continue
+            for gnx in delta.get('deleted', []):
+                for d in result.values():
+                    d.pop(gnx, None)
+                deleted[gnx] = True
+            for key in ('body', 'children', 'headline', 'status'):
+                for gnx, value in delta.get(key, {}).items():
+                    result.setdefault(key, {})[gnx] = value
+                    deleted.pop(gnx, None)
+        if deleted:
+            result['deleted'] = list(deleted)
+        return result
+    #@+node:ekr.20211109070513.1: *3* ocl.status_d
+    def status_d(self, v):
+        """Return a dict describing v's status bits."""
+        return {'dirty': v.isDirty()}
+    #@-others
 #@+node:felix.20210621233316.4: ** class LeoServer
 class LeoServer:
     """Leo Server Controller"""
+
+    # Actions that first index c's outline in c's worker thread.
+    # Leo's core is not thread-safe, and all commands use app-wide data
+    # such as g.app.log, so the actions themselves run in the main thread.
+    threaded_actions = {
+        '!clone_find_all',
+        '!clone_find_all_flattened',
+        '!clone_find_all_flattened_marked',
+        '!clone_find_all_marked',
+        '!clone_find_tag',
+        '!find_all',
+        '!replace_all',
+    }
     #@+others
     #@+node:felix.20210621233316.5: *3* server.__init__
     def __init__(self, testing=False):
@@ -370,6 +619,11 @@ class LeoServer:
         self.dummy_c = None  # Set below, after we set g.
         self.action = None
         self.bad_commands_list = []  # Set below.
+        self.change_logs = {}  # Keys are commanders, values are OutlineChangeLogs.
+        self.busy = set()  # Commanders whose worker thread is indexing the outline.
+        self.executors = {}  # Keys are commanders, values are ThreadPoolExecutors.
+        self.locks = {}  # Keys are commanders (or None), values are asyncio.Locks.
+        self.push_changes = False  # True: push deltas to all clients.
         #
         # Debug utilities
         self.current_id = 0  # Id of action being processed.
@@ -623,10 +877,7 @@ class LeoServer:
             try:
                 gnx = key.command.gnx
                 c = self._check_c()
-                # pylint: disable=undefined-loop-variable
-                for p in c.all_positions():
-                    if p.gnx == gnx:
-                        break
+                p = c.gnx2position(gnx)
                 if p:
                     assert c.positionExists(p)
                     c.selectPosition(p)
@@ -725,6 +976,13 @@ class LeoServer:
             if forced or not c.changed:
                 # c.close() # Stops too much if last file closed
                 g.app.closeLeoWindow(c.frame, finish_quit=False)
+                log = self.change_logs.pop(c, None)
+                if log:
+                    log.close()
+                executor = self.executors.pop(c, None)
+                if executor:
+                    executor.shutdown(wait=False)
+                self.locks.pop(c, None)
             else:
                 # Cannot close, return empty response without 'total' (ask to save, ignore or cancel)
                 return self._make_response()
@@ -1292,6 +1550,41 @@ class LeoServer:
                 # this outputs all Root Children
                 children = [self._get_position_d(child) for child in self._yieldAllRootChildren()]
         return self._make_minimal_response({"children": children})
+    #@+node:ekr.20211109070650.1: *5* server.get_changes
+    def get_changes(self, param):
+        """
+        Return all changes to the outline since param["seq"], a sequence number
+        returned by a previous call to get_changes. Omit "seq" to start.
+
+        The response contains the new "seq" and either "changes" or "full".
+        "full" means that the client must fetch the entire outline again.
+        "changes" is a dict with these optional keys:
+
+        - "body":     a dict of new body texts, keyed by gnx.
+                      None means that a body has changed but has not been
+                      read from its external file: use get_body to fetch it.
+        - "headline": a dict of new headlines, keyed by gnx.
+        - "children": a dict of lists of child gnxs, keyed by the parent's gnx.
+                      "root" gives the gnx of the parent of all top-level nodes.
+        - "status":   a dict of dicts {"dirty"}, keyed by gnx.
+        - "deleted":  a list of gnxs of nodes that no longer exist.
+
+        param["push"], if present, enables or disables sending these changes
+        to all clients as "changes" async messages after every command.
+        """
+        c = self._check_c()
+        if "push" in param:
+            self.push_changes = bool(param["push"])
+        log = self._get_change_log(c)
+        log.update()
+        seq = param.get("seq")
+        package = {"root": c.hiddenRootNode.gnx, "seq": log.seq}
+        changes = None if seq is None else log.changes_since(seq)
+        if changes is None:
+            package["full"] = True
+        else:
+            package["changes"] = changes
+        return self._make_minimal_response(package)
     #@+node:felix.20210621233316.43: *5* server.get_focus
     def get_focus(self, param):
         """
@@ -1535,21 +1828,20 @@ class LeoServer:
         u, wrapper = c.undoer, c.frame.body.wrapper
         if body is None:  # pragma: no cover
             raise ServerError(f"{tag}: no body given")
-        for p in c.all_positions():
-            if p.v.gnx == gnx:
-                if body==p.v.b:
-                    return self._make_response()
-                    # Just exit if there is no need to change at all.
-                bunch = u.beforeChangeNodeContents(p)
-                p.v.setBodyString(body)
-                u.afterChangeNodeContents(p, "Body Text", bunch)
-                if c.p == p:
-                    wrapper.setAllText(body)
-                if not self.c.isChanged():  # pragma: no cover
-                    c.setChanged()
-                if not p.v.isDirty():  # pragma: no cover
-                    p.setDirty()
-                break
+        p = c.gnx2position(gnx) if gnx else None
+        if p:
+            if body==p.v.b:
+                return self._make_response()
+                # Just exit if there is no need to change at all.
+            bunch = u.beforeChangeNodeContents(p)
+            p.v.setBodyString(body)
+            u.afterChangeNodeContents(p, "Body Text", bunch)
+            if c.p == p:
+                wrapper.setAllText(body)
+            if not self.c.isChanged():  # pragma: no cover
+                c.setChanged()
+            if not p.v.isDirty():  # pragma: no cover
+                p.setDirty()
         # additional forced string setting
         if gnx:
             v = c.fileCommands.gnxDict.get(gnx)  # vitalije
@@ -1704,6 +1996,52 @@ class LeoServer:
         # uses the __version__ global constant and the v1, v2, v3 global version numbers
         result = {"version": __version__ , "major": v1, "minor": v2, "patch": v3}
         return self._make_minimal_response(result)
+    #@+node:ekr.20211109071455.1: *5* server.batch
+    def batch(self, param):
+        """
+        Execute param["actions"], a list of {"action": action, "param": param}
+        dicts, in order, and return all their responses in one response.
+
+        No other request can run until all the actions have been executed.
+        If an action fails, the remaining actions are skipped and the response
+        contains "error" and "index", the index of the failing action.
+        Actions that have already run are not undone.
+
+        A successful !shut_down action shuts down the server, as usual.
+        """
+        tag = 'batch'
+        actions = param.get("actions") or []
+        if not isinstance(actions, list):  # pragma: no cover
+            raise ServerError(f"{tag}: actions must be a list")
+        id_ = self.current_id
+        results, error = [], None
+        try:
+            for d in actions:
+                if not isinstance(d, dict):
+                    raise ServerError(f"{tag}: bad action: {d!r}")
+                action = d.get("action")
+                if action == "!batch":
+                    raise ServerError(f"{tag}: nested batch")
+                results.append(self._do_message({
+                    "id": id_,
+                    "action": action,
+                    "param": d.get("param") or {},
+                }))
+        except TerminateServer:
+            raise
+        except Exception as e:
+            error = f"{e}"
+        finally:
+            self.current_id = id_
+            self.action = "!batch"
+        package = {"id": id_}
+        if error:
+            package["error"] = error
+            package["index"] = len(results)
+        # Splice the json responses into the json batch response without
+        # parsing and dumping them again.
+        s = json.dumps(package, separators=(',', ':'), cls=SetEncoder)
+        return f"{s[:-1]},\"results\":[{','.join(results)}]}}"
     #@+node:felix.20210818012827.1: *5* server.do_nothing
     def do_nothing(self, param):
         """Simply return states from _make_response"""
@@ -2216,17 +2554,20 @@ class LeoServer:
 
             'show-focus',
             'show-fonts',
+            'show-import-times',
 
             'show-invisibles',
             'show-next-tip',
             'show-node-uas',
             'show-outline-dock',
+            'show-perf-stats',
             'show-plugin-handlers',
             'show-plugins-info',
             'show-settings',
             'show-settings-outline',
             'show-spell-info',
             'show-stats',
+            'show-undo-stats',
 
             'style-set-selected',
 
@@ -3187,6 +3528,57 @@ class LeoServer:
         if result is None:  # pragma: no cover
             raise ServerError(f"{tag}: no response: {action!r}")
         return result
+    #@+node:ekr.20211109072437.1: *4* server._run_message & helper
+    async def _run_message(self, d):
+        """
+        Handle d, a dict representing an incoming request, and return the
+        response, as _do_message does.
+
+        Requests for a commander are serialized by a per-commander lock.
+        Before running an action in self.threaded_actions, c's worker thread
+        indexes c's outline, so the search doesn't block requests for other
+        outlines. All actions run in the main thread.
+        """
+        selected = self.c
+        c = self._request_commander(d)
+        lock = self.locks.get(c)
+        if not lock:
+            lock = self.locks[c] = asyncio.Lock()
+        async with lock:
+            action = d.get("action") if isinstance(d, dict) else None
+            if c and action in self.threaded_actions:
+                executor = self.executors.get(c)
+                if not executor:
+                    executor = self.executors[c] = ThreadPoolExecutor(
+                        max_workers=1, thread_name_prefix=f"leoserver-{c.shortFileName()}")
+                self.busy.add(c)
+                try:
+                    loop = asyncio.get_event_loop()
+                    await loop.run_in_executor(executor, c.findCommands.search_index.index_outline)
+                finally:
+                    self.busy.discard(c)
+            # Other requests may have selected another commander while this one waited.
+            if selected and selected is not self.c and selected in g.app.commanders():
+                self.c = selected
+            return self._do_message(d)
+
+    def _request_commander(self, d):
+        """Return the commander that request d targets."""
+        action = d.get("action") if isinstance(d, dict) else None
+        param = d.get("param") if isinstance(d, dict) else None
+        if not isinstance(param, dict):
+            return self.c
+        commanders = g.app.commanders()
+        if action == '!set_opened_file':
+            index = param.get('index')
+            if isinstance(index, int) and 0 <= index < len(commanders):
+                return commanders[index]
+        elif action == '!open_file' and param.get('filename'):
+            for c in commanders:
+                if c.fileName() == param.get('filename'):
+                    return c
+            return None
+        return self.c
     #@+node:felix.20210621233316.86: *4* server._do_server_command
     def _do_server_command(self, action, param):
         tag = '_do_server_command'
@@ -3267,6 +3659,13 @@ class LeoServer:
                 if func:
                     return func
         return None
+    #@+node:ekr.20211109070827.1: *4* server._get_change_log
+    def _get_change_log(self, c):
+        """Return the OutlineChangeLog for c, creating it if necessary."""
+        log = self.change_logs.get(c)
+        if not log:
+            log = self.change_logs[c] = OutlineChangeLog(c)
+        return log
     #@+node:felix.20210621233316.91: *4* server._get_focus
     def _get_focus(self):
         """Server helper method to get the focused panel name string"""
@@ -3455,12 +3854,28 @@ class LeoServer:
         }
     #@+node:felix.20210621233316.96: *4* server._positionFromGnx
     def _positionFromGnx(self, gnx):
-        """Return first p node with this gnx or false"""
+        """Return the first position in outline order with this gnx, or False."""
         c = self._check_c()
-        for p in c.all_unique_positions():
-            if p.v.gnx == gnx:
-                return p
-        return False
+        return c.gnx2position(gnx) or False
+    #@+node:ekr.20211109071004.1: *4* server._push_changes
+    def _push_changes(self):
+        """
+        If enabled by get_changes, send the changes made by the last command
+        to all clients.
+        """
+        c = self.c
+        if not self.push_changes or not c or c not in self.change_logs:
+            return
+        log = self.change_logs[c]
+        changes = log.update()
+        if changes:
+            self._send_async_output({
+                "async": "changes",
+                "changes": changes,
+                "fileName": c.fileName(),
+                "root": c.hiddenRootNode.gnx,
+                "seq": log.seq,
+            }, toAll=True)
     #@+node:felix.20210622232409.1: *4* server._send_async_output & helper
     def _send_async_output(self, package, toAll = False):
         """
@@ -3843,12 +4258,13 @@ def main():  # pragma: no cover (tested in client)
                 try:
                     n += 1
                     d = None
-                    d = json.loads(json_message)
+                    encoding = 'json'
+                    d, encoding = decode_message(json_message)
                     if trace and verbose:
                         print(f"{tag}: got: {d}", flush=True)
                     elif trace:
                         print(f"{tag}: got: {d}", flush=True)
-                    answer = controller._do_message(d)
+                    answer = await controller._run_message(d)
                 except TerminateServer as e:
                     raise websockets.exceptions.ConnectionClosed(code=1000, reason=e)
                 except ServerError as e:
@@ -3872,10 +4288,11 @@ def main():  # pragma: no cover (tested in client)
                     g.print_exception()
                     print('', flush=True)
                     break
-                await websocket.send(answer)
+                await websocket.send(encode_message(answer, encoding))
 
                 # If not a 'getter' send refresh signal to other clients
                 if controller.action[0:5] != "!get_" and controller.action != "!do_nothing":
+                    controller._push_changes()
                     await notify_clients(controller.action, websocket)
 
         except websockets.exceptions.ConnectionClosedError as e:  # pragma: no cover
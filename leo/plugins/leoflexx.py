@@ -1653,7 +1653,7 @@ class LeoBrowserTree(leoFrame.NullTree):
         old_p = self.root.c.p
         if trace:
             print('\n%30s: %4s %s ==> %s %s ' % (
-                tag, len(old_p.v._bodyString), old_p.h, len(p.v._bodyString), p.h))
+                tag, len(old_p.b), old_p.h, len(p.b), p.h))
         #
         # Schdule JS side to:
         # 1. Update *old* p.b from flx.body.
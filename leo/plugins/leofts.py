@@ -1,9 +1,24 @@
-import whoosh
-from whoosh.index import create_in, open_dir
-from whoosh.fields import *
-from whoosh.qparser import MultifieldParser
-from whoosh.analysis import RegexTokenizer, LowercaseFilter, StopFilter
+"""
+Full text search for Leo outlines, using SQLite's FTS5 extension.
+
+There is one index per .leo file, in ~/.leo/fts_index. The plugin creates
+the index when an outline is first opened, and updates it incrementally
+when the outline is saved: only the nodes that changed are re-indexed.
+
+The index also holds a hash of each node's contents. Opening an outline
+re-indexes the nodes whose hashes differ, so the index catches up with
+changes made while the outline was closed, say to external files.
+
+LeoFts.search searches the indices of all open and recently opened
+outlines. Results are ranked with FTS5's bm25 function.
+GnxCache.get_p maps results back to positions.
+"""
+
+import hashlib
+import heapq
 import os
+import re
+import sqlite3
 
 g = None
 
@@ -12,149 +27,280 @@ def set_leo(gg):
     g = gg
     g._fts = None
 
-def init ():
+def has_fts5():
+    """Return True if the sqlite3 module supports FTS5."""
+    try:
+        conn = sqlite3.connect(':memory:')
+        conn.execute('create virtual table t using fts5(x)')
+        conn.close()
+        return True
+    except sqlite3.Error:
+        return False
 
-    print ("bigdash init")
+def init():
     import leo.core.leoGlobals as g
-    
     set_leo(g)
-    ok = g.app.gui.guiName() == "qt"
-    g._fts = None
-    g._gnxcache = GnxCache()
-    
+    ok = has_fts5()
+    if ok:
+        g._gnxcache = GnxCache()
+        g.registerHandler('open2', onOpen)
+        g.registerHandler('save1', onSave1)
+        g.registerHandler('save2', onSave2)
+        g.plugin_signon(__name__)
+    else:
+        g.es_print('leofts.py: sqlite3 does not support FTS5')
     return ok
 
 def get_fts():
     if g._fts is None:
-        g._fts = LeoFts( g.app.homeLeoDir + "/fts_index")
+        g._fts = LeoFts(g.os_path_join(g.app.homeLeoDir, "fts_index"))
     return g._fts
 
 def all_positions_global():
     for c in g.app.commanders():
         for p in c.all_unique_positions():
-            yield (c,p)
+            yield (c, p)
+
+# Keys are commanders, values are the gnxs of nodes changed before a save.
+changed_gnxs = {}
+
+def onOpen(tag, keys):
+    c = keys.get('c')
+    if c and c.fileName():
+        get_fts().refresh_nodes(c)
+
+def onSave1(tag, keys):
+    c = keys.get('c')
+    if c:
+        changed_gnxs[c] = [v.gnx for v in c.all_unique_nodes() if v.isDirty()]
+
+def onSave2(tag, keys):
+    c = keys.get('c')
+    gnxs = changed_gnxs.pop(c, None)
+    if c and c.fileName() and gnxs is not None:
+        get_fts().update_nodes(c, gnxs)
 
 class GnxCache:
     """ map gnx => vnode """
     def __init__(self):
         self.clear()
+
     def update_new_cs(self):
         for c in g.app.commanders():
             if c.hash() not in self.cs:
-                for p in c.all_unique_positions():
-                    k = p.gnx
-                    self.ps[k] = c, p.v
+                for v in c.all_unique_nodes():
+                    self.ps[v.gnx] = c, v
                 self.cs.add(c.hash())
-        
+
     def get(self, gnx):
         if not self.ps:
             self.update_new_cs()
-        res = self.ps.get(gnx, None)                               
-        return res
-    def get_p(self,gnx):
-        r = self.get(gnx)
-        if r:
-            c,v = r
-            for p in c.all_unique_positions():
-                if p.v is v:
-                    return c,p.copy()
-        
-        print("Not in gnx cache, slow!")
-        
-        for c,p in all_positions_global():
-            
-            if p.gnx == gnx:
-                return c,p.copy()
+        return self.ps.get(gnx, None)
+
+    def get_p(self, gnx, doc=None):
+        """Return (c, p) for the node with the given gnx, or None."""
+        norm = lambda fn: os.path.normcase(os.path.abspath(fn))
+        for c in g.app.commanders():
+            if doc and (not c.fileName() or norm(c.fileName()) != norm(doc)):
+                continue
+            v = c.fileCommands.gnxDict.get(gnx)
+            if v:
+                p = c.vnode2position(v)
+                if p:
+                    return c, p.copy()
         return None
-        
+
     def clear(self):
         self.ps = {}
         self.cs = set()
 
-class LeoFts:    
+class LeoFts:
+    """An FTS5 index for each .leo file."""
+
     def __init__(self, idx_dir):
         self.idx_dir = idx_dir
-        if not os.path.exists(idx_dir):
-            os.mkdir(idx_dir)
-            self.create()
-        else:
-            self.ix = open_dir(idx_dir)
-    
-    def schema(self):
-        my_analyzer = RegexTokenizer("[a-zA-Z_]+") | LowercaseFilter() | StopFilter()
-        schema = Schema(h=TEXT(stored=True, analyzer=my_analyzer), gnx=ID(stored=True), b=TEXT(analyzer=my_analyzer), parent=ID(stored=True),
-                        doc=ID(stored=True))
-        return schema
-        
-    def create(self):
-        
-        schema = self.schema()
-        self.ix = ix = create_in(self.idx_dir, schema)
-        
-        
+        self.connections = {}  # Keys are normalized .leo file names.
+        if idx_dir != ':memory:' and not os.path.exists(idx_dir):
+            os.makedirs(idx_dir)
+
+    def norm(self, docfile):
+        return os.path.normcase(os.path.abspath(docfile))
+
+    def db_path(self, docfile):
+        """Return the path to the index of the given .leo file."""
+        if self.idx_dir == ':memory:':
+            return ':memory:'
+        key = hashlib.sha1(self.norm(docfile).encode('utf-8')).hexdigest()
+        return os.path.join(self.idx_dir, f"{key}.sqlite")
+
+    def connect(self, docfile, create=True):
+        """Return a connection to the index for docfile, or None."""
+        key = self.norm(docfile)
+        conn = self.connections.get(key)
+        if conn:
+            return conn
+        path = self.db_path(docfile)
+        if not create and (path == ':memory:' or not os.path.exists(path)):
+            return None
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.execute('create table if not exists info(key text primary key, value text)')
+        conn.execute(
+            'create virtual table if not exists nodes using '
+            'fts5(gnx unindexed, h, b, parent unindexed)')
+        conn.execute('create table if not exists hashes(gnx text primary key, hash text)')
+        conn.execute(
+            'insert or replace into info(key, value) values (?, ?)', ('doc', key))
+        self.connections[key] = conn
+        return conn
+
+    def has_index(self, docfile):
+        return self.connect(docfile, create=False) is not None
+
+    def row(self, v):
+        parent = v.parents[0].h if v.parents and v.parents[0].parents else ''
+        return v.gnx, v.h, v.b, parent
+
+    def row_hash(self, row):
+        """Return a hash of the indexed contents of a row."""
+        gnx, h, b, parent = row
+        return hashlib.sha1('\0'.join((h, b, parent)).encode('utf-8')).hexdigest()
+
     def index_nodes(self, c):
-        writer = self.ix.writer()
-        doc = c.mFileName
-        for p in c.all_unique_positions():
-            #print "pushing",p
-            if p.hasParent():
-                par = p.parent().get_UNL()
-            else:
-                par = c.mFileName
-            
-            writer.add_document(h=p.h, b=p.b, gnx=unicode(p.gnx), parent=par, doc=doc)
-            
-        writer.commit()
-        g._gnxcache.clear()
+        """Rebuild the index for all nodes of c."""
+        conn = self.connect(c.fileName())
+        rows = [self.row(v) for v in c.all_unique_nodes()]
+        with conn:
+            conn.execute('begin')
+            conn.execute('delete from nodes')
+            conn.execute('delete from hashes')
+            self.insert_rows(conn, rows)
+        self.clear_gnxcache()
+
+    def insert_rows(self, conn, rows):
+        """Add rows and their hashes to the index. The caller starts the transaction."""
+        conn.executemany('insert into nodes(gnx, h, b, parent) values (?, ?, ?, ?)', rows)
+        conn.executemany(
+            'insert or replace into hashes(gnx, hash) values (?, ?)',
+            ((row[0], self.row_hash(row)) for row in rows))
+
+    def replace_rows(self, conn, gnxs, rows):
+        """Remove the nodes with the given gnxs from the index, then add rows."""
+        with conn:
+            conn.execute('begin')
+            conn.executemany('delete from nodes where gnx = ?', ((z,) for z in gnxs))
+            conn.executemany('delete from hashes where gnx = ?', ((z,) for z in gnxs))
+            self.insert_rows(conn, rows)
+        self.clear_gnxcache()
+
+    def refresh_nodes(self, c):
+        """
+        Bring the index for c up to date, re-indexing only the nodes whose
+        contents no longer match their stored hashes.
+        """
+        conn = self.connect(c.fileName())
+        stored = dict(conn.execute('select gnx, hash from hashes'))
+        if not stored:
+            self.index_nodes(c)
+            return
+        rows = {v.gnx: self.row(v) for v in c.all_unique_nodes()}
+        changed = [gnx for gnx, row in rows.items() if stored.get(gnx) != self.row_hash(row)]
+        deleted = [gnx for gnx in stored if gnx not in rows]
+        if changed or deleted:
+            self.replace_rows(conn, changed + deleted, [rows[z] for z in changed])
+
+    def update_nodes(self, c, gnxs):
+        """
+        Re-index the nodes of c with the given gnxs, and forget deleted nodes.
+        """
+        conn = self.connect(c.fileName())
+        live = {v.gnx: v for v in c.all_unique_nodes()}
+        indexed = {gnx for (gnx,) in conn.execute('select gnx from nodes')}
+        if not indexed:
+            self.index_nodes(c)
+            return
+        stale = set(gnxs) | (indexed - set(live))
+        new = [live[z] for z in stale if z in live]
+        new.extend(v for gnx, v in live.items() if gnx not in indexed and gnx not in stale)
+        self.replace_rows(conn, stale, [self.row(v) for v in new])
+
+    def clear_gnxcache(self):
+        gnxcache = getattr(g, '_gnxcache', None)
+        if gnxcache:
+            gnxcache.clear()
 
     def drop_document(self, docfile):
-        writer = self.ix.writer()
-        print("Drop index", docfile)
-        writer.delete_by_term("doc", docfile)
-        writer.commit()
-        
+        key = self.norm(docfile)
+        conn = self.connections.pop(key, None)
+        if conn:
+            conn.close()
+        path = self.db_path(docfile)
+        if path != ':memory:' and os.path.exists(path):
+            os.remove(path)
+
+    def documents(self):
+        """Return the list of all .leo files to search."""
+        names = [c.fileName() for c in g.app.commanders() if c.fileName()]
+        rf = getattr(g.app, 'recentFilesManager', None)
+        if rf:
+            names.extend(rf.recentFiles)
+        result, seen = [], set()
+        for name in names:
+            key = self.norm(name)
+            if key not in seen:
+                seen.add(key)
+                result.append(name)
+        return result
+
     def statistics(self):
-        r = {}
-        with self.ix.searcher() as s:
-            r['documents'] = list(s.lexicon("doc"))
-        print("stats",r)
+        r = {'documents': [z for z in self.documents() if self.has_index(z)]}
         return r
-        
-        
-    def search(self, searchstring, limit=30):        
-                
+
+    def match_expression(self, searchstring):
+        """Return an FTS5 query matching all words of searchstring."""
+        words = re.findall(r'\w+', searchstring)
+        return ' '.join(f'"{z}"' for z in words)
+
+    def search(self, searchstring, limit=30, docs=None):
+        """
+        Return a list of dicts describing the best matches for searchstring,
+        in the given .leo files, or in all open and recently opened outlines.
+        """
+        queries = [searchstring, self.match_expression(searchstring)]
+        rows = []
+        for doc in self.documents() if docs is None else docs:
+            conn = self.connect(doc, create=False)
+            if not conn:
+                continue
+            for query in queries:
+                if not query:
+                    continue
+                try:
+                    rows.extend((rank, doc, gnx, h, parent, snippet)
+                        for rank, gnx, h, parent, snippet in conn.execute(
+                            "select bm25(nodes, 0.0, 10.0, 1.0) as rank, gnx, h, parent, "
+                            "snippet(nodes, 2, '<b>', '</b>', '...', 16) "
+                            "from nodes where nodes match ? order by rank limit ?",
+                            (query, limit)))
+                    break
+                except sqlite3.OperationalError:
+                    # Not a valid FTS5 query. Search for the words instead.
+                    continue
+        gnxcache = getattr(g, '_gnxcache', None)
         res = []
-        g._gnxcache.update_new_cs()
-        with self.ix.searcher() as searcher:
-            #print (list(searcher.lexicon("b")))
-            query = MultifieldParser(["h", "b"], schema=self.schema()).parse(searchstring)
-            results = searcher.search(query, limit=limit)
-            print (results)
-            for r in results:
-                rr = r.fields()
-                
-                gnx = rr["gnx"]
-                tup = g._gnxcache.get(gnx)
-                if tup:
-                    rr['f'] = True
-                    cont = tup[1].b
-                    
-                    hl = r.highlights("b", text = cont)
-                    rr["highlight"] = hl
-                    
-                else:
-                    rr['f'] = False
-                res.append(rr)
-                
+        for rank, doc, gnx, h, parent, snippet in heapq.nsmallest(limit, rows):
+            tup = gnxcache.get_p(gnx, doc) if gnxcache else None
+            res.append({
+                'doc': doc,
+                'f': bool(tup),
+                'gnx': gnx,
+                'h': h,
+                'highlight': snippet,
+                'parent': parent,
+                'rank': rank,
+            })
         return res
-            
+
     def close(self):
-        self.ix.close()
-        
-def main():
-    fts = LeoFts("c:/t/ltest")
-    fts.create()
-    
-    
-if __name__ == '__main__':
-    main()
\ No newline at end of file
+        for conn in self.connections.values():
+            conn.close()
+        self.connections = {}
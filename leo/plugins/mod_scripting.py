@@ -372,10 +372,9 @@ class AtButtonCallback:
 
         gnx = self.gnx
         # First, search self.c for the gnx.
-        for p in self.c.all_positions():
-            if p.gnx == gnx:
-                script = self.controller.getScript(p)
-                return script
+        p = self.c.gnx2position(gnx)
+        if p:
+            return self.controller.getScript(p)
         # See if myLeoSettings.leo is open.
         for c in g.app.commanders():
             if c.shortFileName().endswith('myLeoSettings.leo'):
@@ -384,10 +383,9 @@ class AtButtonCallback:
             c = None
         if c:
             # Search myLeoSettings.leo file for the gnx.
-            for p in c.all_positions():
-                if p.gnx == gnx:
-                    script = self.controller.getScript(p)
-                    return script
+            p = c.gnx2position(gnx)
+            if p:
+                return self.controller.getScript(p)
         return self.script
     #@-others
 #@+node:ekr.20060328125248.6: ** class ScriptingController
@@ -18,6 +18,8 @@ the following API::
         automatically updated to be consistent
     tc.get_tagged_nodes('foo')
         return a list of positions tagged 'foo'
+    tc.query('foo&!bar')
+        return the set of gnxs of nodes matching a search string (see below)
     tc.get_tags(p)
         return a list of tags applied to the node at position p.
         returns [] if node has no tags
@@ -27,6 +29,9 @@ the following API::
         remove the tag 'baz' from p if it is in the tag list
 
 Internally, tags are stored in `p.v.unknownAttributes['__node_tags']` as a set.
+The controller keeps an index from tags to gnxs, updated by tc.add_tag and
+tc.remove_tag, and rebuilt when an outline is opened and after pasting nodes.
+Call tc.initialize_taglist() to rebuild the index after changing tags directly.
 
 UI
 ==
@@ -69,6 +74,7 @@ used::
     <tag>|<tag> - return nodes tagged with either of the given tags (or both)
     <tag>-<tag> - return nodes tagged with the first tag, but not the second tag
     <tag>^<tag> - return nodes tagged with either of the given tags (but *not* both)
+    !<tag>      - return nodes *not* tagged with the given tag
 
 These may be combined, and are applied left-associatively, building the set from
 the left, such that the query `foo&bar^baz` will return only nodes tagged both
@@ -91,14 +97,17 @@ then the API may be used to tag nodes with any arbitrary strings. The UI,
 however, due to searching capabilities, may *not* be used to tag (or search for)
 nodes with tags containing the special search characters, `&|-^`. The UI also
 cannot search for tags of zero-length, and it automatically removes surrounding
-whitespace (calling .strip()).
+whitespace (calling .strip()). Nor can the UI add tags starting with '!'.
 """
 #@-<< docstring >>
+import bisect
 import re
 from leo.core import leoGlobals as g
 from leo.core import leoNodes
 from leo.core.leoQt import QtCore, QtWidgets
-from leo.core.leoQt import MouseButton
+if QtWidgets:
+    # #2031: Allow this plugin to run without Qt.
+    from leo.core.leoQt import MouseButton
 #@+others
 #@+node:peckj.20140804103733.9244: ** init (nodetags.py)
 def init():
@@ -136,8 +145,12 @@ class TagController:
 
         self.c = c
         self.taglist = []
+        self.tag_index = {}  # Keys are tags, values are sets of gnxs.
+        self.sorted_tags = []  # The keys of self.tag_index, sorted.
         self.initialize_taglist()
         c.theTagController = self
+        # Register this hook before the widget's hook.
+        g.registerHandler('command2', self.command2_hook)
         # #2031: Init the widgets only if we are using Qt.
         if g.app.gui.guiName().startswith('qt'):
             self.ui = LeoTagWidget(c)
@@ -145,13 +158,153 @@ class TagController:
             self.ui.update_all()
     #@+node:peckj.20140804103733.9263: *3* tag_c.initialize_taglist
     def initialize_taglist(self):
-        taglist = []
-        for p in self.c.all_unique_positions():
-            for tag in self.get_tags(p):
-                if tag not in taglist:
+        """Build the tag index from the tags of all nodes."""
+        index, taglist = {}, []
+        for v in self.c.all_unique_nodes():
+            # Don't use v.u: it would create v.unknownAttributes.
+            uA = getattr(v, 'unknownAttributes', None)
+            for tag in uA.get(self.TAG_LIST_KEY, []) if uA else []:
+                gnxs = index.get(tag)
+                if gnxs is None:
+                    gnxs = index[tag] = set()
                     taglist.append(tag)
+                gnxs.add(v.gnx)
+        self.tag_index = index
+        self.sorted_tags = sorted(index)
         self.taglist = taglist
 
+    #@+node:ekr.20211109082603.1: *3* tag_c.command2_hook
+    paste_commands = (
+        'paste-node',
+        'pasteOutlineRetainingClones',
+            # strange that this one isn't canonicalized
+        'paste-retaining-clones',
+    )
+
+    def command2_hook(self, tag, keywords):
+        """Rebuild the tag index after pasting nodes."""
+        if keywords.get('c') == self.c and keywords.get('label') in self.paste_commands:
+            self.initialize_taglist()
+    #@+node:ekr.20211109082603.2: *3* tag_c.index helpers
+    def index_tag(self, tag, gnx):
+        """Add gnx to the index entry for tag."""
+        gnxs = self.tag_index.get(tag)
+        if gnxs is None:
+            gnxs = self.tag_index[tag] = set()
+            bisect.insort(self.sorted_tags, tag)
+        gnxs.add(gnx)
+
+    def unindex_tag(self, tag, gnx):
+        """Remove gnx from the index entry for tag."""
+        gnxs = self.tag_index.get(tag)
+        if gnxs is not None:
+            gnxs.discard(gnx)
+            if not gnxs:
+                del self.tag_index[tag]
+                del self.sorted_tags[bisect.bisect_left(self.sorted_tags, tag)]
+    #@+node:ekr.20211109082603.3: *4* tag_c.matching_tags
+    regex_chars = '.^$*+?{}[]\\|()'
+
+    def matching_tags(self, tag):
+        """
+        Return the sorted list of all tags matching tag, a regex in which * is
+        a wildcard. As with re.match, the regex need only match a prefix of the
+        tag.
+
+        Only tags that start with the literal prefix of the regex can match,
+        so this method tests only the tags in that range of self.sorted_tags.
+        """
+        pattern = tag.replace('*', '.*')
+        regex = re.compile(pattern)
+        prefix = []
+        if '|' not in pattern:
+            for ch in pattern:
+                if ch in '*+?{':
+                    prefix = prefix[:-1]  # The quantifier applies to the previous char.
+                    break
+                if ch in self.regex_chars:
+                    break
+                prefix.append(ch)
+        prefix = ''.join(prefix)
+        tags = self.sorted_tags
+        result = []
+        i = bisect.bisect_left(tags, prefix)
+        while i < len(tags) and tags[i].startswith(prefix):
+            if regex.match(tags[i]):
+                result.append(tags[i])
+            i += 1
+        return result
+    #@+node:ekr.20211109082603.4: *4* tag_c.gnxs_to_positions
+    def gnxs_to_positions(self, gnxs):
+        """
+        Return a list of positions, in outline order, for all gnxs whose nodes
+        are in the outline.
+
+        The index keeps the gnxs of deleted nodes, so that undoing the deletion
+        needs no bookkeeping. Unlike c.gnx2position, this method computes the
+        position of each ancestor only once.
+        """
+        c = self.c
+        gnxDict = c.fileCommands.gnxDict
+        hiddenRoot = c.hiddenRootNode
+        # Keys are vnodes, values are (childIndex, stack), or None if not in the outline.
+        d = {hiddenRoot: (0, [])}
+        # Keys are vnodes, values are dicts giving the child index of each child.
+        indices = {}
+
+        def find(v):
+            if v in d:
+                return d[v]
+            d[v] = None  # Assume v is not in the outline.
+            for parent in v.parents:
+                data = find(parent)
+                if data is None:
+                    continue
+                parent_indices = indices.get(parent)
+                if parent_indices is None:
+                    parent_indices = indices[parent] = {}
+                    for i, child in enumerate(parent.children):
+                        parent_indices.setdefault(child, i)
+                i = parent_indices.get(v)
+                if i is not None:
+                    parent_i, parent_stack = data
+                    stack = [] if parent is hiddenRoot else parent_stack + [(parent, parent_i)]
+                    d[v] = i, stack
+                    break
+            return d[v]
+
+        result = []
+        for gnx in gnxs:
+            v = gnxDict.get(gnx)
+            data = v and find(v)
+            if data:
+                i, stack = data
+                result.append((v, i, stack))
+        result.sort(key=lambda z: [z2[1] for z2 in z[2]] + [z[1]])
+        return [leoNodes.Position(v, i, stack) for v, i, stack in result]
+    #@+node:ekr.20211109082603.7: *4* tag_c.live_gnxs
+    def live_gnxs(self, gnxs):
+        """Return the set of all gnxs in gnxs whose nodes are in the outline."""
+        c = self.c
+        gnxDict = c.fileCommands.gnxDict
+        d = {c.hiddenRootNode: True}  # Keys are vnodes, values are True if in the outline.
+
+        def is_live(v):
+            live = d.get(v)
+            if live is None:
+                live = d[v] = False  # Guard against cycles.
+                for parent in v.parents:
+                    if is_live(parent) and v in parent.children:
+                        live = d[v] = True
+                        break
+            return live
+
+        result = set()
+        for gnx in gnxs:
+            v = gnxDict.get(gnx)
+            if v and is_live(v):
+                result.add(gnx)
+        return result
     #@+node:peckj.20140804103733.9264: *3* tag_c.outline-level
     #@+node:peckj.20140804103733.9268: *4* tag_c.get_all_tags
     def get_all_tags(self):
@@ -160,14 +313,11 @@ class TagController:
     #@+node:ekr.20201030095446.1: *4* tag_c.show_all_tags
     def show_all_tags(self):
         """Show all tags, organized by node."""
-        c, tc = self.c, self
+        c = self.c
         d = {}
-        for p in c.all_unique_positions():
-            u = p.v.u
-            tags = set(u.get(tc.TAG_LIST_KEY, set([])))
-            for tag in tags:
-                aList = d.get(tag, [])
-                aList.append(p.h)
+        for tag in self.sorted_tags:
+            aList = [p.h for p in self.gnxs_to_positions(self.tag_index[tag])]
+            if aList:
                 d[tag] = aList
         # Print all tags.
         if d:
@@ -184,33 +334,65 @@ class TagController:
         """ ensures the outline's taglist is consistent with the state of the nodes in the outline """
         if tag not in self.taglist:
             self.taglist.append(tag)
-        nodelist = self.get_tagged_nodes(tag)
-        if not nodelist:
+        if not self.gnxs_to_positions(self.tag_index.get(tag, [])):
             self.taglist.remove(tag)
         if hasattr(self, 'ui'):
             self.ui.update_all()
     #@+node:peckj.20140804103733.9258: *4* tag_c.get_tagged_nodes
     def get_tagged_nodes(self, tag):
         """ return a list of *positions* of nodes containing the tag, with * as a wildcard """
-        nodelist = []
-        # replace * with .* for regex compatibility
-        tag = tag.replace('*', '.*')
-        regex = re.compile(tag)
-        for p in self.c.all_unique_positions():
-            for tag in self.get_tags(p):
-                if regex.match(tag):
-                    nodelist.append(p.copy())
-                    break
-        return nodelist
+        gnxs = set()
+        for tag2 in self.matching_tags(tag):
+            gnxs |= self.tag_index[tag2]
+        return self.gnxs_to_positions(gnxs)
     #@+node:vitalije.20170811150914.1: *4* tag_c.get_tagged_gnxes
     def get_tagged_gnxes(self, tag):
-        c = self.c
-        tag = tag.replace('*', '.*')
-        regex = re.compile(tag)
-        for p in c.all_unique_positions():
-            for t in self.get_tags(p):
-                if regex.match(t):
-                    yield p.v.gnx
+        for p in self.get_tagged_nodes(tag):
+            yield p.gnx
+    #@+node:ekr.20211109082603.5: *4* tag_c.query
+    search_re = r'(&|\||-|\^)'
+
+    def query(self, s):
+        """
+        Return the set of gnxs of all nodes matching the query s.
+
+        s contains tags, with * as a wildcard, separated by &, |, - and ^.
+        These operators are applied from left to right. A tag starting with
+        ! matches all the nodes *not* matching the rest of the tag.
+        """
+        parts = re.split(self.search_re, s)
+        result = self.query_tag(parts[0])
+        for i in range(1, len(parts) - 1, 2):
+            op, tag = parts[i], parts[i + 1].strip()
+            if tag.startswith('!') and op in '&-':
+                # a&!b is a-b, and a-!b is a&b.
+                op, tag = '-' if op == '&' else '&', tag[1:]
+            gnxs = self.query_tag(tag)
+            if op == '&':
+                result &= gnxs
+            elif op == '|':
+                result |= gnxs
+            elif op == '-':
+                result -= gnxs
+            elif op == '^':
+                result ^= gnxs
+        return result
+
+    def query_tag(self, tag):
+        tag = tag.strip()
+        if tag.startswith('!'):
+            # Compute the gnxs of all nodes in the outline.
+            gnxs, todo = set(), [self.c.hiddenRootNode]
+            while todo:
+                for v in todo.pop().children:
+                    if v.gnx not in gnxs:
+                        gnxs.add(v.gnx)
+                        todo.append(v)
+            return gnxs - self.query_tag(tag[1:])
+        gnxs = set()
+        for tag2 in self.matching_tags(tag):
+            gnxs |= self.tag_index[tag2]
+        return self.live_gnxs(gnxs)
     #@+node:peckj.20140804103733.9265: *3* tag_c.individual nodes
     #@+node:peckj.20140804103733.9259: *4* tag_c.get_tags
     def get_tags(self, p):
@@ -226,6 +408,7 @@ class TagController:
         tags = set(p.v.u.get(self.TAG_LIST_KEY, set([])))
         tags.add(tag)
         p.v.u[self.TAG_LIST_KEY] = tags
+        self.index_tag(tag, p.v.gnx)
         self.c.setChanged()
         self.update_taglist(tag)
     #@+node:peckj.20140804103733.9261: *4* tag_c.remove_tag
@@ -241,6 +424,7 @@ class TagController:
         else:
             del v.u[self.TAG_LIST_KEY]
             # prevent a few corner cases, and conserve disk space
+        self.unindex_tag(tag, v.gnx)
         self.c.setChanged()
         self.update_taglist(tag)
     #@-others
@@ -400,30 +584,7 @@ if QtWidgets:
                 if len(re.split(self.search_re, key)) > 1:
                     self.custom_searches.append(key)
 
-            query = re.split(self.search_re, key)
-            tags = []
-            operations = []
-            for i, s in enumerate(query):
-                if i % 2 == 0:
-                    tags.append(s.strip())
-                else:
-                    operations.append(s.strip())
-            tags.reverse()
-            operations.reverse()
-
-            resultset = set(self.tc.get_tagged_gnxes(tags.pop()))
-            while operations:
-                op = operations.pop()
-                nodes = set(self.tc.get_tagged_gnxes(tags.pop()))
-                if op == '&':
-                    resultset &= nodes
-                elif op == '|':
-                    resultset |= nodes
-                elif op == '-':
-                    resultset -= nodes
-                elif op == '^':
-                    resultset ^= nodes
-
+            resultset = self.tc.query(key)
             self.listWidget.clear()
             self.mapping = {}
             for gnx in resultset:
@@ -458,6 +619,9 @@ if QtWidgets:
             if len(re.split(self.search_re, tag)) > 1:
                 g.es('Cannot add tags containing any of these characters: &|^-', color='red')
                 return  # don't add unsearchable tags
+            if tag.startswith('!'):
+                g.es('Cannot add tags starting with !', color='red')
+                return
             self.tc.add_tag(p, tag)
         #@+node:peckj.20140811082039.6623: *3* tag_w:event hooks
         #@+node:peckj.20140804195456.13487: *4* tag_w.select2_hook
@@ -465,14 +629,8 @@ if QtWidgets:
             self.update_current_tags(self.c.p)
         #@+node:peckj.20140806101020.14006: *4* tag_w.command2_hook
         def command2_hook(self, tag, keywords):
-            paste_cmds = [
-                'paste-node',
-                'pasteOutlineRetainingClones',
-                    # strange that this one isn't canonicalized
-                'paste-retaining-clones',
-            ]
-            if keywords.get('label') in paste_cmds:
-                self.tc.initialize_taglist()
+            if keywords.get('label') in self.tc.paste_commands:
+                # tc.command2_hook has already rebuilt the tag index.
                 self.update_all()
         #@+node:tbnorth.20170313095036.1: *5* tag_w.sf.find_setting
         #@-others
@@ -11,6 +11,7 @@ from typing import Any, List
 from leo.core.leoQt import isQt6, QtCore, QtGui, QtWidgets
 from leo.core.leoQt import EndEditHint, Format, ItemFlag, KeyboardModifier
 from leo.core import leoGlobals as g
+from leo.core import leoFastRedraw
 from leo.core import leoFrame
 from leo.core import leoNodes
 from leo.core import leoPlugins  # Uses leoPlugins.TryNext.
@@ -36,6 +37,11 @@ class LeoQtTree(leoFrame.LeoTree):
         self.traceCallersFlag = False  # Enable traceCallers method.
         # Associating items with position and vnodes...
         self.items = []
+        self.expanded_items = []  # Items to expand after a full redraw.
+        self.fast_redrawer = leoFastRedraw.FastRedraw()
+        self.flat_entries = []  # The flattened outline drawn by the last redraw.
+        self.flat_items = []  # The items corresponding to self.flat_entries.
+        self.redraw_stats = {}  # Keys are command names, values are lists of counts.
         self.item2positionDict = {}
         self.item2vnodeDict = {}
         self.nodeIconsDict = {}  # keys are gnx, values are declutter generated icons
@@ -77,6 +83,9 @@ class LeoQtTree(leoFrame.LeoTree):
             pass
         n = c.config.getInt('icon-height') or 16
         w.setIconSize(QtCore.QSize(160, n))
+        # Uniform row heights allow Qt to lay out only the visible rows.
+        # Declutter rules may change fonts.
+        w.setUniformRowHeights(not self.use_declutter)
     #@+node:ekr.20110605121601.17866: *4* qtree.get_name
     def getName(self):
         """Return the name of this widget: must start with "canvas"."""
@@ -110,6 +119,8 @@ class LeoQtTree(leoFrame.LeoTree):
         self.stayInTree = c.config.getBool('stayInTreeAfterSelect')
         self.use_chapters = c.config.getBool('use-chapters')
         self.use_declutter = c.config.getBool('tree-declutter', default=False)
+        self.use_incremental_redraw = c.config.getBool(
+            'qt-tree-incremental-redraw', default=True)
     #@+node:ekr.20110605121601.17940: *4* qtree.wrapQLineEdit
     def wrapQLineEdit(self, w):
         """A wretched kludge for MacOs k.masterMenuHandler."""
@@ -296,7 +307,8 @@ class LeoQtTree(leoFrame.LeoTree):
         self.initData()
         try:
             self.busy = True
-            self.drawTopTree(p)
+            if not self.incremental_redraw():
+                self.drawTopTree(p)
         finally:
             self.busy = False
         self.setItemForCurrentPosition()
@@ -496,44 +508,36 @@ class LeoQtTree(leoFrame.LeoTree):
         return patterns
     #@+node:ekr.20110605121601.17874: *5* qtree.drawChildren
     def drawChildren(self, p, parent_item):
-        """Draw the children of p if they should be expanded."""
+        """
+        Draw the children of p if they should be expanded.
+
+        Every child of an expanded node gets an item, even if it is outside
+        the viewport. Hidden children get no items: createTreeItem shows the
+        expansion box of parent_item, and expanding it redraws the tree.
+        """
         if not p:
             g.trace('can not happen: no p')
             return
-        if p.hasChildren():
-            if p.isExpanded():
-                self.expandItem(parent_item)
-                child = p.firstChild()
-                while child:
-                    self.drawTree(child, parent_item)
-                    child.moveToNext()
-            else:
-                # Draw the hidden children.
-                child = p.firstChild()
-                while child:
-                    self.drawNode(child, parent_item)
-                    child.moveToNext()
-                self.contractItem(parent_item)
-        else:
-            self.contractItem(parent_item)
+        if p.hasChildren() and p.isExpanded():
+            # parent_item is not yet in the tree, so drawTopTree expands it.
+            self.expanded_items.append(parent_item)
+            child = p.firstChild()
+            while child:
+                self.drawTree(child, parent_item)
+                child.moveToNext()
     #@+node:ekr.20110605121601.17875: *5* qtree.drawNode
     def drawNode(self, p, parent_item):
         """Draw the node p."""
-        c = self.c
-        v = p.v
         # Allocate the QTreeWidgetItem.
         item = self.createTreeItem(p, parent_item)
-        #
         # Update the data structures.
-        itemHash = self.itemHash(item)
-        self.position2itemDict[p.key()] = item
-        self.item2positionDict[itemHash] = p.copy()  # was item
-        self.item2vnodeDict[itemHash] = v  # was item
-        d = self.vnode2itemsDict
-        aList = d.get(v, [])
-        if item not in aList:
-            aList.append(item)
-        d[v] = aList
+        self.registerItem(p, item)
+        return self.drawItem(p, item)
+    #@+node:ekr.20211109075834.1: *5* qtree.drawItem
+    def drawItem(self, p, item):
+        """Set the headline, tool tip and icon of p's item."""
+        c = self.c
+        v = p.v
         # Set the headline and maybe the icon.
         self.setItemText(item, p.h)
         # #1310: Add a tool tip.
@@ -550,42 +554,84 @@ class LeoQtTree(leoFrame.LeoTree):
         if icon:
             item.setIcon(0, icon)
         return item
+    #@+node:ekr.20211109080011.1: *5* qtree.registerItem
+    def registerItem(self, p, item):
+        """
+        Associate item with p in the item dicts.
+
+        Redraws call this method for all visible positions, in outline order.
+        """
+        v = p.v
+        itemHash = self.itemHash(item)
+        self.position2itemDict[p.key()] = item
+        self.item2positionDict[itemHash] = p.copy()  # was item
+        self.item2vnodeDict[itemHash] = v  # was item
+        d = self.vnode2itemsDict
+        aList = d.get(v, [])
+        if item not in aList:
+            aList.append(item)
+        d[v] = aList
+        self.flat_items.append(item)
+        self.flat_entries.append(self.flat_entry(p))
     #@+node:ekr.20110605121601.17876: *5* qtree.drawTopTree
     def drawTopTree(self, p):
-        """Draw the tree rooted at p."""
+        """
+        Draw the tree rooted at p.
+
+        This creates one item for each visible position, that is, each
+        position whose ancestors are all expanded, so the cost is
+        proportional to the number of those positions, not to the viewport.
+        Only Qt's layout and painting are limited to the rows in the
+        viewport: the items are built outside the widget, inserted at once,
+        and the tree uses uniform row heights.
+        """
         trace = 'drawing' in g.app.debug and not g.unitTesting
         if trace:
             t1 = time.process_time()
-        c = self.c
+        w = self.treeWidget
         self.clear()
+        destroyed = len(self.flat_items)
         # Draw all top-level nodes and their visible descendants.
+        # The new items are not in the tree, so Qt does no work for each item.
+        self.expanded_items = []
+        self.flat_entries, self.flat_items = [], []
+        items = [self.drawTree(z) for z in self.top_positions()]
+        self.count_redraw(full=True, created=len(self.flat_items), destroyed=destroyed)
+        # Insert all items at once, then expand them.
+        items = [z for z in items if z]
+        w.setUpdatesEnabled(False)
+        try:
+            w.addTopLevelItems(items)
+            for item in self.expanded_items:
+                item.setExpanded(True)
+        finally:
+            self.expanded_items = []
+            w.setUpdatesEnabled(True)
+        if trace:
+            t2 = time.process_time()
+            g.trace(f"{t2 - t1:5.2f} sec.", g.callers(5))
+    #@+node:ekr.20211109080148.1: *5* qtree.top_positions
+    def top_positions(self):
+        """Return the list of positions drawn as top-level items."""
+        c = self.c
         if c.hoistStack:
             bunch = c.hoistStack[-1]
             p = bunch.p
             h = p.h
             if len(c.hoistStack) == 1 and h.startswith('@chapter') and p.hasChildren():
-                p = p.firstChild()
-                while p:
-                    self.drawTree(p)
-                    p.moveToNext()
-            else:
-                self.drawTree(p)
-        else:
-            p = c.rootPosition()
-            while p:
-                self.drawTree(p)
-                p.moveToNext()
-        if trace:
-            t2 = time.process_time()
-            g.trace(f"{t2 - t1:5.2f} sec.", g.callers(5))
+                return list(p.children())
+            return [p.copy()]
+        return list(c.rootPosition().self_and_siblings())
     #@+node:ekr.20110605121601.17877: *5* qtree.drawTree
     def drawTree(self, p, parent_item=None):
+        """Draw p and its visible descendants. Return p's item."""
         if g.app.gui.isNullGui:
-            return
+            return None
         # Draw the (visible) parent node.
         item = self.drawNode(p, parent_item)
         # Draw all the visible children.
         self.drawChildren(p, parent_item=item)
+        return item
     #@+node:ekr.20110605121601.17878: *5* qtree.initData
     def initData(self):
         self.item2positionDict = {}
@@ -593,6 +639,171 @@ class LeoQtTree(leoFrame.LeoTree):
         self.position2itemDict = {}
         self.vnode2itemsDict = {}
         self.editWidgetsDict = {}
+    #@+node:ekr.20211109080325.1: *4* qtree.incremental_redraw & helpers
+    def incremental_redraw(self):
+        """
+        Update the existing items using the differences between the
+        flattened outline drawn by the previous redraw and the present
+        flattened outline.
+
+        Items are created only for newly visible or changed rows.
+        Return False if the caller must do a full redraw.
+
+        Plugins may register g.visit_tree_item visitors that style items
+        using any data, so such visitors force full redraws.
+        """
+        trace = 'drawing' in g.app.debug and not g.unitTesting
+        w = self.treeWidget
+        visitors = getattr(g, 'visit_tree_item', None)
+        if (
+            not self.use_incremental_redraw or self.use_declutter
+            or not self.flat_items or not w.topLevelItemCount()
+            or visitors and list(visitors)
+        ):
+            return False
+        t1 = time.process_time()
+        old_entries, old_items = self.flat_entries, self.flat_items
+        positions = []
+        for p in self.top_positions():
+            positions.extend(self.yield_visible_tree(p))
+        new_entries = [self.flat_entry(p) for p in positions]
+        key = self.fast_redrawer.entry_key
+        # Reuse the items of equal rows, and of changed rows with the same level and gnx.
+        new_items: List[Any] = [None] * len(positions)
+        changed, removed = [], []
+        for tag, i1, i2, j1, j2 in self.fast_redrawer.get_opcodes(old_entries, new_entries):
+            if tag == 'equal':
+                new_items[j1:j2] = old_items[i1:i2]
+            elif tag == 'replace' and i2 - i1 == j2 - j1 and all(
+                key(old_entries[i]) == key(new_entries[j1 + i - i1]) for i in range(i1, i2)
+            ):
+                new_items[j1:j2] = old_items[i1:i2]
+                changed.extend(range(j1, j2))
+            else:
+                removed.extend(old_items[i1:i2])
+        try:
+            self.flat_entries, self.flat_items = [], []
+            self.remove_items(removed)
+            created = 0
+            for j, p in enumerate(positions):
+                item = new_items[j]
+                if item is None:
+                    new_items[j] = self.drawNode(p, None)
+                    created += 1
+                else:
+                    self.registerItem(p, item)
+            for j in changed:
+                self.redrawItem(positions[j], new_items[j])
+            moved = self.place_items(new_items, positions)
+        except Exception:
+            # Recover with a full redraw.
+            g.es_exception()
+            self.initData()
+            return False
+        self.count_redraw(full=False, created=created, destroyed=len(removed))
+        if trace:
+            g.trace(
+                f"{time.process_time() - t1:5.3f} sec. rows: {len(positions)} "
+                f"created: {created} destroyed: {len(removed)} "
+                f"changed: {len(changed)} moved: {moved}")
+        return True
+    #@+node:ekr.20211109080502.1: *5* qtree.count_redraw
+    def count_redraw(self, full, created=0, destroyed=0):
+        """
+        Update self.redraw_stats for the present command.
+
+        Values are lists: [incremental redraws, full redraws, items created, items destroyed].
+        """
+        key = getattr(self.c, 'command_name', None) or '<no command>'
+        stats = self.redraw_stats.setdefault(key, [0, 0, 0, 0])
+        stats[1 if full else 0] += 1
+        stats[2] += created
+        stats[3] += destroyed
+    #@+node:ekr.20211109080639.1: *5* qtree.flat_entry
+    def flat_entry(self, p):
+        """
+        Return the entry for p in a flattened outline: "level:gnx:..."
+
+        The entry contains everything that changes how the item looks.
+        """
+        v = p.v
+        icons = v.unknownAttributes.get('icons') if hasattr(v, 'unknownAttributes') else None
+        return (
+            f"{p.level()}:{p.gnx}:{v.computeIcon()}:{int(bool(v.children))}:"
+            f"{[z.get('file') for z in icons] if icons else ''}:{p.h}")
+    #@+node:ekr.20211109080816.1: *5* qtree.place_items
+    def place_items(self, items, positions):
+        """
+        Put each item at the proper place in the tree, and expand or
+        contract it as needed. Return the number of items moved.
+        """
+        w = self.treeWidget
+        moved = 0
+        base = positions[0].level() if positions else 0
+        levels = [p.level() - base for p in positions]
+        parents: List[Any] = []  # parents[n] is the last item at level n.
+        counts = {}  # Keys are id(parent_item), values are the next child index.
+        for j, item in enumerate(items):
+            level = levels[j]
+            parent = parents[level - 1] if level > 0 else None
+            del parents[level:]
+            parents.append(item)
+            index = counts.get(id(parent), 0)
+            counts[id(parent)] = index + 1
+            if parent is None:
+                ok = w.topLevelItem(index) is item
+            else:
+                ok = item.parent() is parent and parent.child(index) is item
+            if not ok:
+                moved += 1
+                self.detach_item(item)
+                if parent is None:
+                    w.insertTopLevelItem(index, item)
+                else:
+                    parent.insertChild(index, item)
+        # Items must be in the tree before being expanded.
+        for j, item in enumerate(items):
+            expanded = j + 1 < len(items) and levels[j + 1] > levels[j]
+            if item.isExpanded() != expanded:
+                item.setExpanded(expanded)
+        return moved
+    #@+node:ekr.20211109080953.1: *5* qtree.redrawItem
+    def redrawItem(self, p, item):
+        """Redraw an existing item for p."""
+        self.setChildIndicator(p, item)
+        try:
+            g.visit_tree_item(self.c, p, item)
+        except leoPlugins.TryNext:
+            pass
+        self.drawItem(p, item)
+    #@+node:ekr.20211109081130.1: *5* qtree.remove_items & detach_item
+    def remove_items(self, items):
+        """Remove the given items from the tree."""
+        removed = set(id(z) for z in items)
+        for item in items:
+            parent = item.parent()
+            if parent is None or id(parent) not in removed:
+                self.detach_item(item)
+
+    def detach_item(self, item):
+        """Remove item from its parent item or from the tree."""
+        parent = item.parent()
+        if parent is not None:
+            parent.removeChild(item)
+        else:
+            w = self.treeWidget
+            i = w.indexOfTopLevelItem(item)
+            if i > -1:
+                w.takeTopLevelItem(i)
+    #@+node:ekr.20211109081307.1: *5* qtree.yield_visible_tree
+    def yield_visible_tree(self, p):
+        """Yield copies of p and all its visible descendants, in outline order."""
+        yield p.copy()
+        if p.hasChildren() and p.isExpanded():
+            child = p.firstChild()
+            while child:
+                yield from self.yield_visible_tree(child)
+                child.moveToNext()
     #@+node:ekr.20110605121601.17880: *4* qtree.redraw_after_contract
     def redraw_after_contract(self, p):
 
@@ -1089,21 +1300,40 @@ class LeoQtTree(leoFrame.LeoTree):
         return e, wrapper
     #@+node:ekr.20110605121601.18421: *4* qtree.createTreeItem
     def createTreeItem(self, p, parent_item):
+        """
+        Create an item for p.
 
-        w = self.treeWidget
-        itemOrTree = parent_item or w
-        item = QtWidgets.QTreeWidgetItem(itemOrTree)
+        The caller must add top-level items (parent_item is None) to the tree.
+        """
+        if parent_item:
+            item = QtWidgets.QTreeWidgetItem(parent_item)
+        else:
+            item = QtWidgets.QTreeWidgetItem()
         if isQt6:
             item.setFlags(item.flags() | ItemFlag.ItemIsEditable)
-            ChildIndicatorPolicy = QtWidgets.QTreeWidgetItem.ChildIndicatorPolicy
-            item.setChildIndicatorPolicy(ChildIndicatorPolicy.DontShowIndicatorWhenChildless)  # pylint: disable=no-member
         else:
-            item.setFlags(item.flags() | QtCore.Qt.ItemIsEditable | item.DontShowIndicatorWhenChildless)
+            item.setFlags(item.flags() | QtCore.Qt.ItemIsEditable)
+        self.setChildIndicator(p, item)
         try:
             g.visit_tree_item(self.c, p, item)
         except leoPlugins.TryNext:
             pass
         return item
+    #@+node:ekr.20211109081444.1: *4* qtree.setChildIndicator
+    def setChildIndicator(self, p, item):
+        """
+        Show the expansion box of p's item if p has children,
+        even if the item has no child items.
+        """
+        if isQt6:
+            ChildIndicatorPolicy = QtWidgets.QTreeWidgetItem.ChildIndicatorPolicy
+            item.setChildIndicatorPolicy(
+                ChildIndicatorPolicy.ShowIndicator if p.hasChildren()  # pylint: disable=no-member
+                else ChildIndicatorPolicy.DontShowIndicatorWhenChildless)  # pylint: disable=no-member
+        else:
+            item.setChildIndicatorPolicy(
+                item.ShowIndicator if p.hasChildren()
+                else item.DontShowIndicatorWhenChildless)
     #@+node:ekr.20110605121601.18423: *4* qtree.getCurrentItem
     def getCurrentItem(self):
         w = self.treeWidget
@@ -3,7 +3,9 @@
 #@+node:ekr.20210901170451.1: * @file ../unittests/core/test_leoApp.py
 #@@first
 """Tests of leoApp.py"""
+import json
 import os
+import tempfile
 import zipfile
 from leo.core import leoGlobals as g
 from leo.core.leoTest2 import LeoUnitTest
@@ -83,6 +85,119 @@ class TestApp(LeoUnitTest):
         finally:
             os.remove(path)
         self.assertEqual(s, s2)
+    #@+node:ekr.20211109073910.1: *3* TestApp.test_lm_readGlobalSettingsSnapshot
+    def test_lm_readGlobalSettingsSnapshot(self):
+        from leo.core import leoCache
+        lm = g.app.loadManager
+        old_cacher, old_options = g.app.settings_cacher, lm.options
+        settings_d, bindings_d = lm.globalSettingsDict, lm.globalBindingsDict
+        with tempfile.TemporaryDirectory() as tmp:
+            cacher = leoCache.SettingsCacher(path=g.os_path_join(tmp, 'settings'))
+            g.app.settings_cacher = cacher
+            try:
+                # A round trip.
+                lm.writeGlobalSettingsSnapshot([])
+                lm.globalSettingsDict = lm.globalBindingsDict = None
+                assert lm.readGlobalSettingsSnapshot()
+                self.assertEqual(sorted(lm.globalSettingsDict.keys()), sorted(settings_d.keys()))
+                self.assertEqual(sorted(lm.globalBindingsDict.keys()), sorted(bindings_d.keys()))
+                # A change to the environment invalidates the snapshot.
+                lm.options = {'theme_path': 'xyzzy'}
+                assert not lm.readGlobalSettingsSnapshot()
+                # A change to any settings file invalidates the snapshot.
+                lm.options = old_options
+                fn = g.os_path_join(tmp, 'test.leo')
+                with open(fn, 'w') as f:
+                    f.write('a')
+                env = lm.computeSettingsSnapshotEnv()
+                cacher.put(env, [fn], 'snapshot')
+                self.assertEqual(cacher.get(env), 'snapshot')
+                with open(fn, 'w') as f:
+                    f.write('b')
+                self.assertEqual(cacher.get(env), None)
+                # Searches for theme-name span chunk boundaries.
+                with open(fn, 'w') as f:
+                    f.write('x' * 5 + 'theme-name')
+                for n in (1, 3, 6, 100):
+                    assert lm.fileContains(fn, b'theme-name', chunk_size=n), n
+                assert not lm.fileContains(fn, b'theme-names', chunk_size=3)
+            finally:
+                cacher.commit_and_close()
+                g.app.settings_cacher, lm.options = old_cacher, old_options
+                lm.globalSettingsDict, lm.globalBindingsDict = settings_d, bindings_d
+    #@+node:ekr.20211109075029.1: *3* TestApp.test_lm_scanPluginModules
+    def test_lm_scanPluginModules(self):
+        from leo.core.leoApp import LazyPluginClass
+        from leo.plugins.importers.python import Py_Importer
+        lm = g.app.loadManager
+        old_home = g.app.homeLeoDir
+        with tempfile.TemporaryDirectory() as tmp:
+            g.app.homeLeoDir = tmp
+            try:
+                # Create the manifest.
+                lm.readPluginsManifest()
+                d = dict(lm.scanPluginModules('importers'))
+                self.assertEqual(d['python.py']['class'], Py_Importer)
+                assert lm.plugins_manifest_changed
+                lm.writePluginsManifest()
+                assert g.os_path_exists(lm.computePluginsManifestPath())
+                # Use the manifest.
+                lm.readPluginsManifest()
+                d = dict(lm.scanPluginModules('importers'))
+                assert not lm.plugins_manifest_changed
+                aClass = d['python.py']['class']
+                self.assertIsInstance(aClass, LazyPluginClass)
+                self.assertEqual(aClass.__name__, 'Py_Importer')
+                self.assertTrue('.py' in d['python.py']['extensions'])
+                self.assertEqual(aClass, LazyPluginClass('leo.plugins.importers.python', 'Py_Importer'))
+                self.assertIs(aClass.resolve(), Py_Importer)
+                # Base classes have no importer_dict.
+                self.assertEqual(d['linescanner.py'], {})
+            finally:
+                g.app.homeLeoDir = old_home
+                lm.plugins_manifest = {}
+    #@+node:ekr.20211109082740.12: *3* TestApp.test_perf_stats
+    def test_perf_stats(self):
+        from leo.core.leoApp import LatencyHistogram
+        c, stats = self.c, g.app.perfStats
+        # Percentiles are accurate to within 12.5%.
+        h = LatencyHistogram()
+        for i in range(1, 1001):
+            h.add(i / 1000)
+        self.assertEqual(h.count, 1000)
+        self.assertEqual(h.max, 1.0)
+        for q in (50, 95, 100):
+            got = h.percentile(q)
+            self.assertTrue(q / 100 <= got <= 1.125 * q / 100, msg=(q, got))
+        # Record commands and hook handlers.
+        from leo.core.leoPlugins import LeoPluginsController
+
+        def handler(tag, keywords):
+            pass
+
+        pc = LeoPluginsController()
+        pc.registerHandler('command2', handler)
+        try:
+            stats.enabled = True
+            for i in range(2):
+                c.executeMinibufferCommand('goto-first-node')
+                pc.doHandlersForTag('command2', {'c': c})
+        finally:
+            stats.enabled = False
+        commands, hooks = stats.tables['commands'], stats.tables['hooks']
+        self.assertEqual(commands['goto-first-node'].count, 2)
+        names = [z for z in hooks if z.endswith('handler:command2')]
+        self.assertEqual(len(names), 1, msg=list(hooks))
+        self.assertEqual(hooks[names[0]].count, 2)
+        # Disabled stats record nothing.
+        c.executeMinibufferCommand('goto-first-node')
+        self.assertEqual(commands['goto-first-node'].count, 2)
+        # Export and clear.
+        d = json.loads(json.dumps(stats.to_json()))
+        self.assertEqual(d['commands']['goto-first-node']['count'], 2)
+        self.assertTrue('goto-first-node' in stats.report())
+        stats.clear()
+        self.assertEqual(stats.tables['commands'], {})
     #@+node:ekr.20210909194336.4: *3* TestApp.test_rfm_writeRecentFilesFileHelper
     def test_rfm_writeRecentFilesFileHelper(self):
         fn = 'ффф.leo'
@@ -4,11 +4,13 @@
 #@@first
 """Tests of leoAtFile.py"""
 import os
+import shutil
 import tempfile
 import textwrap
 from leo.core import leoGlobals as g
 from leo.core import leoAtFile
 from leo.core import leoBridge
+from leo.core import leoCache
 from leo.core.leoTest2 import LeoUnitTest
 
 #@+others
@@ -161,6 +163,25 @@ class TestAtFile(LeoUnitTest):
         for expected, s in table:
             result = at.directiveKind4(s, 0)
             self.assertEqual(expected, result, msg=repr(s))
+    #@+node:ekr.20211109052326.1: *3* TestAtFile.test_external_files_cacher
+    def test_external_files_cacher(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            cacher = leoCache.ExternalFilesCacher(path=directory)
+            path = os.path.join(directory, 'test.py')
+            with open(path, 'w') as f:
+                f.write('a = 1\n')
+            nodes = [('ekr.1', '@file test.py', 1)]
+            bodies = {'ekr.1': 'a = 1\n'}
+            cacher.put(path, 'a = 1\n', nodes, bodies)
+            self.assertEqual(cacher.get(path, 'a = 1\n'), (nodes, bodies))
+            # The contents hash must match.
+            self.assertEqual(cacher.get(path, 'a = 2\n'), None)
+            # The size must match.
+            with open(path, 'w') as f:
+                f.write('a = 22\n')
+            self.assertEqual(cacher.get(path, 'a = 1\n'), None)
+            cacher.commit_and_close()
     #@+node:ekr.20211106034202.1: *3* TsetAtFile.test_findSectionName
     def test_findSectionName(self):
         # Test code per #2303.
@@ -399,6 +420,126 @@ class TestAtFile(LeoUnitTest):
         at.putRefLine(s, 0, n1, n2, name, p)
         
        
+    #@+node:ekr.20211109063921.1: *3* TestAtFile.test_read_lazy_bodies
+    def test_read_lazy_bodies(self):
+
+        c = self.c
+        at = c.atFileCommands
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'test.py')
+            root = c.rootPosition().insertAfter()
+            root.h = f"@file {path}"
+            root.b = "# root\n@others\n"
+            for i in range(2):
+                child = root.insertAsLastChild()
+                child.h = f"child {i}"
+                child.b = f"@language python\na = {i}\n"
+            contents = at.atFileToString(root, sentinels=True)
+            with open(path, 'w') as f:
+                f.write(contents)
+            root.v._deleteAllChildren()
+            at.lazyBodies = True
+            try:
+                at.read(root)
+            finally:
+                at.lazyBodies = False
+            child0, child1 = root.v.children
+            self.assertEqual(root.b, "# root\n@others\n")
+            self.assertTrue(isinstance(child0._bodyString, leoAtFile.LazyBodies))
+            self.assertTrue(child0._bodyString is child1._bodyString)
+            self.assertEqual(child1.h, 'child 1')
+            # Directive checks don't load the bodies.
+            p = root.firstChild()
+            self.assertTrue(p.v.hasBody())
+            self.assertFalse(p.isAtOthersNode() or p.isAtAllNode() or p.isAtIgnoreNode())
+            self.assertEqual(g.get_directives_dict(p).get('language'), 'python')
+            self.assertEqual(g.findLanguageDirectives(c, p), 'python')
+            self.assertTrue(isinstance(child0._bodyString, leoAtFile.LazyBodies))
+            # Copying a node whose body has not been loaded copies the body.
+            # Loading one body sets all bodies.
+            copy = root.copyWithNewVnodes()
+            self.assertEqual(
+                [z.b for z in copy.children()],
+                ["@language python\na = 0\n", "@language python\na = 1\n"])
+            self.assertEqual(child0._bodyString, "@language python\na = 0\n")
+            self.assertEqual(child1.b, "@language python\na = 1\n")
+            self.assertEqual(at.atFileToString(root, sentinels=True), contents)
+    #@+node:ekr.20211109083231.21: *3* TestAtFile.test_read_lazy_bodies_new_root_gnx
+    def test_read_lazy_bodies_new_root_gnx(self):
+
+        c = self.c
+        at = c.atFileCommands
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'test.py')
+            root = c.rootPosition().insertAfter()
+            root.h = f"@file {path}"
+            root.b = "# root\n@others\n"
+            child = root.insertAsLastChild()
+            child.h = 'child'
+            child.b = "a = 1\n"
+            contents = at.atFileToString(root, sentinels=True)
+            # Fix #1064: The first node represents the root, regardless of its gnx.
+            contents = contents.replace(f"@+node:{root.gnx}:", "@+node:xyzzy.1:", 1)
+            with open(path, 'w') as f:
+                f.write(contents)
+            root.v._deleteAllChildren()
+            root.b = ''
+            # Unit tests would assert that the gnxs match.
+            at.lazyBodies, g.unitTesting = True, False
+            try:
+                at.read(root)
+            finally:
+                at.lazyBodies, g.unitTesting = False, True
+            self.assertEqual(root.b, "# root\n@others\n")
+            self.assertEqual(root.firstChild().b, "a = 1\n")
+    #@+node:ekr.20211109053622.1: *3* TestAtFile.test_readAll_with_workers
+    def test_readAll_with_workers(self):
+
+        c = self.c
+        at = c.atFileCommands
+        old_cacher = g.app.external_files_cacher
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Create and write two @file trees.
+            # The second file uses a non-default encoding.
+            roots = []
+            encodings = ('utf-8', 'latin-1')
+            for i, encoding in enumerate(encodings):
+                root = c.rootPosition().insertAfter()
+                path = os.path.join(temp_dir, f"test{i}.py")
+                root.h = f"@file {path}"
+                root.b = f"@encoding {encoding}\n# file {i}\n@others\n"
+                child = root.insertAsLastChild()
+                child.h = f"child {i}"
+                child.b = f"a = 'caf\u00e9 {i}'\n"
+                contents = at.atFileToString(root, sentinels=True)
+                with open(path, 'wb') as f:
+                    f.write(contents.encode(encoding))
+                root.v._deleteAllChildren()
+                roots.append(root)
+            # Count the writes to the external files cache.
+            puts = []
+            cacher = leoCache.ExternalFilesCacher(path=temp_dir)
+            put = cacher.put
+            cacher.put = lambda *args: puts.append(args[0]) or put(*args)
+            g.app.external_files_cacher = cacher
+            try:
+                for n in range(2):
+                    # Read both trees in worker threads.
+                    at.readWorkers = 2
+                    at.readAll(c.rootPosition())
+                    self.assertEqual(at.prefetchedFiles, {})
+                    for i, root in enumerate(roots):
+                        self.assertEqual(root.b, f"@encoding {encodings[i]}\n# file {i}\n@others\n")
+                        self.assertEqual(root.numberOfChildren(), 1)
+                        child = root.firstChild()
+                        self.assertEqual(child.h, f"child {i}")
+                        self.assertEqual(child.b, f"a = 'caf\u00e9 {i}'\n")
+                        self.assertEqual(child.v.parents, [root.v])
+                    # Only cache misses update the cache.
+                    self.assertEqual(len(puts), 2)
+            finally:
+                g.app.external_files_cacher = old_cacher
+                cacher.commit_and_close()
     #@+node:ekr.20210905052021.24: *3* TestAtFile.test_remove
     def test_remove(self):
         
@@ -437,6 +578,31 @@ class TestAtFile(LeoUnitTest):
         finally:
             f.close()
             os.unlink(f.name)
+    #@+node:ekr.20211109083231.20: *3* TestAtFile.test_replaceFile_hard_link
+    def test_replaceFile_hard_link(self):
+
+        at, c = self.at, self.c
+        at.initCommonIvars()
+        at.scanAllDirectives(c.p)
+        encoding = 'utf-8'
+        directory = tempfile.mkdtemp()
+        fn = os.path.join(directory, 'a.txt')
+        link = os.path.join(directory, 'b.txt')
+        try:
+            with open(fn, 'w', encoding=encoding) as f:
+                f.write('old contents')
+            try:
+                os.link(fn, link)
+            except (AttributeError, OSError):  # pragma: no cover
+                self.skipTest('no hard links')
+            val = at.replaceFile('new contents', encoding, fn, at.root)
+            assert val, val
+            # Both names still refer to the same, changed, file.
+            with open(link, encoding=encoding) as f:
+                self.assertEqual(f.read(), 'new contents')
+            self.assertTrue(os.path.samefile(fn, link))
+        finally:
+            shutil.rmtree(directory)
     #@+node:ekr.20210905052021.26: *3* TestAtFile.test_replaceFile_no_target_file
     def test_replaceFile_no_target_file(self):
         
@@ -521,6 +687,70 @@ class TestAtFile(LeoUnitTest):
         # Just test the last line.
         at.sentinels = False
         at.validInAtOthers(p)
+    #@+node:ekr.20211109061647.1: *3* TestAtFile.test_writeAll_unchanged_subtree
+    def test_writeAll_unchanged_subtree(self):
+
+        c = self.c
+        at = c.atFileCommands
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'test.py')
+            root = c.rootPosition().insertAfter()
+            root.h = f"@file {path}"
+            root.b = "@others\n"
+            child = root.insertAsLastChild()
+            child.h = 'child'
+            child.b = "a = 1\n"
+            root.setDirty()
+            at.writeAll()
+            self.assertTrue(os.path.exists(path))
+            self.assertTrue(g.os_path_realpath(path) in at.writeHashes)
+            # Writing the unchanged tree does not regenerate the file.
+            old_putFile = at.putFile
+            try:
+                at.putFile = None  # Would raise an exception.
+                root.setDirty()
+                at.writeAll()
+                self.assertFalse(root.isDirty())
+            finally:
+                at.putFile = old_putFile
+            # Changing the tree changes the file.
+            child.b = "a = 2\n"
+            root.setDirty()
+            at.writeAll()
+            with open(path) as f:
+                self.assertTrue('a = 2\n' in f.read())
+    #@+node:ekr.20211109061824.1: *3* TestAtFile.test_writeAll_with_workers
+    def test_writeAll_with_workers(self):
+
+        c = self.c
+        at = c.atFileCommands
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths, roots = [], []
+            for i in range(3):
+                path = os.path.join(temp_dir, f"test{i}.py")
+                root = c.rootPosition().insertAfter()
+                root.h = f"@file {path}"
+                root.b = f"a = {i}\n"
+                root.setDirty()
+                paths.append(path)
+                roots.append(root)
+            # Make one of the files unchanged, and another changed.
+            with open(paths[1], 'w') as f:
+                f.write(at.atFileToString(roots[1], sentinels=True))
+            with open(paths[2], 'w') as f:
+                f.write('old contents\n')
+            for root in roots[1:]:
+                # Pretend Leo has read the existing files.
+                at.rememberReadPath(g.fullPath(c, root), root)
+            at.writeWorkers = 2
+            at.writeAll()
+            self.assertEqual(at.pendingWrites, None)
+            self.assertEqual(at.unchangedFiles, 1)
+            for i, path in enumerate(paths):
+                with open(path) as f:
+                    self.assertTrue(f"a = {i}\n" in f.read())
+            # No temp files remain.
+            self.assertEqual(sorted(os.listdir(temp_dir)), ['test0.py', 'test1.py', 'test2.py'])
     #@-others
 #@+node:ekr.20211031085414.1: ** class TestFastAtRead(LeoUnitTest)
 class TestFastAtRead(LeoUnitTest):
@@ -1006,6 +1236,51 @@ class TestFastAtRead(LeoUnitTest):
         x.read_into_root(contents, path='test', root=root)
         s = c.atFileCommands.atFileToString(root, sentinels=True)
         self.assertEqual(contents, s)
+    #@+node:ekr.20211109052503.1: *3* TestFast.test_read_from_cache
+    def test_read_from_cache(self):
+
+        c, x = self.c, self.x
+        h = '@file /test/test_read_from_cache.py'
+        root = c.rootPosition()
+        root.h = h # To match contents.
+        #@+<< define contents >>
+        #@+node:ekr.20211109052640.1: *4* << define contents >> (test_read_from_cache)
+        # Be careful: no line should look like a Leo sentinel!
+        contents = textwrap.dedent(f'''\
+        #AT+leo-ver=5-thin
+        #AT+node:{root.gnx}: * {h}
+        #AT@language python
+
+        a = 1
+
+        #AT+others
+        #AT+node:ekr.20211109052640.2: ** cloned node
+        a = 2
+        #AT+node:ekr.20211109052640.3: *3* child
+        a = 3
+        #AT+node:ekr.20211109052640.2: ** cloned node
+        a = 2
+        #AT+node:ekr.20211109052640.3: *3* child
+        a = 3
+        #AT-others
+        #AT-leo
+        ''').replace('AT', '@').replace('LB', '<<')
+        #@-<< define contents >>
+        x.read_into_root(contents, path='test', root=root)
+        self.assertTrue(x.cache_data)
+        nodes, bodies = x.cache_data
+        self.assertEqual(len(nodes), 5)
+        # Recreate the tree from the cached data.
+        y = leoAtFile.FastAtRead(c, gnx2vnode=x.gnx2vnode)
+        y.read_from_cache(nodes, bodies, path='test', root=root)
+        s = c.atFileCommands.atFileToString(root, sentinels=True)
+        self.assertEqual(contents, s)
+        child1 = root.firstChild()
+        child2 = child1.next()
+        self.assertTrue(child1.isCloned())
+        self.assertEqual(child1.v, child2.v)
+        self.assertEqual(child1.v.parents, [root.v, root.v])
+        self.assertEqual(child1.firstChild().v.parents, [child1.v])
     #@+node:ekr.20211101180354.1: *3* TestFast.test_verbatim
     def test_verbatim(self):
 
@@ -97,6 +97,110 @@ class TestColorizer(LeoUnitTest):
             grand.b = grand_s
             got = x.useSyntaxColoring(grand)
             self.assertEqual(got, expected, msg=f"i: {i} {language}")
+    #@+node:ekr.20211109082112.3: *3* TestColorizer.test_color_cache
+    def test_color_cache(self):
+        c = self.c
+        if not leoColorizer.QtWidgets:
+            self.skipTest('no qt')
+        c.target_language = 'python'
+        wrapper = c.frame.body.wrapper
+        widget = c.frame.body.widget
+        x = leoColorizer.JEditColorizer(c, widget, wrapper)
+        wrapper.configDict, wrapper.configUnderlineDict = {}, {}
+        x.cache_size, x.precolor_lines = 10, 4
+        p1 = c.rootPosition()
+        p1.b = textwrap.dedent('''\
+            def spam():
+                """A docstring
+                spanning lines."""
+                return 'eggs'
+            ''')
+        p2 = p1.insertAfter()
+        p2.b = p1.b.replace('spam', 'eggs')
+
+        def color(p):
+            """Color p as QSyntaxHighlighter would. Return the line states."""
+            c.selectPosition(p)
+            x.replay_count = 0
+            h = x.highlighter = leoColorizer.PrecolorHighlighter()
+            states = []
+            for s in g.splitLines(p.b):
+                h.next_block()
+                x.recolor(s.rstrip('\n'))
+                states.append(h.state)
+            return states
+
+        states = color(p1)
+        self.assertEqual(x.replay_count, 0)
+        color(p2)
+        # Revisiting p1 replays all lines.
+        self.assertEqual(color(p1), states)
+        self.assertEqual(x.replay_count, 4)
+        # Changing p1 invalidates only the changed line.
+        p1.b = p1.b.replace('eggs', 'spam')
+        color(p2)
+        self.assertEqual(color(p1), states)
+        self.assertEqual(x.replay_count, 3)
+        # Precolor p2.
+        x.clear_color_cache()
+        color(p1)
+        timer = g.NullObject()
+        x.precolor_handler(timer)
+        self.assertFalse(x.precolor_job)
+        self.assertTrue(p2.v.gnx in x.color_cache)
+        color(p2)
+        self.assertEqual(x.replay_count, 4)
+        # Precoloring stops after one full scan.
+        x.precolor_handler(timer)
+        self.assertTrue(x.precolor_positions is False)
+        # Precoloring examines exactly precolor_scan_count positions per call.
+        x.clear_color_cache()
+        x.precolor_positions = None
+        x.precolor_scan_count = 1
+        self.assertEqual(x.next_precolor_job().p, p1)
+        self.assertIsNone(x.next_precolor_job())  # p2 is the selected node.
+    #@+node:ekr.20211109083231.16: *3* TestColorizer.test_pygments_legacy_format
+    def test_pygments_legacy_format(self):
+        # Create the colorizer without a widget: setTag needs only a highlighter.
+        x = leoColorizer.PygmentsColorizer.__new__(leoColorizer.PygmentsColorizer)
+        formats = []
+
+        class Highlighter:
+            def setFormat(self, i, length, format):
+                formats.append((i, length, format))
+
+        x.highlighter = Highlighter()
+        x.formats_dict = {'keyword': 'keyword-format'}
+        x.n_setTag = x.tagCount = 0
+        x.setLegacyFormat(0, 3, 'keyword', 'def spam():')
+        self.assertEqual(formats, [(0, 3, 'keyword-format')])
+        self.assertEqual(x.format_runs, None)
+    #@+node:ekr.20211109082249.4: *3* TestColorizer.test_compile_ruleset
+    def test_compile_ruleset(self):
+        c = self.c
+        if not leoColorizer.QtWidgets:
+            self.skipTest('no qt')
+        wrapper = c.frame.body.wrapper
+        widget = c.frame.body.widget
+        x = leoColorizer.JEditColorizer(c, widget, wrapper)
+        x.init_mode('python')
+        ruleset = x.compile_ruleset(x.rulesDict)
+        self.assertTrue(ruleset is x.compile_ruleset(x.rulesDict))
+        # Characters without rules.
+        self.assertEqual(ruleset.skip_pat.match('(): pass', 0).end(), 4)
+        # Operators.
+        pattern, kinds, names = ruleset.seq_dict['>']
+        m = pattern.match('a >= b', 2)
+        self.assertEqual(m.end(), 4)
+        self.assertEqual(kinds[m.lastindex - 1], 'operator')
+        # Keywords.
+        self.assertTrue('d' in ruleset.keyword_chars)
+        # Strings and comments.
+        self.assertFalse('"' in ruleset.seq_dict)
+        self.assertFalse('#' in ruleset.seq_dict)
+        # Changing rules invalidates all compiled rulesets.
+        x.set_wikiview_patterns([], [])
+        self.assertFalse(x.compiled_rulesets)
     #@+node:ekr.20210905170507.5: *3* TestColorizer.test_colorizer_Actionscript
     def test_colorizer_Actionscript(self):
         text = textwrap.dedent("""\
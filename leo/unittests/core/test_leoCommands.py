@@ -112,6 +112,82 @@ class TestCommands(LeoUnitTest):
         c = self.c
         errors = c.checkOutline()
         self.assertEqual(errors, 0)
+    #@+node:ekr.20211109082917.2: *3* TestCommands.test_c_checkOutline_links
+    def test_c_checkOutline_links(self):
+        c, p = self.c, self.c.p
+        self.assertEqual(c.checkOutline(check_links=True), 0)
+        # Deleting a node that contains a clone leaves no stale links.
+        child = p.insertAsLastChild()
+        grand_child = child.insertAsLastChild()
+        clone = grand_child.clone()
+        clone.moveToLastChildOf(p)
+        c.deletePositionsInList([child])
+        self.assertFalse(clone.isCloned())
+        self.assertEqual(c.checkOutline(check_links=True), 0)
+        # Observers see only touched vnodes, and only while observing.
+        other = c.addVnodeObserver()
+        touched = c.addVnodeObserver()
+        c.removeVnodeObserver(touched)
+        self.assertEqual(c.vnode_observers, [other])  # Not the equal set.
+        c.removeVnodeObserver(other)
+        touched = c.addVnodeObserver()
+        v = p.insertAsLastChild().v
+        c.removeVnodeObserver(touched)
+        self.assertTrue(v in touched)
+        self.assertEqual(c.checkOutline(vnodes=touched), 0)
+        p.insertAsLastChild()
+        self.assertEqual(len(touched), 2)
+        # Only status observers see changed dirty bits.
+        touched = c.addVnodeObserver()
+        content = c.addVnodeObserver(status=False)
+        v.setDirty()
+        c.removeVnodeObserver(touched)
+        c.removeVnodeObserver(content)
+        self.assertEqual((touched, content), ({v}, set()))
+        self.assertEqual(c.status_observers, [])
+        # A parent link without a child link.
+        v.parents.append(p.v)
+        self.assertEqual(c.checkOutline(check_links=True), 1)
+        self.assertEqual(c.checkOutline(vnodes=[v]), 1)
+        v.parents.remove(p.v)
+        # A vnode that is its own ancestor.
+        v.children.append(p.v)
+        p.v.parents.append(v)
+        self.assertEqual(c.checkOutline(check_links=True), 1)
+        self.assertEqual(c.checkOutline(vnodes=[v]), 1)
+        v.children.remove(p.v)
+        p.v.parents.remove(v)
+        self.assertEqual(c.checkOutline(check_links=True), 0)
+    #@+node:ekr.20211109083231.12: *3* TestCommands.test_c_undoableDeletePositions_nested
+    def test_c_undoableDeletePositions_nested(self):
+        c, p, u = self.c, self.c.p, self.c.undoer
+        # p.next() contains child, which contains a clone of the last child of sib.
+        parent = p.insertAfter()
+        child = parent.insertAsLastChild()
+        sib = parent.insertAsLastChild()
+        grand_child = child.insertAsLastChild()
+        grand_child.insertAsLastChild()
+        clone = grand_child.clone()
+        clone.moveToLastChildOf(sib)
+        child2 = sib.insertAsLastChild()
+        child2.clone().moveToLastChildOf(p)
+
+        def links():
+            return {v: sorted(z.gnx for z in v.parents) for v in c.all_unique_nodes()}
+
+        positions = [z.copy() for z in c.all_positions()]
+        old_links = links()
+        c.undoableDeletePositions([parent, child, clone])
+        self.assertEqual(c.checkOutline(check_links=True), 0)
+        self.assertEqual(child2.v.parents, [p.v])
+        self.assertEqual(grand_child.v.parents, [])
+        for i in range(2):
+            u.undo()
+            self.assertEqual(c.checkOutline(check_links=True), 0)
+            self.assertEqual(positions, list(c.all_positions()))
+            self.assertEqual(old_links, links())
+            u.redo()
+            self.assertEqual(c.checkOutline(check_links=True), 0)
     #@+node:ekr.20210901140645.15: *3* TestCommands.test_c_checkPythonCode
     def test_c_checkPythonCode(self):
         c = self.c
@@ -127,6 +203,27 @@ class TestCommands(LeoUnitTest):
         """)
         result = c.checkPythonCode(event=None, checkOnSave=False, ignoreAtIgnore=True)
         self.assertEqual(result, 'error')
+    #@+node:ekr.20211109063253.1: *3* TestCommands.test_c_compactOutline
+    def test_c_compactOutline(self):
+        c, p = self.c, self.c.p
+        child1 = p.insertAsLastChild()
+        child2 = p.insertAsLastChild()
+        child1.h = ''.join(['dup', 'licate'])
+        child2.h = ''.join(['dup', 'licate'])
+        self.assertFalse(child1.h is child2.h)
+        child1.v.u  # Creates an empty uA.
+        child2.v.u['unit_test'] = 'abc'
+        clone = child2.clone()
+        n = len(list(c.all_unique_nodes()))
+        positions = [z.copy() for z in c.all_positions()]
+        self.assertEqual(c.compactOutline(), n + 1)  # Includes the hidden root.
+        # The outline has not changed.
+        self.assertEqual(positions, list(c.all_positions()))
+        self.assertTrue(clone.isCloned())
+        self.assertTrue(child1.h is child2.h)
+        self.assertFalse(hasattr(child1.v, 'unknownAttributes'))
+        self.assertEqual(child2.v.u, {'unit_test': 'abc'})
+        self.assertEqual(c.checkOutline(), 0)
     #@+node:ekr.20210901140645.7: *3* TestCommands.test_c_config_initIvar_sets_commander_ivars
     def test_c_config_initIvar_sets_commander_ivars(self):
         c = self.c
@@ -191,6 +288,33 @@ class TestCommands(LeoUnitTest):
             i2, j2 = w.getSelectionRange()
             self.assertTrue(i2 < j2, msg=f"i: {i}, j: {j}")
             
+    #@+node:ekr.20211109072123.1: *3* TestCommands.test_c_gnx2position
+    def test_c_gnx2position(self):
+        c = self.c
+        self.assertEqual(c.gnx2position('no-such-gnx'), None)
+        for p in c.all_positions():
+            p2 = c.gnx2position(p.gnx)
+            self.assertEqual(p2, p)
+            self.assertTrue(c.positionExists(p2))
+        # Clones.
+        parent = c.rootPosition().insertAfter()
+        p = parent.insertAsLastChild()
+        clone = p.clone()
+        clone.moveToLastChildOf(c.rootPosition())
+        positions = c.gnx2positions(p.gnx)
+        self.assertEqual(len(positions), 2)
+        self.assertTrue(all(z.v == p.v for z in positions))
+        # The first clone in outline order, not the clone under v.parents[0].
+        first = next(z for z in c.all_positions() if z.v == p.v)
+        self.assertEqual(first, clone)
+        self.assertEqual(c.gnx2position(p.gnx), first)
+        # Deleted nodes.
+        child = parent.insertAsLastChild()
+        grand_child = child.insertAsLastChild()
+        gnx = grand_child.gnx
+        child.doDelete()
+        self.assertEqual(c.gnx2position(gnx), None)
+        self.assertEqual(c.gnx2positions(gnx), [])
     #@+node:ekr.20210906075242.9: *3* TestCommands.test_c_hiddenRootNode_fileIndex
     def test_c_hiddenRootNode_fileIndex(self):
         c = self.c
@@ -4,6 +4,10 @@
 #@@first
 """Tests of leoExternalFiles.py"""
 
+import os
+import sys
+import tempfile
+import unittest
 from leo.core import leoGlobals as g
 import leo.core.leoApp as leoApp
 from leo.core.leoTest2 import LeoUnitTest
@@ -31,6 +35,93 @@ class TestExternalFiles(LeoUnitTest):
         efc = g.app.externalFilesController
         for i in range(100):
             efc.on_idle()
+    #@+node:ekr.20211109060037.1: *3* TestExternalFiles.test_watcher
+    @unittest.skipIf(not sys.platform.startswith('linux'), 'requires inotify')
+    def test_watcher(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = os.path.realpath(directory)
+            path = os.path.join(directory, 'watched.py')
+            other_path = os.path.join(directory, 'other.py')
+            for z in (path, other_path):
+                with open(z, 'w') as f:
+                    f.write('# initial\n')
+            watcher = leoExternalFiles.InotifyWatcher()
+            try:
+                watcher.add_path(path)
+                self.assertEqual(watcher.changed_paths(), set())
+                for z in (path, other_path):
+                    with open(z, 'w') as f:
+                        f.write('# changed\n')
+                self.assertEqual(watcher.changed_paths(), {path})
+                self.assertEqual(watcher.changed_paths(), set())
+            finally:
+                watcher.close()
+    #@+node:ekr.20211109083231.3: *3* TestExternalFiles.test_watcher_path_d
+    @unittest.skipIf(not sys.platform.startswith('linux'), 'requires inotify')
+    def test_watcher_path_d(self):
+        c = self.c
+        efc = g.app.externalFilesController
+        with tempfile.TemporaryDirectory() as directory:
+            directory = os.path.realpath(directory)
+            path = os.path.join(directory, 'watched.py')
+            other_path = os.path.join(directory, 'other.py')
+            for z in (path, other_path):
+                with open(z, 'w') as f:
+                    f.write('# initial\n')
+            c.rootPosition().h = f"@clean {path}"
+            efc.watcher = leoExternalFiles.InotifyWatcher()
+            efc.watcher_inited = True
+            efc.enabled_d[c] = True
+            g.app.windowList.append(c.frame)
+            try:
+                efc.idle_check_watcher()
+                self.assertEqual(list(efc.path_d), [path])
+                # Changes to watched files of no @<file> node do not rescan outlines.
+                registered = []
+                efc.register_commander = registered.append
+                efc.watcher.add_path(other_path)
+                with open(other_path, 'w') as f:
+                    f.write('# changed\n')
+                efc.idle_check_watcher()
+                self.assertEqual(registered, [])
+                del efc.register_commander
+                # Later registrations rescan only changed subtrees.
+                c.all_unique_positions = None
+                p = c.rootPosition().insertAfter()
+                p.h = f"@clean {other_path}"
+                c.rootPosition().clearDirty()
+                efc.register_commander(c)
+                self.assertEqual(sorted(efc.path_d), sorted([path, other_path]))
+                self.assertEqual(efc.touched_d[c], set())
+                p.doDelete()
+                efc.register_commander(c)
+                self.assertEqual(list(efc.path_d), [path])
+                del c.all_unique_positions
+                # The watcher queues only changed open-with files.
+                efc.files = [
+                    leoExternalFiles.ExternalFile(c, '.py', c.rootPosition(), z, 0)
+                    for z in (path, other_path)
+                ]
+                for z in (path, other_path):
+                    efc.watcher.add_path(z)
+                with open(other_path, 'w') as f:
+                    f.write('# changed again\n')
+                efc.idle_check_watcher()
+                self.assertEqual([z.path for z in efc.unchecked_files], [other_path])
+                efc.files, efc.unchecked_files = [], []
+            finally:
+                g.app.windowList.remove(c.frame)
+            # Forget closed commanders.
+            efc.idle_check_watcher()
+            self.assertEqual(efc.path_d, {})
+            self.assertEqual(efc.registered_commanders, set())
+            self.assertEqual(efc.touched_d, {})
+            self.assertEqual(c.vnode_observers, [])
+            # Shutting down closes the watcher.
+            watcher = efc.watcher
+            efc.shut_down()
+            self.assertEqual(watcher.fd, -1)
+            self.assertEqual(efc.watcher, None)
     #@-others
 #@-others
 #@-leo
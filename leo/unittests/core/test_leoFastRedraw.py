@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#@+leo-ver=5-thin
+#@+node:ekr.20211109081758.1: * @file ../unittests/core/test_leoFastRedraw.py
+#@@first
+"""Tests of leoFastRedraw.py"""
+
+from leo.core.leoTest2 import LeoUnitTest
+from leo.core.leoFastRedraw import FastRedraw
+
+#@+others
+#@+node:ekr.20211109081758.2: ** class TestFastRedraw (LeoUnitTest)
+class TestFastRedraw(LeoUnitTest):
+    """Test cases for leoFastRedraw.py"""
+    #@+others
+    #@+node:ekr.20211109081758.3: *3* TestFastRedraw.check_opcodes
+    def check_opcodes(self, a, b, opcodes):
+        """Check that opcodes turn a into b."""
+        i, j, result = 0, 0, []
+        for tag, i1, i2, j1, j2 in opcodes:
+            self.assertEqual((i, j), (i1, j1))
+            if tag == 'equal':
+                self.assertEqual(a[i1:i2], b[j1:j2])
+            result.extend(b[j1:j2])
+            i, j = i2, j2
+        self.assertEqual((i, j), (len(a), len(b)))
+        self.assertEqual(result, b)
+    #@+node:ekr.20211109081758.4: *3* TestFastRedraw.test_flatten_outline
+    def test_flatten_outline(self):
+        c = self.c
+        self.create_test_outline()
+        redrawer = FastRedraw()
+        for p in c.all_positions():
+            p.contract()
+        a = redrawer.flatten_outline(c)
+        self.assertEqual(len(a), len(list(c.rootPosition().self_and_siblings())))
+        for p in c.all_positions():
+            p.expand()
+        b = redrawer.flatten_outline(c)
+        self.assertEqual(len(b), len(list(c.all_positions())))
+        opcodes = redrawer.get_opcodes(a, b)
+        self.check_opcodes(a, b, opcodes)
+        # Expanding nodes only inserts lines.
+        self.assertEqual(set(z[0] for z in opcodes), {'equal', 'insert'})
+        self.assertEqual(redrawer.make_redraw_list(b, b), [])
+        self.assertTrue(redrawer.make_redraw_list(a, b))
+    #@+node:ekr.20211109081758.5: *3* TestFastRedraw.test_get_opcodes
+    def test_get_opcodes(self):
+        redrawer = FastRedraw()
+        a = [f"0:gnx{i}:h{i}\n" for i in range(20)]
+        table = (
+            # Move one line down.
+            (a[:2] + a[3:15] + a[2:3] + a[15:],
+                [('delete', 2, 3, 2, 2), ('insert', 15, 15, 14, 15)]),
+            # Move one line up.
+            (a[:2] + a[15:16] + a[2:15] + a[16:],
+                [('insert', 2, 2, 2, 3), ('delete', 15, 16, 16, 16)]),
+            # Change a headline.
+            (a[:4] + ['0:gnx4:changed\n'] + a[5:], [('replace', 4, 5, 4, 5)]),
+            # Delete two lines.
+            (a[:4] + a[6:], [('delete', 4, 6, 4, 4)]),
+            # Insert a line.
+            (a[:4] + ['1:new:new\n'] + a[4:], [('insert', 4, 4, 4, 5)]),
+        )
+        for b, expected in table:
+            opcodes = redrawer.get_opcodes(a, b)
+            self.check_opcodes(a, b, opcodes)
+            changes = [z for z in opcodes if z[0] != 'equal']
+            self.assertEqual(changes, expected)
+        # Multiple changes.
+        b = a[:1] + ['0:gnx1:changed\n'] + a[3:10] + ['0:new:new\n'] + a[12:] + a[2:3]
+        opcodes = redrawer.get_opcodes(a, b)
+        self.check_opcodes(a, b, opcodes)
+        self.assertEqual(redrawer.get_opcodes(a, a), [('equal', 0, 20, 0, 20)])
+        self.assertEqual(redrawer.get_opcodes([], a), [('insert', 0, 0, 0, 20)])
+        # Move a changed node up past a sibling with many expanded descendants.
+        big = ['0:top:top\n', '0:big:big\n']
+        big.extend(f"1:child{i}:child{i}\n" for i in range(1000))
+        big.extend(['0:clean:clean\n', '0:bottom:bottom\n'])
+        b = big[:1] + ['0:clean:dirty\n'] + big[1:-2] + big[-1:]
+        opcodes = redrawer.get_opcodes(big, b)
+        self.check_opcodes(big, b, opcodes)
+        changes = [z for z in opcodes if z[0] != 'equal']
+        self.assertEqual(changes, [('insert', 1, 1, 1, 2), ('delete', 1002, 1003, 1003, 1003)])
+    #@-others
+#@-others
+#@-leo
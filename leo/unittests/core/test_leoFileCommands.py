@@ -8,6 +8,7 @@ Tests of leoFileCommands.py.
 test-file-commands runs these tests.
 """
 
+import io
 import leo.core.leoFileCommands as leoFileCommands
 from leo.core.leoTest2 import LeoUnitTest
 
@@ -103,6 +104,78 @@ class TestFileCommands(LeoUnitTest):
         self.assertEqual(len(s), 4)
         s = s.translate(table)
         self.assertEqual(len(s), 2)
+    #@+node:ekr.20211109062625.1: *3* TestFileCommands.test_fast_readWithPullParser
+    def test_fast_readWithPullParser(self):
+        c, root = self.c, self.root_p
+        fc = c.fileCommands
+        # Create clones, uA's and a body with an invalid character.
+        child = root.insertAsLastChild()
+        child.h = 'child'
+        child.b = 'child body' + chr(0) + '\n'
+        child.v.unknownAttributes = {'unit_test': 'abc'}
+        grand_child = child.insertAsLastChild()
+        grand_child.h = 'grand child'
+        grand_child.b = 'grand child body\n'
+        clone = child.clone()
+        clone.moveToLastChildOf(root)
+        s = fc.outline_to_clipboard_string(root)
+        # Read s with both readers, using tiny chunks.
+        reader = leoFileCommands.FastRead(c, {})
+        reader.chunk_size = 7
+        hidden_v, g_element = reader.readWithPullParser('test', io.StringIO(s))
+        hidden_v2 = leoFileCommands.FastRead(c, {}).readFileFromClipboard(s)
+
+        def dump(v):
+            return [v.gnx, v.h, v.b, getattr(v, 'unknownAttributes', None),
+                [dump(z) for z in v.children]]
+
+        self.assertEqual(dump(hidden_v), dump(hidden_v2))
+        # Check the clones and the translated body.
+        root_v = hidden_v.children[0]
+        child_v, clone_v = root_v.children[-2:]
+        self.assertTrue(child_v is clone_v)
+        self.assertEqual(child_v.parents, [root_v, root_v])
+        self.assertEqual(child_v.b, 'child body\n')
+        self.assertEqual(child_v.unknownAttributes, {'unit_test': 'abc'})
+        self.assertEqual(child_v.children[0].h, 'grand child')
+    #@+node:ekr.20211109083231.4: *3* TestFileCommands.test_fast_readWithPullParser_errors
+    def test_fast_readWithPullParser_errors(self):
+        c = self.c
+        # #1581: <v> elements without 't' attributes are distinct vnodes.
+        s = (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<leo_file><vnodes>\n'
+            '<v><vh>a</vh></v>\n'
+            '<v><vh>b</vh></v>\n'
+            '</vnodes><tnodes></tnodes></leo_file>\n'
+        )
+        gnx2vnode = {}
+        hidden_v, g_element = leoFileCommands.FastRead(c, gnx2vnode).readWithPullParser('test', io.StringIO(s))
+        a, b = hidden_v.children
+        self.assertEqual((a.h, b.h), ('a', 'b'))
+        self.assertFalse(a is b)
+        self.assertTrue(a.gnx and b.gnx and a.gnx != b.gnx)
+        self.assertFalse(None in gnx2vnode)
+        # A parse failure removes all new vnodes and restores all old vnodes.
+        old_v = a
+        old_gnx2vnode = dict(gnx2vnode)
+        old_parents = old_v.parents[:]
+        s = (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<leo_file><vnodes>\n'
+            f'<v t="{old_v.gnx}"><vh>a</vh></v>\n'
+            '<v t="ekr.20211109083231.99"><vh>new</vh></v>\n'
+            '</vnodes><tnodes>\n'
+            f'<t tx="{old_v.gnx}">new body</t>\n'
+            '</tnodes>\n'
+            '<unclosed>\n'
+        )
+        reader = leoFileCommands.FastRead(c, gnx2vnode)
+        hidden_v, g_element = reader.readWithPullParser('test', io.StringIO(s))
+        self.assertEqual(hidden_v, None)
+        self.assertEqual(gnx2vnode, old_gnx2vnode)
+        self.assertEqual(old_v.parents, old_parents)
+        self.assertEqual(old_v.b, '')
     #@-others
 #@-others
 #@-leo
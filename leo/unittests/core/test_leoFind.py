@@ -262,6 +262,77 @@ class TestFind(LeoUnitTest):
         settings.find_text = 'not-found-xyzzy'
         x.do_find_all(settings)
 
+    #@+node:ekr.20211109065354.1: *4* TestFind.find-all (search index)
+    def test_find_all_with_search_index(self):
+        c, settings, x = self.c, self.settings, self.x
+        table = (
+            # find_text, pattern_match, whole_word.
+            ('def', False, True),
+            ('ild3', False, False),
+            ('v1 = 3', False, False),
+            (r'def (\w+)\(', True, False),
+            (r'top[14]|child', True, False),
+            (r'(?:ild)3', True, False),
+            (r'(?P<name>op)\d', True, False),
+            ('not-found-xyzzy', False, False),
+        )
+        for find_text, pattern_match, whole_word in table:
+            results = []
+            for use_find_index in (False, True):
+                c.selectPosition(c.rootPosition())
+                x.findAllUniqueFlag = False
+                x.unique_matches = set()
+                x.use_find_index = use_find_index
+                settings.find_text = find_text
+                settings.ignore_case = False
+                settings.node_only = False
+                settings.pattern_match = pattern_match
+                settings.suboutline_only = False
+                settings.whole_word = whole_word
+                results.append(x.do_find_all(settings))
+                found = c.lastTopLevel()
+                if found.h.startswith('Found All:'):
+                    found.doDelete()
+            self.assertEqual(results[0], results[1], msg=find_text)
+        # The index narrows the search.
+        si = x.search_index
+        self.assertEqual(si.candidates('child3', False, False).vnodes, {g.findNodeAnywhere(c, 'child 3').v})
+        self.assertEqual(si.candidates('colou?r', True, False).vnodes, set())
+        self.assertEqual(si.candidates('a|b', True, False), None)
+        # The index sees changed nodes when they are visited.
+        p = c.rootPosition()
+        p.b = 'xyzzy'
+        candidates = si.candidates('xyzzy', False, True)
+        self.assertEqual(candidates.vnodes, set())
+        self.assertTrue(p.v in candidates)
+        self.assertFalse(p.next().v in candidates)
+        self.assertEqual(si.candidates('xyzzy', False, True).vnodes, {p.v})
+        # Plain searches use the find text's escapes.
+        p.b = 'foo\nbar'
+        x.use_find_index = True
+        x.find_text, x.pattern_match, x.whole_word = r'foo\nbar', False, False
+        self.assertTrue(p.v in x.compute_candidates())
+    #@+node:ekr.20211109083231.8: *4* TestFind.search index: required_literals
+    def test_search_index_required_literals(self):
+        si = self.x.search_index
+        table = (
+            (r'def (\w+)\(', ['def ']),
+            (r'colou?r', ['colo', 'r']),
+            (r'(?:foo)bar', ['foo', 'bar']),
+            (r'(?P<name>abc)\d', ['abc']),
+            (r'(?P<name>a)x(?P=name)y', ['a', 'x', 'y']),
+            (r'foo(?=bar)', ['foo']),
+            (r'foo(?!bar)', ['foo']),
+            (r'(?<=bar)foo', ['foo']),
+            (r'(?<!bar)foo', ['foo']),
+            (r'(?i)foo', ['foo']),
+            (r'(?i:foo)', ['foo']),
+            (r'(?#comment)foo', ['foo']),
+            (r'(?x)f o o', []),
+            (r'(?(1)a|b)', []),
+        )
+        for pattern, expected in table:
+            self.assertEqual(si.required_literals(pattern), expected, msg=pattern)
     #@+node:ekr.20210110073117.65: *4* TestFind.find-def
     def test_find_def(self):
         settings, x = self.settings, self.x
@@ -180,6 +180,44 @@ class TestGlobals(LeoUnitTest):
         self.assertEqual(d.get('encoding'), 'utf-8')
         self.assertEqual(d.get('comment'), 'a b c')
         assert not d.get('path'), d.get('path')
+    #@+node:ekr.20211109054113.1: *3* TestGlobals.test_g_get_directives_dict_uses_cache
+    def test_g_get_directives_dict_uses_cache(self):
+        c = self.c
+        p = c.p
+        cache = c.directivesCache
+        p.b = '@language python\n@tabwidth -8\n'
+        d = g.get_directives_dict(p)
+        self.assertEqual(d.get('tabwidth'), '-8')
+        misses = cache.misses
+        # Changing the returned dict must not change the cache.
+        d['tabwidth'] = '-2'
+        d = g.get_directives_dict(p)
+        self.assertEqual(cache.misses, misses)
+        self.assertEqual(d.get('tabwidth'), '-8')
+        # Changing the body invalidates the entry.
+        p.b = '@language python\n@tabwidth -4\n'
+        d = g.get_directives_dict(p)
+        self.assertEqual(cache.misses, misses + 1)
+        self.assertEqual(d.get('tabwidth'), '-4')
+        # So does changing the body directly.
+        p.v._bodyString = '@language python\n@tabwidth -6\n'
+        self.assertEqual(g.get_directives_dict(p).get('tabwidth'), '-6')
+        # And changing the headline.
+        p.h = '@path xyz'
+        self.assertEqual(g.get_directives_dict(p).get('path'), 'xyz')
+        # Purging forgets deleted and changed vnodes.
+        p2 = p.insertAfter()
+        p3 = p2.insertAfter()
+        for z in (p, p2, p3):
+            g.get_directives_dict(z)
+        p2.doDelete()
+        p3.b = '@language c\n'
+        cache.purge()
+        self.assertEqual([key[0] for key in cache.d], [p.v])
+        cache.purge_size = 0
+        self.assertEqual(g.get_directives_dict(p3).get('language'), 'c')
+        self.assertEqual(len(cache.d), 2)
+        self.assertEqual(cache.purge_size, 1000)
     #@+node:ekr.20210905203541.17: *3* TestGlobals.test_g_getDocString
     def test_g_getDocString(self):
         s1 = 'no docstring'
@@ -6,6 +6,7 @@
 
 # pylint: disable=no-member
 from leo.core import leoGlobals as g
+from leo.core import leoNodes
 from leo.core.leoTest2 import LeoUnitTest
 
 #@+others
@@ -866,6 +867,71 @@ class TestNodes(LeoUnitTest):
             result2 = p.v.atAutoRstNodeName(h=s)
             self.assertEqual(result1, expected1, msg=s)
             self.assertEqual(result2, expected2, msg=s)
+    #@+node:ekr.20211109083054.6: *4* TestNodes.test_walk_vnodes
+    def test_walk_vnodes(self):
+        c, p = self.c, self.c.p
+        # Clone a subtree so that unique and non-unique walks differ.
+        clone = p.firstChild().clone()
+        clone.moveToLastChildOf(p.next())
+        c.checkOutline()
+        # Walk all positions.
+        walker = c.walk_vnodes()
+        result = [(walker.position(), level) for v, level in walker]
+        self.assertEqual(result, [(z.copy(), z.level()) for z in c.all_positions()])
+        # Walk unique vnodes.
+        result = [v for v, level in c.walk_vnodes(unique=True)]
+        self.assertEqual(result, list(c.all_unique_nodes()))
+        self.assertEqual(len(result), len(set(result)))
+        # Walk a subtree, including or excluding the root.
+        p2 = p.next()
+        walker = p2.walk_vnodes()
+        result = [(walker.position(), level) for v, level in walker]
+        self.assertEqual(result, [(z.copy(), z.level()) for z in p2.self_and_subtree()])
+        walker = p2.walk_vnodes(include_self=False)
+        self.assertEqual([walker.position() for v, level in walker], list(p2.subtree()))
+        # skip_subtree prunes the walk.
+        walker = c.walk_vnodes()
+        result = []
+        for v, level in walker:
+            result.append(v)
+            walker.skip_subtree()
+        self.assertEqual(result, [z.v for z in c.all_roots(predicate=lambda p: True)])
+        # The walk itself allocates no positions.
+        n = g.app.positions
+        for v, level in c.walk_vnodes():
+            pass
+        self.assertEqual(g.app.positions, n)
+        # Null positions have no subtrees.
+        null = leoNodes.Position(None)
+        self.assertEqual(list(null.walk_vnodes()), [])
+        for generator in (
+            null.self_and_subtree, null.subtree, null.nodes,
+            null.unique_nodes, null.unique_subtree,
+        ):
+            self.assertEqual(list(generator()), [], msg=generator.__name__)
+        # Callers may move the positions yielded with copy=False.
+
+        def move(p):
+            if p.hasChildren():
+                p.moveToLastChild()
+
+        for generator, p in (
+            (c.all_positions, c.rootPosition()),
+            (c.all_unique_positions, c.rootPosition()),
+            (p2.self_and_subtree, p2.copy()),
+        ):
+            expected = []
+            after = p.nodeAfterTree() if generator == p2.self_and_subtree else None
+            while p and p != after:
+                expected.append(p.copy())
+                move(p)
+                p.moveToThreadNext()
+            result = []
+            for p in generator(copy=False):
+                result.append(p.copy())
+                move(p)
+            self.assertEqual(result, expected, msg=generator.__name__)
+            self.assertNotEqual(result, list(generator()), msg=generator.__name__)
     #@-others
 #@-others
 
@@ -7,6 +7,7 @@
 import textwrap
 from leo.core import leoGlobals as g
 from leo.core.leoTest2 import LeoUnitTest
+from leo.core.leoUndo import SpilledText, UndoText
 assert g
 
 # pylint: disable=no-member
@@ -361,6 +362,70 @@ class TestUndo(LeoUnitTest):
         c.undoer.undo()
         c.undoer.redo()
         self.assertEqual(original.b, original_s)
+    #@+node:ekr.20211109082426.14: *3* TestUndo.test_undo_memory_budget
+    def test_undo_memory_budget(self):
+        c, p, u = self.c, self.c.p, self.c.undoer
+        w = c.frame.body.wrapper
+        p.b = ''.join(f"line {i}\n" for i in range(1000))
+        u.clearUndoState()
+        bodies = [p.b]
+        for i in range(20):
+            bunch = u.beforeChangeBody(p)
+            p.v.b = p.b.replace(f"line {i * 10}\n", f"changed {i}\n")
+            w.setAllText(p.v.b)
+            u.afterChangeBody(p, 'Change Body', bunch)
+            bodies.append(p.b)
+        # Only the present body appears in full.
+        self.assertTrue(all(isinstance(z.oldBody, UndoText) for z in u.beads))
+        self.assertTrue(all(isinstance(z.newBody, UndoText) for z in u.beads[:-1]))
+        self.assertTrue(u.beads[-1].newBody is p.b)
+        self.assertLess(sum(u.beadSize(z) for z in u.beads), 2 * len(p.b))
+        for i in range(20, 0, -1):
+            u.undo()
+            self.assertEqual(p.b, bodies[i - 1])
+        for i in range(1, 21):
+            u.redo()
+            self.assertEqual(p.b, bodies[i])
+        # Spill all beads but the present bead.
+        u.memory_budget, u.spill_to_disk = 1000, True
+        u.cutStackToBudget()
+        self.assertEqual(len(u.beads), 20)
+        self.assertTrue(isinstance(u.beads[0].oldBody, SpilledText))
+        for i in range(20, 0, -1):
+            u.undo()
+            self.assertEqual(p.b, bodies[i - 1])
+        for i in range(1, 21):
+            u.redo()
+            self.assertEqual(p.b, bodies[i])
+        # Discard all beads but the present bead.
+        u.spill_to_disk = False
+        u.cutStackToBudget()
+        self.assertEqual((len(u.beads), u.bead), (1, 0))
+        self.assertEqual(u.discarded_beads, 19)
+        u.undo()
+        self.assertEqual(p.b, bodies[19])
+        self.assertFalse(u.canUndo())
+    #@+node:ekr.20211109083231.18: *3* TestUndo.test_undo_memory_budget_prunes_live_texts
+    def test_undo_memory_budget_prunes_live_texts(self):
+        c, p, u = self.c, self.c.p, self.c.undoer
+        w = c.frame.body.wrapper
+        p2 = p.insertAfter()
+        p2.b = 'p2 body\n' * 100
+        p.b = 'p body\n' * 100
+        u.clearUndoState()
+        for p3 in (p2, p):
+            c.selectPosition(p3)
+            bunch = u.beforeChangeBody(p3)
+            p3.v.b = p3.b + 'changed\n'
+            w.setAllText(p3.v.b)
+            u.afterChangeBody(p3, 'Change Body', bunch)
+        self.assertTrue(p.v in u.live_texts and p2.v in u.live_texts)
+        # Discard p2's bead.
+        u.memory_budget = 10
+        u.cutStackToBudget()
+        self.assertEqual(len(u.beads), 1)
+        self.assertTrue(p.v in u.live_texts)
+        self.assertFalse(p2.v in u.live_texts)
     #@-others
 #@-others
 #@-leo
@@ -2,8 +2,10 @@
 #@+node:ekr.20210820203000.1: * @file ../unittests/core/test_leoserver.py
 """Unit tests for leo/core/leoserver.py"""
 
+import asyncio
 import json
 import os
+import threading
 import leo.core.leoserver as leoserver
 from leo.core.leoTest2 import LeoUnitTest
 
@@ -134,6 +136,176 @@ class TestLeoServer(LeoUnitTest):
                             print(f"Exception in {tag}: {method_name!r} {e}")
         finally:
             server.close_file({"forced": True})
+    #@+node:ekr.20211109071632.1: *3* TestLeoServer.test_batch
+    def test_batch(self):
+        server = self.server
+        test_dot_leo = g.os_path_finalize_join(g.app.loadDir, '..', 'test', 'test.leo')
+        self._request("!open_file", {"log": False, "filename": test_dot_leo})
+        try:
+            c = server.c
+            gnxs = [p.gnx for p in c.all_unique_positions()][:3]
+            actions = [{"action": "!get_body", "param": {"gnx": gnx}} for gnx in gnxs]
+            answer = self._request("!batch", {"log": False, "actions": actions})
+            self.assertFalse("error" in answer)
+            self.assertEqual(answer["id"], self.request_number)
+            self.assertEqual(
+                [z["body"] for z in answer["results"]],
+                [c.fileCommands.gnxDict[gnx].b for gnx in gnxs])
+            # Errors stop the batch.
+            actions.insert(1, {"action": "!error"})
+            answer = self._request("!batch", {"log": False, "actions": actions})
+            self.assertEqual(answer["index"], 1)
+            self.assertEqual(len(answer["results"]), 1)
+            # Batches don't swallow shut down requests.
+
+            def shut_down(param):
+                raise leoserver.TerminateServer("client requested shut down")
+
+            server.shut_down = shut_down
+            try:
+                with self.assertRaises(leoserver.TerminateServer):
+                    server.batch({"actions": [{"action": "!shut_down"}]})
+            finally:
+                del server.shut_down
+        finally:
+            server.close_file({"forced": True})
+    #@+node:ekr.20211109071809.1: *3* TestLeoServer.test_message_framing
+    def test_message_framing(self):
+        d = {"id": 1, "action": "!get_version", "param": {"text": "abc" * 100}}
+        s = json.dumps(d)
+        encodings = ['json', 'zlib']
+        if leoserver.msgpack:
+            encodings.append('msgpack')
+        for encoding in encodings:
+            message = leoserver.encode_message(s, encoding)
+            self.assertEqual(leoserver.decode_message(message), (d, encoding))
+        self.assertEqual(leoserver.decode_message(s.encode('utf-8')), (d, 'json'))
+        self.assertTrue(len(leoserver.encode_message(s, 'zlib')) < len(s))
+    #@+node:ekr.20211109071141.1: *3* TestLeoServer.test_get_changes
+    def test_get_changes(self):
+        server = self.server
+        test_dot_leo = g.os_path_finalize_join(g.app.loadDir, '..', 'test', 'test.leo')
+        self._request("!open_file", {"log": False, "filename": test_dot_leo})
+        try:
+            c = server.c
+            # The first request returns only a sequence number.
+            answer = self._request("!get_changes", {"log": False})
+            self.assertTrue(answer.get("full"))
+            seq = answer["seq"]
+            answer = self._request("!get_changes", {"log": False, "seq": seq})
+            self.assertEqual(answer["changes"], {})
+            # Change the headline and body of one node and insert another.
+            p = c.rootPosition()
+            p.h = 'new headline'
+            p.b = 'new body'
+            p2 = p.insertAfter()
+            answer = self._request("!get_changes", {"log": False, "seq": seq})
+            changes = answer["changes"]
+            self.assertEqual(changes["headline"][p.gnx], 'new headline')
+            self.assertEqual(changes["body"][p.gnx], 'new body')
+            self.assertTrue(p2.gnx in changes["headline"])
+            self.assertTrue(answer["root"] in changes["children"])
+            self.assertFalse("deleted" in changes)
+            # Delete the new node.
+            seq2 = answer["seq"]
+            p2.doDelete()
+            answer = self._request("!get_changes", {"log": False, "seq": seq2})
+            self.assertEqual(answer["changes"]["deleted"], [p2.gnx])
+            # Merged changes don't describe deleted nodes.
+            answer = self._request("!get_changes", {"log": False, "seq": seq})
+            changes = answer["changes"]
+            self.assertEqual(changes["deleted"], [p2.gnx])
+            self.assertFalse(p2.gnx in changes["headline"])
+            # UI-only status bits are not changes.
+            seq3 = answer["seq"]
+            p.setMarked()
+            p.expand()
+            answer = self._request("!get_changes", {"log": False, "seq": seq3})
+            self.assertEqual(answer["changes"], {})
+            # Only touched vnodes are compared.
+            log = server.change_logs[c]
+            p.v.clearDirty()
+            self.assertEqual(log.touched, {p.v})
+            answer = self._request("!get_changes", {"log": False, "seq": seq3})
+            self.assertEqual(answer["changes"], {"status": {p.gnx: {"dirty": False}}})
+            # Taking a snapshot does not load lazy bodies.
+            from leo.core.leoAtFile import LazyBodies
+            lazy = LazyBodies(c, 'contents', 'path', p.v)
+            p.v._bodyString = lazy
+            c.touchVnodes([p.v])
+            answer = self._request("!get_changes", {"log": False, "seq": seq3})
+            self.assertEqual(answer["changes"]["body"], {p.gnx: None})
+            self.assertTrue(log.snapshot[p.v][1] is lazy)
+            self.assertTrue(lazy.data is not None)
+            p.v._bodyString = 'new body'
+            # Closing the file stops the log's observer.
+            self.assertTrue(log.touched in c.vnode_observers)
+            server.close_file({"forced": True})
+            self.assertFalse(log.touched in c.vnode_observers)
+            self._request("!open_file", {"log": False, "filename": test_dot_leo})
+            # Unknown sequence numbers require a full refresh.
+            answer = self._request("!get_changes", {"log": False, "seq": seq3 + 10})
+            self.assertTrue(answer.get("full"))
+        finally:
+            server.close_file({"forced": True})
+    #@+node:ekr.20211109072614.1: *3* TestLeoServer.test_run_message
+    def test_run_message(self):
+        server = self.server
+        test_dot_leo = g.os_path_finalize_join(g.app.loadDir, '..', 'test', 'test.leo')
+        self._request("!open_file", {"log": False, "filename": test_dot_leo})
+        try:
+            c = server.c
+            server.current_id = 0
+            threads = []
+            old_do_message = server._do_message
+            si = c.findCommands.search_index
+            old_index_outline = si.index_outline
+
+            def do_message(d):
+                threads.append((threading.current_thread(), server.c))
+                return old_do_message(d)
+
+            def index_outline():
+                threads.append((threading.current_thread(), None))
+                return old_index_outline()
+
+            server._do_message = do_message
+            si.index_outline = index_outline
+            # LeoServer.__init__ added the idle-time task to this loop.
+            loop = asyncio.get_event_loop()
+            try:
+                # Find-all indexes the outline in c's worker thread.
+                d = {"id": 1, "action": "!find_all", "param": {"find_text": "def"}}
+                answer = json.loads(loop.run_until_complete(server._run_message(d)))
+                self.assertEqual(answer["id"], 1)
+                # Other commands run in the main thread.
+                for action in (
+                    '!import_any_file', '!save_file', '-save', '-save-file', '-write-at-file-nodes',
+                ):
+                    self.assertFalse(action in server.threaded_actions, msg=action)
+                d = {"id": 2, "action": "!get_version", "param": {}}
+                answer = json.loads(loop.run_until_complete(server._run_message(d)))
+                self.assertEqual(answer["id"], 2)
+            finally:
+                server._do_message = old_do_message
+                del si.index_outline
+            (thread1, c1), (thread2, c2), (thread3, c3) = threads
+            self.assertNotEqual(thread1, threading.current_thread())
+            self.assertEqual(thread2, threading.current_thread())
+            self.assertEqual(thread3, threading.current_thread())
+            self.assertTrue(c2 == c3 == server.c == c)
+            self.assertFalse(c in server.busy)
+            # Locks belong to the commander that the request targets.
+            index = g.app.commanders().index(c)
+            d = {"id": 3, "action": "!set_opened_file", "param": {"index": index}}
+            self.assertEqual(server._request_commander(d), c)
+            d = {"id": 4, "action": "!open_file", "param": {"filename": test_dot_leo}}
+            self.assertEqual(server._request_commander(d), c)
+            d = {"id": 5, "action": "!open_file", "param": {"filename": "xyzzy.leo"}}
+            self.assertEqual(server._request_commander(d), None)
+        finally:
+            server.close_file({"forced": True})
+        self.assertFalse(c in server.executors)
     #@+node:felix.20210621233316.103: *3* TestLeoServer.test_open_and_close
     def test_open_and_close(self):
         # server = self.server
@@ -104,6 +104,107 @@ class TestPlugins(LeoUnitTest):
             assert p2
             self.assertEqual(p2.v, p.v)
             assert c.positionExists(p2), 'does not exist: %s' % p2
+    #@+node:ekr.20211109065708.1: *3* TestPlugins.test_leofts
+    def test_leofts(self):
+        import leo.plugins.leofts as leofts
+        if not leofts.has_fts5():
+            self.skipTest('Requires FTS5')
+        c = self.c
+        c.mFileName = g.os_path_finalize_join(g.app.loadDir, 'test_leofts.leo')
+        leofts.set_leo(g)
+        g._gnxcache = leofts.GnxCache()
+        fts = leofts.LeoFts(':memory:')
+        g.app.windowList.append(c.frame)
+        try:
+            root = c.rootPosition()
+            root.h = 'Root'
+            child = root.insertAsLastChild()
+            child.h = 'Child'
+            child.b = 'alpha beta\n'
+            fts.index_nodes(c)
+            docs = [c.fileName()]
+            results = fts.search('alpha', docs=docs)
+            self.assertEqual([z['gnx'] for z in results], [child.gnx])
+            self.assertEqual(results[0]['parent'], 'Root')
+            self.assertTrue(results[0]['f'])
+            c2, p2 = g._gnxcache.get_p(child.gnx, c.fileName())
+            self.assertEqual(p2, child)
+            # Only changed nodes are updated.
+            child.b = 'gamma\n'
+            root.b = 'alpha\n'
+            fts.update_nodes(c, [root.gnx])
+            self.assertEqual(len(fts.search('alpha', docs=docs)), 2)
+            self.assertEqual(fts.search('gamma', docs=docs), [])
+            fts.update_nodes(c, [child.gnx])
+            self.assertEqual([z['gnx'] for z in fts.search('alpha', docs=docs)], [root.gnx])
+            self.assertEqual([z['gnx'] for z in fts.search('gamma', docs=docs)], [child.gnx])
+            # Deleted nodes are removed.
+            child.doDelete()
+            fts.update_nodes(c, [])
+            self.assertEqual(fts.search('gamma', docs=docs), [])
+            # Invalid FTS5 queries search for the words.
+            self.assertEqual(len(fts.search('alpha-', docs=docs)), 1)
+            # Opening an outline re-indexes nodes changed while it was closed.
+            root.b = 'delta\n'
+            new = root.insertAsLastChild()
+            new.h = 'epsilon'
+            g._fts = fts
+            leofts.onOpen('open2', {'c': c})
+            self.assertEqual([z['gnx'] for z in fts.search('delta', docs=docs)], [root.gnx])
+            self.assertEqual([z['gnx'] for z in fts.search('epsilon', docs=docs)], [new.gnx])
+            self.assertEqual(fts.search('alpha', docs=docs), [])
+            conn = fts.connect(c.fileName())
+            stored = dict(conn.execute('select gnx, hash from hashes'))
+            self.assertEqual(sorted(stored), sorted(v.gnx for v in c.all_unique_nodes()))
+        finally:
+            fts.close()
+            g.app.windowList.remove(c.frame)
+            g._fts = g._gnxcache = None
+    #@+node:ekr.20211109082603.6: *3* TestPlugins.test_nodetags
+    def test_nodetags(self):
+        import leo.plugins.nodetags as nodetags
+        c = self.c
+        p1 = c.rootPosition().insertAfter()
+        p2 = p1.insertAfter()
+        p3 = p2.insertAfter()
+        p1.v.u['__node_tags'] = {'work/priority', 'home'}
+        tc = nodetags.TagController(c)
+        try:
+            self.assertEqual(sorted(tc.get_all_tags()), ['home', 'work/priority'])
+            tc.add_tag(p2, 'work/long-term')
+            tc.add_tag(p3, 'home')
+            self.assertEqual(tc.sorted_tags, ['home', 'work/long-term', 'work/priority'])
+            self.assertEqual(tc.get_tagged_nodes('home'), [p1, p3])
+            self.assertEqual(tc.get_tagged_nodes('work/*'), [p1, p2])
+            self.assertEqual(tc.get_tagged_nodes('wor'), [p1, p2])  # Like re.match.
+            self.assertEqual(tc.get_tagged_nodes('work/l.*|home'), [p1, p2, p3])
+            self.assertEqual(tc.get_tagged_nodes('w?ork/p'), [p1])
+            self.assertEqual(tc.get_tagged_nodes('xyz'), [])
+            # Queries.
+            all_gnxs = {p.gnx for p in c.all_unique_positions()}
+            table = (
+                ('home&work/*', {p1.gnx}),
+                ('home | work/*', {p1.gnx, p2.gnx, p3.gnx}),
+                ('home-work/*', {p3.gnx}),
+                ('home^work/*', {p2.gnx, p3.gnx}),
+                ('!home', all_gnxs - {p1.gnx, p3.gnx}),
+                ('work/*&!home', {p2.gnx}),
+            )
+            for query, expected in table:
+                self.assertEqual(tc.query(query), expected, msg=query)
+            # Removing tags updates the index.
+            tc.remove_tag(p1, 'work/priority')
+            self.assertEqual(tc.sorted_tags, ['home', 'work/long-term'])
+            self.assertEqual(sorted(tc.get_all_tags()), ['home', 'work/long-term'])
+            self.assertEqual(tc.get_tagged_nodes('work/*'), [p2])
+            # Deleted nodes are not found.
+            c.selectPosition(p3)
+            c.deleteOutline()
+            self.assertEqual(tc.get_tagged_nodes('home'), [p1])
+            c.undoer.undo()
+            self.assertEqual(len(tc.get_tagged_nodes('home')), 2)
+        finally:
+            g.unregisterHandler('command2', tc.command2_hook)
     #@+node:ekr.20210909194336.57: *3* TestPlugins.test_regularizeName
     def test_regularizeName(self):
         pc = LeoPluginsController()